@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+from functools import lru_cache
+
+import yaml
+
+from profiling import traced
+
+# =====================
+# Config
+# =====================
+VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o-mini")
+GEN_MODEL = os.getenv("GEN_MODEL", "gpt-4o-mini")
+TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "gpt-4o-transcribe")
+# Nei prompt di generazione: ricetta normalizzata e compatta (recipe_normalizer.py) invece del testo grezzo
+COMPACT_RECIPE_PROMPT = os.getenv("RECIPE_COMPACT_PROMPT", "1") != "0"
+# max_tokens e stop anticipato per variante, dai limiti di frasi del prompt (generation_budget.py)
+TOKEN_BUDGET = os.getenv("GEN_TOKEN_BUDGET", "1") != "0"
+# audio ripulito e compresso prima della trascrizione (audio_preprocess.py)
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") != "0"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RULES_FILE = os.path.join(BASE_DIR, "rules", "registri.yaml")
+SYSTEM_PROMPT_FILE = os.path.join(BASE_DIR, "prompts", "system.txt")
+
+# =====================
+# Risorse caricate una sola volta per processo
+# =====================
+_CLIENT_OVERRIDE = None
+
+@lru_cache(maxsize=None)
+def _default_client():
+    from openai import OpenAI
+    return OpenAI()  # OPENAI_API_KEY da env / Streamlit Secrets
+
+def get_client():
+    return _CLIENT_OVERRIDE if _CLIENT_OVERRIDE is not None else _default_client()
+
+def set_client(client):
+    """Sostituisce il client OpenAI (benchmark, test di carico). None = client reale."""
+    global _CLIENT_OVERRIDE
+    _CLIENT_OVERRIDE = client
+
+@lru_cache(maxsize=None)
+def get_rules():
+    with open(RULES_FILE, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+def get_registri():
+    return get_rules()["registri"]          # dict: nome -> guida
+
+def get_hard_rules():
+    return get_rules()["hard_rules"]        # list[str]
+
+@lru_cache(maxsize=None)
+def get_system_prompt():
+    with open(SYSTEM_PROMPT_FILE, "r", encoding="utf-8") as f:
+        return f.read()
+
+# =====================
+# Helpers
+# =====================
+def _to_data_url(file_bytes: bytes, mime: str) -> str:
+    b64 = base64.b64encode(file_bytes).decode("utf-8")
+    return f"data:{mime};base64,{b64}"
+
+def extract_text_from_image(image_bytes: bytes, mime: str) -> str:
+    data_url = _to_data_url(image_bytes, mime)
+    prompt = (
+        "Estrai e trascrivi fedelmente il testo della ricetta dall'immagine.\n"
+        "Regole:\n"
+        "- Non inventare nulla.\n"
+        "- Mantieni numeri, unità (g, ml), virgole, simboli e 'q.b.'\n"
+        "- Mantieni struttura a righe.\n"
+        "- Se c'è una tabella, rendila in testo con colonne separate da ' | '.\n"
+        "Output: SOLO il testo estratto."
+    )
+
+    def attempt(model):
+        resp = get_client().chat.completions.create(
+            model=model,
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": data_url}},
+                ]
+            }]
+        )
+        return (resp.choices[0].message.content or "").strip()
+
+    from model_router import check_ocr, models_for, route
+    return route("ocr", models_for("ocr", VISION_MODEL), attempt, check_ocr)[0]
+
+@traced("modello: trascrizione")
+def _transcribe(audio_bytes: bytes, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(audio_bytes)
+        tmp_path = tmp.name
+    try:
+        with open(tmp_path, "rb") as f:
+            tr = get_client().audio.transcriptions.create(
+                model=TRANSCRIBE_MODEL,
+                file=f,
+            )
+        return getattr(tr, "text", "") or ""
+    finally:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+
+def transcribe_audio_detailed(audio_bytes: bytes, suffix: str) -> dict:
+    """
+    Trascrizione con report (audio_preprocess.format_audio_report): {"text", "report"}.
+    Se l'audio preparato non dà testo si riprova una volta con l'originale.
+    """
+    if not AUDIO_PREPROCESS:
+        t0 = time.perf_counter()
+        text = _transcribe(audio_bytes, suffix)
+        report = {"original_bytes": len(audio_bytes), "sent_bytes": len(audio_bytes), "used_original": True,
+                  "transcribe_ms": (time.perf_counter() - t0) * 1000}
+        return {"text": text, "report": report}
+
+    from audio_preprocess import prepare_audio
+    prepared = prepare_audio(audio_bytes, suffix)
+    t0 = time.perf_counter()
+    text = _transcribe(prepared.data, prepared.suffix)
+    prepared.report["transcribe_ms"] = (time.perf_counter() - t0) * 1000
+    if not text.strip() and not prepared.report["used_original"]:
+        # il tentativo scartato resta nel report a parte: byte e tempo sono quelli dell'originale
+        t0 = time.perf_counter()
+        text = _transcribe(audio_bytes, suffix)
+        prepared.report.update(
+            used_original=True, reason="trascrizione vuota dell'audio preparato",
+            sent_bytes=len(audio_bytes), discarded_ms=prepared.report["transcribe_ms"],
+            transcribe_ms=(time.perf_counter() - t0) * 1000,
+        )
+    return {"text": text, "report": prepared.report}
+
+def transcribe_audio_bytes(audio_bytes: bytes, suffix: str) -> str:
+    return transcribe_audio_detailed(audio_bytes, suffix)["text"]
+
+def prompt_recipe(ricetta: str) -> str:
+    """Testo ricetta da mettere nei prompt: compatto (default) o così com'è."""
+    if not COMPACT_RECIPE_PROMPT:
+        return ricetta
+    from recipe_normalizer import normalize_recipe
+    return normalize_recipe(ricetta).compact
+
+def build_generation_prompt(ricetta: str, registro: str, out_type: str, length: str) -> str:
+    reg_hint = get_registri()[registro]
+    ricetta = prompt_recipe(ricetta)
+
+    return (f"""
+Sei un copywriter gastronomico specializzato.
+Il tuo compito è scrivere la descrizione di un piatto basandoti sulla ricetta fornita.
+
+COMANDO: Devi generare SOLAMENTE la versione: {out_type} {length}.
+NON generare altre varianti.
+NON generare introduzioni o spiegazioni.
+NON unire più versioni (es. se chiesto Menu, NON fare Cameriere).
+
+REGISTRO RICHIESTO: {registro}
+DESCRIZIONE REGISTRO: {reg_hint}
+(Usa queste regole di stile SOLO per la versione {out_type} {length})
+
+REGOLE HARD (da rispettare sempre):
+- """ + "\n- ".join(get_hard_rules()) + f"""
+
+RICETTA (testo sorgente):
+{ricetta}
+
+OUTPUT ATTESO:
+Scrivi SOLO il testo per {out_type} in formato {length}.
+""").strip()
+
+def build_generation_messages(ricetta: str, registro: str, out_type: str, length: str) -> list:
+    return [
+        {"role": "system", "content": get_system_prompt()},
+        {"role": "user", "content": build_generation_prompt(ricetta, registro, out_type, length)},
+    ]
+
+def _usage(resp) -> dict:
+    usage = getattr(resp, "usage", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+    }
+
+def _stream_until(model: str, messages: list, max_sentences: int, params: dict):
+    """Generazione in stream chiusa appena il testo raggiunge max_sentences frasi."""
+    from generation_budget import SentenceCounter
+    counter = SentenceCounter(max_sentences)
+    usage, chunks, finish_reason = None, 0, None
+    stream = get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **params,
+    )
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = _usage(chunk)
+            if not chunk.choices:
+                continue
+            finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+            delta = chunk.choices[0].delta.content or ""
+            chunks += bool(delta)
+            if counter.feed(delta):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()  # chiude la connessione: il modello smette di generare
+
+    if usage is None:
+        # stream interrotto prima del chunk finale: ~1 token per chunk, prompt stimato dai caratteri
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": chunks, "total_tokens": prompt_tokens + chunks}
+    return counter.text(), usage, counter.stopped(), finish_reason
+
+def _complete(model: str, messages: list, budget, params: dict):
+    if budget and budget.early_stop:
+        return _stream_until(model, messages, budget.max_sentences, params)
+    resp = get_client().chat.completions.create(model=model, messages=messages, **params)
+    choice = resp.choices[0]
+    return (choice.message.content or "").strip(), _usage(resp), False, getattr(choice, "finish_reason", None)
+
+def _generate_once(model: str, messages: list, budget) -> dict:
+    params = {"max_tokens": budget.max_tokens} if budget and budget.max_tokens else {}
+    text, usage, stopped, finish_reason = _complete(model, messages, budget, params)
+    truncated = finish_reason == "length" and not stopped and bool(params)
+    if truncated:
+        # tetto raggiunto prima della fine della frase: testo tagliato, si rifà senza max_tokens
+        text, retry_usage, stopped, finish_reason = _complete(model, messages, budget, {})
+        usage = {k: usage[k] + retry_usage[k] for k in usage}
+    return {"text": text, "usage": usage, "stopped_early": stopped, "truncated_retry": truncated}
+
+def generate_output_detailed(ricetta: str, registro: str, out_type: str, length: str) -> dict:
+    """
+    Come generate_output, ma ritorna anche token usati e latenza:
+    {"text", "usage", "latency_ms", "stopped_early", "truncated_retry", "models"}.
+    I modelli si provano in ordine (model_router.py) finché il testo passa il controllo locale.
+    """
+    from generation_budget import get_budget, record
+    from model_router import check_generation, models_for, route
+    messages = build_generation_messages(ricetta, registro, out_type, length)
+    budget = get_budget(registro, out_type, length) if TOKEN_BUDGET else None
+
+    results = []
+
+    def attempt(model):
+        results.append(_generate_once(model, messages, budget))
+        return results[-1]
+
+    t0 = time.perf_counter()
+    result, attempts = route(
+        "generation",
+        models_for("generation", GEN_MODEL, registro, length),
+        attempt,
+        lambda r: check_generation(r["text"], ricetta, registro, out_type, length),
+    )
+    latency_ms = (time.perf_counter() - t0) * 1000
+    # i token dei tentativi scartati si pagano comunque
+    usage = {k: sum(r["usage"][k] for r in results) for k in result["usage"]}
+
+    record(
+        registro, out_type, length, result["usage"]["completion_tokens"], latency_ms,
+        result["stopped_early"], any(r["truncated_retry"] for r in results),
+    )
+    return dict(result, usage=usage, latency_ms=latency_ms, models=[a["model"] for a in attempts])
+
+def generate_output(ricetta: str, registro: str, out_type: str, length: str) -> str:
+    return generate_output_detailed(ricetta, registro, out_type, length)["text"]
+
+def build_translation_prompt(text: str, language: str, register: str) -> str:
+    return f"""
+Sei un traduttore esperto di menu gastronomici.
+Traduci il seguente testo in {language}.
+Mantieni rigorosamente il tono, lo stile e la formattazione del registro originale: "{register}".
+Non aggiungere spiegazioni o commenti extra.
+
+TESTO DA TRADURRE:
+{text}
+""".strip()
+
+def translate_text(text: str, language: str, register: str) -> str:
+    prompt = build_translation_prompt(text, language, register)
+
+    def attempt(model):
+        resp = get_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+        )
+        return (resp.choices[0].message.content or "").strip()
+
+    from model_router import check_translation, models_for, route
+    return route("translation", models_for("translation", GEN_MODEL), attempt, lambda t: check_translation(t, text))[0]
+
+# =====================
+# Immagini piatto (con cache persistente)
+# =====================
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "dish_images"))
+
+def build_image_prompt(ricetta: str) -> str:
+    return f"""
+Create a plated, finished dish inspired by the following recipe: {ricetta}.
+The dish must be fully prepared and ready to serve.
+Only one single plate visible. Centered composition.
+No ingredients outside the plate. No bowls, no glasses, no cutlery, no table props.
+White porcelain plate or matte black stoneware plate.
+Isolated plate on seamless neutral elegant background (light grey or soft beige).
+Minimalist fine dining plating with generous negative space for menu text.
+Professional studio food photography, soft diffused lighting.
+The entire frame must contain only the plate. Clean background with no texture. Luxury Michelin-star restaurant aesthetic.
+""".strip()
+
+def image_params(model: str) -> dict:
+    """Parametri per modello (minimo indispensabile)."""
+    if model.startswith("gpt-image-"):
+        # GPT Image: size 1024/1536 e quality low/medium/high/auto
+        return {"size": "1024x1024", "quality": "high"}
+    if model == "dall-e-3":
+        return {"size": "1024x1024", "quality": "standard", "response_format": "url"}  # oppure "hd"
+    # dall-e-2
+    return {"size": "512x512", "response_format": "url"}
+
+def max_candidates(model: str) -> int:
+    """Quante immagini il modello accetta in una sola chiamata (dall-e-3 solo 1)."""
+    return 1 if model == "dall-e-3" else 4
+
+def image_cache_key(prompt: str, model: str, size: str, quality: str) -> str:
+    """Chiave su prompt normalizzato (spazi e maiuscole non contano), modello, size e quality."""
+    normalized = " ".join(prompt.split()).lower()
+    raw = json.dumps([normalized, model, size, quality or ""], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def cached_image_paths(key: str, cache_dir: str = None) -> list:
+    """File delle candidate già generate per la chiave, in ordine (0 = principale)."""
+    cache_dir = cache_dir or IMAGE_CACHE_DIR
+    paths = []
+    while True:
+        path = os.path.join(cache_dir, f"{key}_{len(paths)}.png")
+        if not os.path.exists(path):
+            return paths
+        paths.append(path)
+
+def _image_bytes(item) -> bytes:
+    # GPT Image: base64
+    if getattr(item, "b64_json", None):
+        return base64.b64decode(item.b64_json)
+
+    # DALL·E: URL
+    if getattr(item, "url", None):
+        import requests
+        return requests.get(item.url, timeout=30).content
+
+    raise RuntimeError("Risposta immagini inattesa: manca sia b64_json sia url.")
+
+@traced("modello: immagini")
+def generate_dish_images(ricetta: str, model="gpt-image-1.5", n=1, use_cache=True) -> list:
+    """
+    Genera `n` immagini candidate del piatto (una sola chiamata API con n>1).
+
+    Le immagini restano in cache su disco: a parità di prompt/modello/size/quality
+    vengono restituite subito; se ne servono più di quelle in cache si generano
+    solo quelle mancanti. Ritorna la lista dei percorsi (0 = principale).
+    """
+    prompt = build_image_prompt(ricetta)
+    params = image_params(model)
+    key = image_cache_key(prompt, model, params["size"], params.get("quality"))
+
+    paths = cached_image_paths(key) if use_cache else []
+    missing = n - len(paths)
+    if missing <= 0:
+        return paths[:n]
+
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    per_call = max_candidates(model)
+    while missing > 0:
+        batch = min(missing, per_call)
+        response = get_client().images.generate(model=model, prompt=prompt, n=batch, **params)
+        if not response.data:
+            raise RuntimeError(f"Nessuna immagine restituita da {model} (richieste {batch}).")
+        # l'API può restituirne meno di n: si conta quello che è arrivato davvero
+        for item in response.data[:batch]:
+            path = os.path.join(IMAGE_CACHE_DIR, f"{key}_{len(paths)}.png")
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(_image_bytes(item))
+            os.replace(tmp, path)
+            paths.append(path)
+        missing -= min(len(response.data), batch)
+
+    return paths[:n]
+
+def generate_dish_image(ricetta: str, model="gpt-image-1.5", n=1):
+    """
+    Genera l'immagine del piatto in versione ristorante stellato (la principale
+    tra le `n` candidate). Solleva un'eccezione in caso di errore (la UI decide come mostrarlo).
+    """
+    paths = generate_dish_images(ricetta, model=model, n=n)
+    with open(paths[0], "rb") as f:
+        return f.read()
@@ -0,0 +1,294 @@
+"""
+API HTTP (FastAPI) della pipeline di Voce del Piatto, senza Streamlit.
+
+Usa le stesse funzioni di app.py (ai_services, archive_manager, menu_export):
+    POST /ocr               immagine ricetta -> testo
+    POST /transcribe        audio -> testo
+    POST /generate          testi per più registri / lingue (stream=true -> NDJSON)
+    POST /generate/batch    più ricette in una richiesta (stream=true -> NDJSON)
+    POST /image             immagini candidate del piatto (base64)
+    POST /archive           nuova voce in archivio
+    GET  /archive/search    ricerca nell'archivio
+
+Avvio (dalla cartella dell'app, come Streamlit):
+    API_TOKEN=... uvicorn api_server:app --host 0.0.0.0 --port 8000
+
+Le chiamate al modello sono bloccanti: girano in thread (asyncio.to_thread),
+limitate da semafori (API_MAX_TEXT_CONCURRENCY, API_MAX_IMAGE_CONCURRENCY).
+Richieste di generazione identiche in corso nello stesso momento condividono
+un'unica chiamata al modello.
+"""
+import io
+import os
+import hmac
+import json
+import base64
+import asyncio
+import binascii
+import hashlib
+from typing import List, Literal, Optional
+
+from fastapi import Depends, FastAPI, File, Header, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from PIL import Image
+
+import ai_services
+import archive_manager
+from menu_export import search_dishes
+
+API_TOKEN = os.getenv("API_TOKEN", "")
+MAX_TEXT_CONCURRENCY = int(os.getenv("API_MAX_TEXT_CONCURRENCY", "8"))
+MAX_IMAGE_CONCURRENCY = int(os.getenv("API_MAX_IMAGE_CONCURRENCY", "2"))
+MAX_BATCH = int(os.getenv("API_MAX_BATCH", "50"))
+BASE_LANGUAGE = "Italiano"
+
+_text_slots = asyncio.Semaphore(MAX_TEXT_CONCURRENCY)
+_image_slots = asyncio.Semaphore(MAX_IMAGE_CONCURRENCY)
+_inflight = {}  # chiave richiesta -> asyncio.Task condiviso
+
+app = FastAPI(title="Voce del Piatto API", version="1.0")
+
+
+# =====================
+# Auth
+# =====================
+def require_token(authorization: str = Header(default="")):
+    if not API_TOKEN:
+        raise HTTPException(503, "API_TOKEN non configurato sul server.")
+    token = authorization.removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(token, API_TOKEN):
+        raise HTTPException(401, "Token non valido.")
+
+
+# =====================
+# Modelli richieste
+# =====================
+class GenerateRequest(BaseModel):
+    ricetta: str = Field(min_length=1)
+    registri: List[str] = Field(min_length=1)
+    out_type: Literal["Menu", "Cameriere"] = "Menu"
+    length: Literal["Corto", "Lungo"] = "Corto"
+    languages: List[str] = []
+    stream: bool = False
+
+
+class BatchRequest(BaseModel):
+    items: List[GenerateRequest] = Field(min_length=1)
+    stream: bool = False
+
+
+class ImageRequest(BaseModel):
+    ricetta: str = Field(min_length=1)
+    model: str = "gpt-image-1.5"
+    n: int = Field(default=1, ge=1, le=8)
+    use_cache: bool = True
+
+
+class ArchiveRequest(BaseModel):
+    titolo: str = Field(min_length=1)
+    ricetta: str
+    frase: str = ""
+    tags: str = ""
+    image_b64: Optional[str] = None
+
+
+# =====================
+# Esecuzione chiamate bloccanti
+# =====================
+async def _run_limited(slots, fn, *args, **kwargs):
+    async with slots:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def _coalesced(key, fn, *args):
+    """Una sola chiamata al modello per richieste identiche contemporanee."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_limited(_text_slots, fn, *args))
+        _inflight[key] = task
+        task.add_done_callback(lambda _t: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def _key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _validate(req: GenerateRequest):
+    registri = ai_services.get_registri()
+    unknown = [r for r in req.registri if r not in registri]
+    if unknown:
+        raise HTTPException(422, f"Registri sconosciuti: {', '.join(unknown)}")
+
+
+def _combine(base_text, translations, languages):
+    """Stesso formato dell'output in app.py (blocchi '--- LINGUA ---')."""
+    out = base_text
+    for lang in languages:
+        out += f"\n\n--- {lang.upper()} ---\n{translations[lang]}"
+    return out
+
+
+async def _generate_register(req: GenerateRequest, registro, emit=None):
+    ricetta = req.ricetta.strip()
+    base_text = await _coalesced(
+        _key("gen", ricetta, registro, req.out_type, req.length),
+        ai_services.generate_output, ricetta, registro, req.out_type, req.length,
+    )
+    if emit:
+        await emit({"registro": registro, "lingua": BASE_LANGUAGE, "testo": base_text})
+
+    async def translate(lang):
+        text = await _coalesced(_key("tr", base_text, lang, registro), ai_services.translate_text, base_text, lang, registro)
+        if emit:
+            await emit({"registro": registro, "lingua": lang, "testo": text})
+        return lang, text
+
+    translations = dict(await asyncio.gather(*(translate(lang) for lang in req.languages)))
+    return registro, _combine(base_text, translations, req.languages)
+
+
+async def _generate(req: GenerateRequest, emit=None):
+    results = await asyncio.gather(*(_generate_register(req, r, emit) for r in req.registri))
+    return dict(results)
+
+
+def _ndjson(events):
+    async def body():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+async def _stream_generate(req: GenerateRequest):
+    """Eventi man mano che arrivano (testo base e traduzioni), poi il riepilogo."""
+    queue = asyncio.Queue()
+    task = asyncio.ensure_future(_generate(req, emit=queue.put))
+    task.add_done_callback(lambda _t: queue.put_nowait(None))
+    while (event := await queue.get()) is not None:
+        yield event
+    try:
+        yield {"done": True, "outputs": task.result()}
+    except Exception as e:
+        yield {"done": True, "error": str(e)}
+
+
+# =====================
+# Endpoint
+# =====================
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/ocr", dependencies=[Depends(require_token)])
+async def ocr(file: UploadFile = File(...)):
+    data = await file.read()
+    try:
+        text = await _run_limited(_text_slots, ai_services.extract_text_from_image, data, file.content_type or "image/jpeg")
+    except Exception as e:
+        raise HTTPException(502, f"Errore OCR del modello: {e}")
+    return {"text": text}
+
+
+@app.post("/transcribe", dependencies=[Depends(require_token)])
+async def transcribe(file: UploadFile = File(...)):
+    data = await file.read()
+    suffix = os.path.splitext(file.filename or "")[1] or ".wav"
+    try:
+        res = await _run_limited(_text_slots, ai_services.transcribe_audio_detailed, data, suffix)
+    except Exception as e:
+        raise HTTPException(502, f"Errore di trascrizione: {e}")
+    return {"text": res["text"], "audio": res["report"]}
+
+
+@app.post("/generate", dependencies=[Depends(require_token)])
+async def generate(req: GenerateRequest):
+    _validate(req)
+    if req.stream:
+        return _ndjson(_stream_generate(req))
+    try:
+        outputs = await _generate(req)
+    except Exception as e:
+        raise HTTPException(502, f"Errore del modello: {e}")
+    return {"outputs": outputs, "params": {"tipo": req.out_type, "lunghezza": req.length}}
+
+
+@app.post("/generate/batch", dependencies=[Depends(require_token)])
+async def generate_batch(batch: BatchRequest):
+    if len(batch.items) > MAX_BATCH:
+        raise HTTPException(413, f"Massimo {MAX_BATCH} ricette per batch.")
+    for item in batch.items:
+        _validate(item)
+
+    async def run(i, item):
+        try:
+            return {"index": i, "outputs": await _generate(item)}
+        except Exception as e:
+            return {"index": i, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(batch.items)]
+    if batch.stream:
+        async def events():
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        return _ndjson(events())
+    return {"results": await asyncio.gather(*tasks)}
+
+
+@app.post("/image", dependencies=[Depends(require_token)])
+async def image(req: ImageRequest):
+    try:
+        paths = await _run_limited(
+            _image_slots, ai_services.generate_dish_images, req.ricetta, model=req.model, n=req.n, use_cache=req.use_cache
+        )
+    except Exception as e:
+        raise HTTPException(502, f"Errore generazione immagine: {e}")
+
+    def read_all():
+        out = []
+        for path in paths:
+            with open(path, "rb") as f:
+                out.append(base64.b64encode(f.read()).decode("ascii"))
+        return out
+
+    return {"images": await asyncio.to_thread(read_all)}
+
+
+def _decode_image(image_b64):
+    """Byte dell'immagine in base64; 422 se il base64 o l'immagine non sono validi."""
+    try:
+        data = base64.b64decode(image_b64, validate=True)
+    except binascii.Error:
+        raise HTTPException(422, "image_b64 non è base64 valido.")
+    try:
+        Image.open(io.BytesIO(data)).verify()
+    except Exception:
+        raise HTTPException(422, "image_b64 non contiene un'immagine leggibile.")
+    return data
+
+
+@app.post("/archive", dependencies=[Depends(require_token)])
+async def archive(req: ArchiveRequest):
+    img = _decode_image(req.image_b64) if req.image_b64 else None
+    serial, img_path = await asyncio.to_thread(
+        archive_manager.add_archive_entry, req.titolo, req.ricetta, req.frase, img, req.tags
+    )
+    return {"seriale": int(serial), "immagine_path": img_path}
+
+
+@app.get("/archive/search", dependencies=[Depends(require_token)])
+async def archive_search(q: Optional[str] = None, tag: Optional[str] = None,
+                         serial_from: Optional[int] = None, serial_to: Optional[int] = None, limit: int = 50):
+    if not os.path.exists(archive_manager.ARCHIVE_FILE):
+        return {"results": []}
+    rows = await asyncio.to_thread(
+        search_dishes, archive_manager.ARCHIVE_FILE, serial_from, serial_to, tag, q, limit
+    )
+    return {"results": rows}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
@@ -1,114 +1,19 @@
 import os
-import base64
-import tempfile
+import time
 import streamlit as st
-from openai import OpenAI
-import yaml
-import io
-import requests
-import pandas as pd
-from datetime import datetime
-from docx import Document
 import hmac
-import zipfile
+
+import profiling
+from shared_cache import cached_file_bytes, get_cache, report_session, session_reports
+from ui_utils import rerun_fragment
+
+# NB: pandas, python-docx, openai, requests vengono importati solo nella pagina Tool
+# (vedi ai_services.py, archive_manager.py, docx_export.py): la Home parte subito.
 
 # CONFIGURAZIONE PAGINA (Deve essere il primo comando Streamlit)
 st.set_page_config(page_title="Voce del Piatto", layout="wide")
 
-def create_archive_zip():
-    """Crea un file ZIP contenente l'Excel e tutte le immagini archiviate."""
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, 'a', zipfile.ZIP_DEFLATED, False) as zip_file:
-        if os.path.exists(ARCHIVE_FILE):
-            zip_file.write(ARCHIVE_FILE, ARCHIVE_FILE)
-        if os.path.exists(IMAGES_DIR):
-            for root, dirs, files in os.walk(IMAGES_DIR):
-                for file in files:
-                    zip_file.write(os.path.join(root, file), os.path.join(IMAGES_DIR, file))
-    return buf.getvalue()
-
-# =====================
-# Archiving Logic (Merged from archive_manager.py)
-# =====================
-ARCHIVE_FILE = "archivio_piatti.xlsx"
-IMAGES_DIR = "archived_images"
-
-def initialize_archive():
-    """Crea il file Excel con gli header se non esiste."""
-    if not os.path.exists(ARCHIVE_FILE):
-        df = pd.DataFrame(columns=[
-            "seriale", 
-            "titolo", 
-            "ricetta", 
-            "frase_iconica", 
-            "immagine_path", 
-            "tags", 
-            "data_archiviazione"
-        ])
-        df.to_excel(ARCHIVE_FILE, index=False)
-    
-    if not os.path.exists(IMAGES_DIR):
-        os.makedirs(IMAGES_DIR)
-
-def get_next_serial():
-    """Ritorna il prossimo seriale disponibile."""
-    if not os.path.exists(ARCHIVE_FILE):
-        return 1
-    try:
-        df = pd.read_excel(ARCHIVE_FILE)
-        if df.empty:
-            return 1
-        return df["seriale"].max() + 1
-    except Exception:
-        return 1
-
-def add_archive_entry(titolo, ricetta, frase, immagine_bytes, tags):
-    """Aggiunge una riga all'archivio Excel e salva l'immagine (se presente)."""
-    initialize_archive()
-    
-    serial = get_next_serial()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    img_path = ""
-    if immagine_bytes:
-        # Salva immagine usando il seriale come nome file
-        img_filename = f"{serial}.png"
-        img_path = os.path.join(IMAGES_DIR, img_filename)
-        with open(img_path, "wb") as f:
-            f.write(immagine_bytes)
-    
-    # Prepara dati
-    new_data = {
-        "seriale": serial,
-        "titolo": titolo,
-        "ricetta": ricetta,
-        "frase_iconica": frase,
-        "immagine_path": img_filename if immagine_bytes else "",
-        "tags": tags,
-        "data_archiviazione": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    # Carica, appendi e salva
-    try:
-        # Leggi l'intero foglio per evitare sovrascritture parziali
-        if os.path.exists(ARCHIVE_FILE):
-            df = pd.read_excel(ARCHIVE_FILE)
-        else:
-            # Fallback se il file è sparito tra initialize e qui
-            df = pd.DataFrame(columns=["seriale", "titolo", "ricetta", "frase_iconica", "immagine_path", "tags", "data_archiviazione"])
-        
-        # Assicuriamoci che i tipi siano coerenti per il concat
-        new_row_df = pd.DataFrame([new_data])
-        df = pd.concat([df, new_row_df], ignore_index=True)
-        
-        # Salvataggio forzato su file
-        with pd.ExcelWriter(ARCHIVE_FILE, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
-            
-        return serial, img_path
-    except Exception as e:
-        # Non usare st.error qui se vogliamo che l'errore sia catturato dal chiamante
-        raise e
+_RUN_T0 = time.perf_counter()  # durata del rerun completo (vedi fondo pagina Tool)
 
 def require_password():
     if st.session_state.get("auth_ok"):
@@ -130,30 +35,6 @@ def require_password():
 
 require_password()
 
-# =====================
-# Config
-# =====================
-
-client = OpenAI()  # OPENAI_API_KEY da env / Streamlit Secrets
-
-VISION_MODEL = os.getenv("VISION_MODEL", "gpt-4o-mini")
-GEN_MODEL = os.getenv("GEN_MODEL", "gpt-4o-mini")
-TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "gpt-4o-transcribe")
-
-# =====================
-# Load rules + prompt
-# =====================
-def load_yaml(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
-
-RULES = load_yaml("rules/registri.yaml")
-REGISTRI = RULES["registri"]          # dict: nome -> guida
-HARD_RULES = RULES["hard_rules"]      # list[str]
-
-with open("prompts/system.txt", "r", encoding="utf-8") as f:
-    SYSTEM_TXT = f.read()
-
 # =====================
 # Session state
 # =====================
@@ -176,186 +57,45 @@ if "last_confirmed_ricetta" not in st.session_state:
     st.session_state.last_confirmed_ricetta = ""
 
 if "archival_results" not in st.session_state:
-    st.session_state.archival_results = {} # dict: key -> {'excel_bytes': b, 'img_bytes': b, 'serial': s}
+    st.session_state.archival_results = {} # dict: key -> {'img_path': p, 'serial': s, ...} (solo riferimenti, niente bytes)
 
 # Contatori per resettare i popover
 if "pop_counters" not in st.session_state:
     st.session_state["pop_counters"] = {}
 
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+# Memoria occupata da questa sessione (pagina Admin)
+def _report_session_memory():
+    session_id = _session_id()
+    if session_id is not None:
+        report_session(session_id, st.session_state.to_dict().items())
+
+_report_session_memory()
+
+def _discard_speculation():
+    # le generazioni speculative non ancora usate non servono più (ricetta cambiata)
+    if st.session_state.get("speculative_mode"):
+        from speculation import get_speculator
+        get_speculator().discard(_session_id())
+
 def reset_confirmation():
     st.session_state.recipe_confirmed = False
+    _discard_speculation()
 
 def clear_all_callback():
     st.session_state.outputs = {}
     st.session_state.ricetta = ""
     st.session_state.manual_input_text = ""
     st.session_state.recipe_confirmed = False
+    _discard_speculation()
 
 def clear_manual_input_callback():
     st.session_state.manual_input_text = ""
 
-# =====================
-# Helpers
-# =====================
-def _to_data_url(file_bytes: bytes, mime: str) -> str:
-    b64 = base64.b64encode(file_bytes).decode("utf-8")
-    return f"data:{mime};base64,{b64}"
-
-def extract_text_from_image(image_bytes: bytes, mime: str) -> str:
-    data_url = _to_data_url(image_bytes, mime)
-    prompt = (
-        "Estrai e trascrivi fedelmente il testo della ricetta dall'immagine.\n"
-        "Regole:\n"
-        "- Non inventare nulla.\n"
-        "- Mantieni numeri, unità (g, ml), virgole, simboli e 'q.b.'\n"
-        "- Mantieni struttura a righe.\n"
-        "- Se c'è una tabella, rendila in testo con colonne separate da ' | '.\n"
-        "Output: SOLO il testo estratto."
-    )
-
-    resp = client.chat.completions.create(
-        model=VISION_MODEL,
-        messages=[{
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": data_url}},
-            ]
-        }]
-    )
-    return (resp.choices[0].message.content or "").strip()
-
-def transcribe_audio_bytes(audio_bytes: bytes, suffix: str) -> str:
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-    try:
-        with open(tmp_path, "rb") as f:
-            tr = client.audio.transcriptions.create(
-                model=TRANSCRIBE_MODEL,
-                file=f,
-            )
-        return getattr(tr, "text", "") or ""
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-
-def generate_output(ricetta: str, registro: str, out_type: str, length: str) -> str:
-    reg_hint = REGISTRI[registro]
-
-    user_prompt = f"""
-Sei un copywriter gastronomico specializzato.
-Il tuo compito è scrivere la descrizione di un piatto basandoti sulla ricetta fornita.
-
-COMANDO: Devi generare SOLAMENTE la versione: {out_type} {length}.
-NON generare altre varianti.
-NON generare introduzioni o spiegazioni.
-NON unire più versioni (es. se chiesto Menu, NON fare Cameriere).
-
-REGISTRO RICHIESTO: {registro}
-DESCRIZIONE REGISTRO: {reg_hint}
-(Usa queste regole di stile SOLO per la versione {out_type} {length})
-
-REGOLE HARD (da rispettare sempre):
-- """ + "\n- ".join(HARD_RULES) + f"""
-
-RICETTA (testo sorgente):
-{ricetta}
-
-OUTPUT ATTESO:
-Scrivi SOLO il testo per {out_type} in formato {length}.
-""".strip()
-
-    resp = client.chat.completions.create(
-        model=GEN_MODEL,
-        messages=[
-            {"role": "system", "content": SYSTEM_TXT},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    return (resp.choices[0].message.content or "").strip()
-
-def translate_text(text: str, language: str, register: str) -> str:
-    prompt = f"""
-Sei un traduttore esperto di menu gastronomici.
-Traduci il seguente testo in {language}.
-Mantieni rigorosamente il tono, lo stile e la formattazione del registro originale: "{register}".
-Non aggiungere spiegazioni o commenti extra.
-
-TESTO DA TRADURRE:
-{text}
-""".strip()
-    
-    resp = client.chat.completions.create(
-        model=GEN_MODEL,
-        messages=[
-            {"role": "user", "content": prompt},
-        ],
-    )
-    return (resp.choices[0].message.content or "").strip()
-
-def export_docx(titolo: str, contenuto: str) -> bytes:
-    doc = Document()
-    doc.add_heading(titolo, level=1)
-
-    for par in contenuto.split("\n"):
-        doc.add_paragraph(par)
-
-    bio = io.BytesIO()
-    doc.save(bio)
-    bio.seek(0)
-    return bio.read()
-
-def generate_dish_image(ricetta: str, model="gpt-image-1.5"):
-    """Genera l'immagine del piatto in versione ristorante stellato."""
-    prompt = f"""
-Create a plated, finished dish inspired by the following recipe: {ricetta}.
-The dish must be fully prepared and ready to serve.
-Only one single plate visible. Centered composition.
-No ingredients outside the plate. No bowls, no glasses, no cutlery, no table props.
-White porcelain plate or matte black stoneware plate.
-Isolated plate on seamless neutral elegant background (light grey or soft beige).
-Minimalist fine dining plating with generous negative space for menu text.
-Professional studio food photography, soft diffused lighting.
-The entire frame must contain only the plate. Clean background with no texture. Luxury Michelin-star restaurant aesthetic.
-""".strip()
-
-    try:
-        # --- Parametri per modello (minimo indispensabile) ---
-        kwargs = {"model": model, "prompt": prompt, "n": 1}
-
-        if model.startswith("gpt-image-"):
-            # GPT Image: size 1024/1536 e quality low/medium/high/auto
-            kwargs["size"] = "1024x1024"
-            kwargs["quality"] = "high"
-        elif model == "dall-e-3":
-            kwargs["size"] = "1024x1024"
-            kwargs["quality"] = "standard"  # oppure "hd"
-            kwargs["response_format"] = "url"
-        else:  # dall-e-2
-            kwargs["size"] = "512x512"
-            kwargs["response_format"] = "url"
-
-        response = client.images.generate(**kwargs)
-        item = response.data[0]
-
-        # GPT Image: base64
-        if getattr(item, "b64_json", None):
-            return base64.b64decode(item.b64_json)
-
-        # DALL·E: URL
-        if getattr(item, "url", None):
-            return requests.get(item.url, timeout=30).content
-
-        raise RuntimeError("Risposta immagini inattesa: manca sia b64_json sia url.")
-
-    except Exception as e:
-        st.error(f"Errore nella generazione dell'immagine ({model}): {e}")
-        return None
-
-
 # =====================
 # UX Fine: mini-CSS (pulizia visiva)
 # =====================
@@ -417,401 +157,721 @@ st.markdown("""
 # Home / Tool switch
 # =====================
 
+pages = ["Home", "Tool" , "Cover Menu", "Export Menu"]
+if st.secrets.get("ADMIN_PASSWORD", ""):
+    pages.append("Admin")
+
 page = st.radio(
         "",
-        ["Home", "Tool" , "Cover Menu"],
+        pages,
         horizontal=True,
         index=0,
         label_visibility="collapsed"
         )
 
+# Profilo del rerun (interruttore nella pagina Admin): run_scope lo chiude anche
+# con st.stop(), st.rerun() o un'eccezione a metà pagina
+with profiling.run_scope(f"app · {page}"):
+    st.divider()
 
+    if page == "Home":
+        # --- LANDING ---
+        st.markdown("""
+        <div style="text-align:center; margin-top:0.5rem; margin-bottom:1.5rem;">
+          <div style="font-size:1.6rem; font-weight:700; color:#1F1F1F;">
+            Descrizioni per menu e sala, in 30 secondi.
+          </div>
+          <div style="font-size:1rem; color:#6b6b6b; margin-top:0.4rem;">
+            Carica una ricetta (foto o voce), scegli lo stile, genera la tua “voce”.
+          </div>
+        </div>
+        """, unsafe_allow_html=True)
 
+        col1, col2, col3 = st.columns(3, gap="large")
+
+        with col1:
+            st.markdown("""
+            <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
+              <div style="font-weight:700; color:#C9A227;">Input naturale</div>
+              <div style="margin-top:6px;">Testo, foto o voce → testo editabile.</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+        with col2:
+            st.markdown("""
+            <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
+              <div style="font-weight:700; color:#C9A227;">5 registri</div>
+              <div style="margin-top:6px;">Minimal, classico, territoriale, sensoriale, emozionale.</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+        with col3:
+            st.markdown("""
+            <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
+              <div style="font-weight:700; color:#C9A227;">Output pronto</div>
+              <div style="margin-top:6px;">Menu o sala, supporto lingue, export DOCX incluso.</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+        st.stop()
 
+    # Admin (cache condivisa + memoria per sessione)
+
+    if page == "Admin":
+        if not st.session_state.get("admin_ok"):
+            admin_pwd = st.text_input("Password amministratore", type="password")
+            if st.button("Entra come admin"):
+                if hmac.compare_digest(admin_pwd, st.secrets.get("ADMIN_PASSWORD", "")):
+                    st.session_state["admin_ok"] = True
+                    st.rerun()
+                else:
+                    st.error("Password non corretta.")
+            st.stop()
 
+        def _mb(n):
+            return round(n / (1024 * 1024), 2)
+
+        stats = get_cache().stats()
+        st.subheader("Cache condivisa")
+        st.caption(f"{_mb(stats['used_bytes'])} MB usati su {_mb(stats['budget_bytes'])} MB (SHARED_CACHE_MB)")
+        st.dataframe([
+            {"namespace": ns, "voci": s["entries"], "MB": _mb(s["bytes"]),
+             "hit": s["hits"], "miss": s["misses"], "evictions": s["evictions"]}
+            for ns, s in sorted(stats["namespaces"].items())
+        ], use_container_width=True)
+        if st.button("Svuota cache"):
+            get_cache().invalidate()
+            st.rerun()
 
-st.divider()
+        st.subheader("Memoria per sessione")
+        now = time.time()
+        st.dataframe([
+            {"sessione": r["session_id"][:8], "ultima attività (s)": int(now - r["seen"]), "MB": _mb(r["total_bytes"]),
+             "chiavi più pesanti": ", ".join(f"{k} ({_mb(v)} MB)" for k, v in sorted(r["sizes"].items(), key=lambda kv: -kv[1])[:3])}
+            for r in session_reports()
+        ], use_container_width=True)
+
+        from speculation import get_speculator
+        spec = get_speculator().stats()
+        st.subheader("Generazione speculativa")
+        st.caption(
+            f"Hit rate {spec['hit_rate'] if spec['hit_rate'] is not None else '—'} · "
+            f"token sprecati {spec['wasted_tokens']} (usati {spec['used_tokens']}) · "
+            f"attesa risparmiata {spec['saved_ms'] / 1000:.1f} s"
+        )
+        st.dataframe([spec], use_container_width=True)
+
+        from generation_budget import variant_report
+        st.subheader("Generazione per variante")
+        st.caption("Token medi in uscita e latenza per registro / tipo / lunghezza (max_tokens e stop anticipato dai limiti di frasi).")
+        st.dataframe(variant_report(), use_container_width=True)
+
+        from model_router import routing_report
+        st.subheader("Routing modelli")
+        st.caption("Escalation al modello più forte quando il controllo locale scarta il testo (rules/routing.yaml).")
+        st.dataframe(routing_report(), use_container_width=True)
+
+        st.subheader("Profilo dei rerun")
+        st.toggle(
+            "Profila ogni rerun (cProfile + span sui punti caldi)",
+            value=profiling.is_enabled(),
+            key="profiling_toggle",
+            on_change=lambda: profiling.set_enabled(st.session_state.profiling_toggle),
+        )
+        st.caption("Vale per tutte le sessioni: da spegnere dopo la diagnosi.")
+        runs = profiling.recent_runs()
+        if runs:
+            run = st.selectbox(
+                "Rerun",
+                runs,
+                format_func=lambda r: (
+                    f"{time.strftime('%H:%M:%S', time.localtime(r['started']))} · {r['label']} · "
+                    f"{r['total_ms']:.0f} ms" + (" (interrotto)" if r["interrupted"] else "")
+                ),
+            )
+            st.caption("Span (punti caldi con nome)")
+            st.dataframe(profiling.span_rows(run), use_container_width=True)
+            st.caption(f"Top {profiling.PROFILE_TOP_N} funzioni per tempo cumulativo")
+            st.dataframe(run["top"], use_container_width=True)
+            if run["prof"]:
+                st.download_button(
+                    "⬇️ Profilo completo (.prof, per snakeviz / flame graph)",
+                    data=run["prof"],
+                    file_name=f"rerun_{int(run['started'])}.prof",
+                    mime="application/octet-stream",
+                )
+            st.caption("Span aggregati")
+            st.dataframe(profiling.span_report(), use_container_width=True)
+            if st.button("Azzera profili"):
+                profiling.reset()
+                st.rerun()
+        st.stop()
 
-if page == "Home":
-    # --- LANDING ---
-    st.markdown("""
-    <div style="text-align:center; margin-top:0.5rem; margin-bottom:1.5rem;">
-      <div style="font-size:1.6rem; font-weight:700; color:#1F1F1F;">
-        Descrizioni per menu e sala, in 30 secondi.
-      </div>
-      <div style="font-size:1rem; color:#6b6b6b; margin-top:0.4rem;">
-        Carica una ricetta (foto o voce), scegli lo stile, genera la tua “voce”.
-      </div>
-    </div>
-    """, unsafe_allow_html=True)
+    # Cover Menu
 
-    col1, col2, col3 = st.columns(3, gap="large")
+    if page == "Cover Menu":
+        import os
+        BASE_DIR = r"c:\cover_menu"
 
-    with col1:
-        st.markdown("""
-        <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
-          <div style="font-weight:700; color:#C9A227;">Input naturale</div>
-          <div style="margin-top:6px;">Testo, foto o voce → testo editabile.</div>
-        </div>
-        """, unsafe_allow_html=True)
+        if not os.path.exists(BASE_DIR):
+            st.warning("⚠️ Cover Menu disponibile solo in ambiente locale.")
+            st.stop()
 
-    with col2:
-        st.markdown("""
-        <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
-          <div style="font-weight:700; color:#C9A227;">5 registri</div>
-          <div style="margin-top:6px;">Minimal, classico, territoriale, sensoriale, emozionale.</div>
-        </div>
-        """, unsafe_allow_html=True)
+        from modules_cover.cover_app_ui import cover_ui
+        cover_ui(BASE_DIR)
+        st.stop()
 
-    with col3:
-        st.markdown("""
-        <div style="background:#F6F6F6; border:1px solid #E6E6E6; padding:14px 16px; border-radius:12px;">
-          <div style="font-weight:700; color:#C9A227;">Output pronto</div>
-          <div style="margin-top:6px;">Menu o sala, supporto lingue, export DOCX incluso.</div>
-        </div>
-        """, unsafe_allow_html=True)
+    # Export Menu (DOCX + PDF da archivio)
 
-    st.stop()
+    if page == "Export Menu":
+        import tempfile
+        from archive_manager import ARCHIVE_FILE
+        from menu_export import export_menu
 
-# Cover Menu
+        st.subheader("Export menu dall'archivio")
 
-if page == "Cover Menu":
-    import os
-    BASE_DIR = r"c:\cover_menu"
+        if not os.path.exists(ARCHIVE_FILE):
+            st.info("Archivio vuoto: archivia almeno un piatto dalla pagina Tool.")
+            st.stop()
 
-    if not os.path.exists(BASE_DIR):
-        st.warning("⚠️ Cover Menu disponibile solo in ambiente locale.")
+        with st.form("menu_export"):
+            titolo_menu = st.text_input("Titolo del menu", value="Menu")
+            c1, c2 = st.columns(2)
+            serial_from = c1.number_input("Dal seriale", min_value=0, value=0, step=1)
+            serial_to = c2.number_input("Al seriale (0 = tutti)", min_value=0, value=0, step=1)
+            tag_menu = st.text_input("Tag (es. mare)")
+            search_menu = st.text_input("Cerca nel testo")
+            do_export = st.form_submit_button("Genera menu", type="primary")
+
+        if do_export:
+            # cartella temporanea per export (niente sovrascritture tra utenti), rimossa a fine export:
+            # in sessione restano solo i byte dei due file
+            with st.spinner("Export in corso..."), tempfile.TemporaryDirectory(prefix="menu_") as out_dir:
+                res = export_menu(
+                    out_dir,
+                    titolo=titolo_menu.strip() or "Menu",
+                    serial_from=int(serial_from) or None,
+                    serial_to=int(serial_to) or None,
+                    tag=tag_menu.strip() or None,
+                    search=search_menu.strip() or None,
+                )
+                for kind in ("docx", "pdf"):
+                    with open(res.pop(f"{kind}_path"), "rb") as f:
+                        res[f"{kind}_bytes"] = f.read()
+            st.session_state["menu_export_res"] = res
+
+        res = st.session_state.get("menu_export_res")
+        if res:
+            if not res["count"]:
+                st.warning("Nessun piatto corrisponde ai filtri.")
+            else:
+                st.success(f"{res['count']} piatti esportati.")
+                st.caption(" · ".join(f"{k}: {v}" for k, v in res["sections"].items()))
+
+                d1, d2 = st.columns(2)
+                d1.download_button(
+                    "📄 Scarica DOCX",
+                    data=res["docx_bytes"],
+                    file_name="menu.docx",
+                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    use_container_width=True
+                )
+                d2.download_button(
+                    "🖨️ Scarica PDF",
+                    data=res["pdf_bytes"],
+                    file_name="menu.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
         st.stop()
 
-    from modules_cover.cover_app_ui import cover_ui
-    cover_ui(BASE_DIR)
-    st.stop()
 
 
+    # =====================
 
-# =====================
+    # =====================
+    # Main App Logic
+    # =====================
 
-# =====================
-# Main App Logic
-# =====================
+    # Import pesanti: solo qui, la pagina Tool è l'unica che li usa
+    from ai_services import (
+        get_registri,
+        transcribe_audio_detailed,
+        generate_output,
+        translate_text,
+        generate_dish_images,
+    )
+    from archive_manager import ARCHIVE_FILE, add_archive_entry, replace_entry_image
+    from image_store import image_path
+    from docx_export import export_docx, export_docx_combined
+
+    REGISTRI = get_registri()          # dict: nome -> guida (caricato una volta per processo)
+
+    reg_names = list(REGISTRI.keys())
+    default_regs = [r for r in ["Minimal contemporaneo", "Classico elegante"] if r in reg_names]
+    if not default_regs and reg_names:
+        default_regs = [reg_names[0]]
+    default_idx = reg_names.index("Minimal contemporaneo") if "Minimal contemporaneo" in reg_names else 0
+
+    # =====================
+    # Archiviazione (frammento, un pannello per registro)
+    # =====================
+    @st.fragment
+    @profiling.profiled("archive_panel")
+    def archive_panel(r, txt, ricetta):
+        """
+        Form di archiviazione di un registro. È un frammento: titolo, tags, checkbox
+        e bottoni rieseguono solo questo pannello, non tutta la pagina.
+        """
+        t0 = time.perf_counter()
+        # Alternativa stabile al popover per evitare TypeError in certi ambienti
+        exp_key = f"exp_arch_{r.replace(' ', '_')}"
+        if exp_key not in st.session_state:
+            st.session_state[exp_key] = False
+
+        with st.expander("📂 Archivia piatto", expanded=st.session_state[exp_key]):
+            st.subheader("Dati per l'archivio:")
+
+            # --- SINCRONIZZAZIONE INTEGRATA ---
+            with st.container(border=True):
+                st.write("🔄 Sincronizza archivio locale")
+                up_file = st.file_uploader("Carica il tuo Excel per non perdere le modifiche", type=["xlsx"], key=f"up_{r.replace(' ', '_')}")
+                if up_file:
+                    file_key = f"{up_file.name}_{up_file.size}"
+                    if st.session_state.get("last_synced_file") != file_key:
+                        with open(ARCHIVE_FILE, "wb") as f:
+                            f.write(up_file.getbuffer())
+                        st.session_state["last_synced_file"] = file_key
+                        st.success("Archivio sincronizzato!")
+                        rerun_fragment()
+
+            st.write("---")
+            titolo_piatto = st.text_input("Titolo del piatto", key=f"title_{r.replace(' ', '_')}")
+            tags_piatto = st.text_input("Tags (es. mare, primo, etc.)", key=f"tags_{r.replace(' ', '_')}")
+
+            st.divider()
+            do_gen_img = st.checkbox("Genera immagine AI", value=True, key=f"gen_img_{r.replace(' ', '_')}")
+            img_model = st.selectbox("Modello immagine", ["gpt-image-1.5", "gpt-image-1-mini", "dall-e-3", "dall-e-2"], index=0, key=f"model_img_{r.replace(' ', '_')}", disabled=not do_gen_img)
+            n_img = st.number_input(
+                "Candidate immagine", min_value=1, max_value=4, value=1, step=1,
+                help="Più candidate in una sola chiamata: le alternative restano disponibili sotto.",
+                key=f"n_img_{r.replace(' ', '_')}", disabled=not do_gen_img or img_model == "dall-e-3"
+            )
 
-reg_names = list(REGISTRI.keys())
-default_regs = [r for r in ["Minimal contemporaneo", "Classico elegante"] if r in reg_names]
-if not default_regs and reg_names:
-    default_regs = [reg_names[0]]
-default_idx = reg_names.index("Minimal contemporaneo") if "Minimal contemporaneo" in reg_names else 0
+            if st.button("Conferma Archiviazione", key=f"btn_arch_{r.replace(' ', '_')}", type="primary", use_container_width=True):
+                if not titolo_piatto.strip():
+                    st.warning("Inserisci un titolo per il piatto.")
+                else:
+                    with st.spinner("Archiviazione in corso..."):
+                        try:
+                            img_bytes = None
+                            img_candidates = []
+                            if do_gen_img:
+                                with st.spinner(f"Generazione immagine ({img_model})..."):
+                                    try:
+                                        # cache su disco: stessa ricetta/modello -> nessuna nuova chiamata
+                                        img_candidates = generate_dish_images(ricetta, model=img_model, n=int(n_img))
+                                        with open(img_candidates[0], "rb") as f:
+                                            img_bytes = f.read()
+                                    except Exception as e:
+                                        st.error(f"Errore nella generazione dell'immagine ({img_model}): {e}")
+
+                            serial, img_filename = add_archive_entry(
+                                titolo=titolo_piatto.strip(),
+                                ricetta=ricetta,
+                                frase=txt,
+                                immagine_bytes=img_bytes,
+                                tags=tags_piatto.strip()
+                            )
 
-# =====================
-# Layout 3 colonne
-# =====================
-left, center, right = st.columns([2.15, 2.15, 2.15], gap="large")
+                            if serial:
+                                # per il download basta la variante JPEG "print", non il master PNG
+                                st.session_state.archival_results[f"res_{r.replace(' ', '_')}"] = {
+                                    "img_path": image_path(serial, "print") if img_bytes else None,
+                                    "img_source": img_candidates[0] if img_candidates else None,
+                                    "serial": serial,
+                                    "img_filename": f"{serial}.jpg",
+                                    "img_alternates": img_candidates[1:]
+                                }
+                                st.success(f"Piatto archiviato! (Seriale: {serial})")
+                                st.balloons()
+                            else:
+                                st.error("Errore durante il salvataggio dei dati.")
+                        except Exception as e:
+                            st.error(f"Errore durante l'archiviazione: {e}")
+
+            # --- DOWNLOAD IMMEDIATI (DOPO SUCCESSO) ---
+            res_key = f"res_{r.replace(' ', '_')}"
+            if res_key in st.session_state.archival_results:
+                res = st.session_state.archival_results[res_key]
+                st.divider()
+                st.write("📥 Scarica subito sul tuo PC:")
+
+                st.download_button(
+                    "📊 Scarica Excel Aggiornato",
+                    # letto al click e condiviso tra sessioni finché il file non cambia
+                    data=lambda: cached_file_bytes(ARCHIVE_FILE),
+                    file_name="archivio_piatti.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"dl_xl_{res_key}",
+                    use_container_width=True
+                )
+
+                if res["img_path"]:
+                    def _read_img(path=res["img_path"]):
+                        with open(path, "rb") as f:
+                            return f.read()
 
-# =====================
-# LEFT: controlli (in form) + azioni
-# =====================
-with left:
-    st.subheader("Impostazioni")
-
-    with st.form("controls", clear_on_submit=False):
-        registri_sel = st.multiselect(
-            "Registri",
-            reg_names,
-            default=default_regs,
-            key="sp_registri_multi"
-        )
+                    st.download_button(
+                        f"🖼️ Scarica Immagine ({res['img_filename']})",
+                        data=_read_img,
+                        file_name=res["img_filename"],
+                        mime="image/jpeg",
+                        key=f"dl_img_{res_key}",
+                        use_container_width=True
+                    )
+
+                # Candidate alternative (già pagate nella stessa chiamata)
+                alternates = res.get("img_alternates") or []
+                if alternates:
+                    st.write("Alternative:")
+                    alt_cols = st.columns(len(alternates))
+                    for i, (col_alt, alt_path) in enumerate(zip(alt_cols, alternates)):
+                        with col_alt:
+                            st.image(alt_path, use_container_width=True)
+                            if st.button("Usa questa", key=f"alt_{res_key}_{i}", use_container_width=True):
+                                with open(alt_path, "rb") as f:
+                                    replace_entry_image(res["serial"], f.read())
+                                # la principale diventa un'alternativa
+                                old = [p for p in [res.get("img_source")] if p]
+                                res["img_source"] = alt_path
+                                res["img_alternates"] = [p for p in alternates if p != alt_path] + old
+                                res["img_path"] = image_path(res["serial"], "print")
+                                rerun_fragment()
+
+            if st.button("Pulisci / Chiudi", key=f"btn_canc_{r.replace(' ', '_')}", use_container_width=True):
+                if res_key in st.session_state.archival_results:
+                    del st.session_state.archival_results[res_key]
+                st.session_state[exp_key] = False
+                rerun_fragment()
+
+            st.caption(f"Pannello aggiornato in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+    # =====================
+    # Layout 3 colonne
+    # =====================
+    left, center, right = st.columns([2.15, 2.15, 2.15], gap="large")
+
+    # =====================
+    # LEFT: controlli (in form) + azioni
+    # =====================
+    with left:
+        st.subheader("Impostazioni")
+
+        with st.form("controls", clear_on_submit=False):
+            registri_sel = st.multiselect(
+                "Registri",
+                reg_names,
+                default=default_regs,
+                key="sp_registri_multi"
+            )
 
 
-        out_type = st.radio("Tipo testo", ["Menu", "Cameriere"], key="sp_out_type")
-        length = st.radio("Lunghezza", ["Corto", "Lungo"], key="sp_length")
+            out_type = st.radio("Tipo testo", ["Menu", "Cameriere"], key="sp_out_type")
+            length = st.radio("Lunghezza", ["Corto", "Lungo"], key="sp_length")
 
-        # Disable generate if not confirmed
-        is_confirmed = st.session_state.get("recipe_confirmed", False)
+            # Disable generate if not confirmed
+            is_confirmed = st.session_state.get("recipe_confirmed", False)
         
-        extra_langs = st.multiselect(
-            "Lingue extra",
-            ["Inglese", "Tedesco", "Francese", "Spagnolo"],
-            default=[],
-            key="sp_extra_langs"
-        )
+            extra_langs = st.multiselect(
+                "Lingue extra",
+                ["Inglese", "Tedesco", "Francese", "Spagnolo"],
+                default=[],
+                key="sp_extra_langs"
+            )
         
-        genera = st.form_submit_button("Genera", type="primary", disabled=not is_confirmed)
+            use_model_cache = st.checkbox(
+                "Riusa testi già generati", value=True, key="sp_model_cache",
+                help="Stessa ricetta e stesse impostazioni: il testo arriva dalla cache condivisa, senza chiamare il modello."
+            )
 
+            genera = st.form_submit_button("Genera", type="primary", disabled=not is_confirmed)
 
-    colA, colB = st.columns(2)
-    if colA.button("Pulisci output"):
-        st.session_state.outputs = {}
-    if colB.button("Pulisci tutto", on_click=clear_all_callback):
-        pass
 
+        colA, colB = st.columns(2)
+        if colA.button("Pulisci output"):
+            st.session_state.outputs = {}
+        if colB.button("Pulisci tutto", on_click=clear_all_callback):
+            pass
 
-# =====================
-# CENTER: input (Foto/Voce/Testo) + revisione
-# =====================
-with center:
-    st.subheader("Input")
 
-    tab_foto, tab_voce, tab_testo = st.tabs(["📷 Foto", "🎙️ Voce", "✍️ Testo"])
+    # =====================
+    # CENTER: input (Foto/Voce/Testo) + revisione
+    # =====================
+    with center:
+        st.subheader("Input")
 
-    with tab_foto:
-        img = st.file_uploader("Carica immagine (JPG/PNG)", type=["jpg", "jpeg", "png"])
-        c1, c2 = st.columns([1, 1])
-        do_ocr = c1.button("Estrai testo", type="primary")
-        if img:
-            st.image(img, caption="Anteprima", use_container_width=True)
+        tab_foto, tab_voce, tab_testo = st.tabs(["📷 Foto", "🎙️ Voce", "✍️ Testo"])
 
-        if do_ocr:
-            if not img:
-                st.warning("Carica prima un'immagine.")
+        with tab_foto:
+            imgs = st.file_uploader(
+                "Carica immagini (JPG/PNG), una per pagina", type=["jpg", "jpeg", "png"], accept_multiple_files=True
+            )
+            # chiave per file_id, non per nome: da iPhone ogni foto arriva come image.jpg
+            by_id = {f.file_id: f for f in imgs or []}
+            labels = {fid: f"{f.name} (#{i + 1})" for i, (fid, f) in enumerate(by_id.items())}
+            order = list(by_id)
+            if len(by_id) > 1:
+                # l'ordine di selezione è l'ordine delle pagine: togli e riaggiungi per spostare
+                order = st.multiselect(
+                    "Ordine pagine", list(by_id), default=list(by_id), format_func=labels.get,
+                    key=f"ocr_page_order_{abs(hash(tuple(sorted(by_id))))}"  # nuove foto -> ordine ripartito da capo
+                )
+                detect_order = st.checkbox("Ordina per numero di pagina (se scritto sulle foto)", key="ocr_detect_order")
             else:
-                with st.spinner("Estrazione testo in corso..."):
-                    text = extract_text_from_image(img.getvalue(), img.type or "image/jpeg")
-                if text:
-                    st.session_state.ricetta = text.strip()
+                detect_order = False
+            c1, c2 = st.columns([1, 1])
+            do_ocr = c1.button("Estrai testo", type="primary")
+            if order:
+                thumbs = st.columns(min(len(order), 4))
+                for i, fid in enumerate(order):
+                    thumbs[i % len(thumbs)].image(by_id[fid], caption=f"{i + 1}. {labels[fid]}", use_container_width=True)
+            if st.session_state.get("last_ocr_report"):
+                st.caption(st.session_state.last_ocr_report)
+
+            if do_ocr:
+                if not order:
+                    st.warning("Carica prima un'immagine.")
+                else:
+                    from ocr_pages import extract_pages, stitch
+                    pages = [(labels[fid], by_id[fid].getvalue(), by_id[fid].type or "image/jpeg") for fid in order]
+                    with st.spinner(f"Estrazione testo in corso ({len(pages)} pagine)..."):
+                        results, report = extract_pages(pages, detect_order=detect_order)
+                    text = stitch(results)
+                    st.session_state.last_ocr_report = (
+                        f"{report['pages']} pagine in {report['elapsed_ms'] / 1000:.1f} s "
+                        f"({report['cached']} dalla cache"
+                        + (", riordinate per numero di pagina" if report["reordered"] else "")
+                        + (f", {report['empty']} senza testo" if report["empty"] else "") + ")"
+                    )
+                    if text:
+                        st.session_state.ricetta = text
+                        reset_confirmation()
+                        st.success("Testo estratto e copiato in Revisione!")
+                        st.rerun()
+                    else:
+                        st.warning("Niente testo utile. Prova foto più nitida/frontale.")
+
+
+        with tab_voce:
+            st.write("MVP: carica una registrazione (wav/mp3/m4a).")
+            aud = st.file_uploader("Carica audio", type=["wav", "mp3", "m4a", "aac"])
+            do_stt = st.button("Trascrivi audio", type="primary")
+            if aud:
+                st.audio(aud)
+            if st.session_state.get("last_audio_report"):
+                st.caption(st.session_state.last_audio_report)
+
+            if do_stt:
+                if not aud:
+                    st.warning("Carica prima un file audio.")
+                else:
+                    suffix = os.path.splitext(aud.name)[1] or ".wav"
+                    with st.spinner("Trascrizione in corso..."):
+                        res = transcribe_audio_detailed(aud.getvalue(), suffix=suffix)
+                    text = res["text"]
+                    from audio_preprocess import format_audio_report
+                    st.session_state.last_audio_report = format_audio_report(res["report"])
+                    if text:
+                        st.session_state.ricetta = text.strip()
+                        reset_confirmation()
+                        st.success("Trascrizione completata e copiata in Revisione!")
+                        st.rerun()
+                    else:
+                        st.warning("Trascrizione vuota. Prova un audio più pulito.")
+
+        with tab_testo:
+            txt_in = st.text_area("Scrivi/Incolla", key="manual_input_text", height=200)
+
+            col_t1, col_t2 = st.columns(2)
+            if col_t1.button("Copia in Revisione", type="primary", use_container_width=True):
+                if txt_in and txt_in.strip():
+                    st.session_state.ricetta = txt_in.strip()
                     reset_confirmation()
-                    st.success("Testo estratto e copiato in Revisione!")
                     st.rerun()
                 else:
-                    st.warning("Niente testo utile. Prova foto più nitida/frontale.")
+                    st.warning("Scrivi qualcosa prima di copiare.")
+        
+            if col_t2.button("Cancella testo", use_container_width=True, on_click=clear_manual_input_callback):
+                pass
 
 
-    with tab_voce:
-        st.write("MVP: carica una registrazione (wav/mp3/m4a).")
-        aud = st.file_uploader("Carica audio", type=["wav", "mp3", "m4a", "aac"])
-        do_stt = st.button("Trascrivi audio", type="primary")
-        if aud:
-            st.audio(aud)
+        st.divider()
 
-        if do_stt:
-            if not aud:
-                st.warning("Carica prima un file audio.")
-            else:
-                suffix = os.path.splitext(aud.name)[1] or ".wav"
-                with st.spinner("Trascrizione in corso..."):
-                    text = transcribe_audio_bytes(aud.getvalue(), suffix=suffix)
-                if text:
-                    st.session_state.ricetta = text.strip()
-                    reset_confirmation()
-                    st.success("Trascrizione completata e copiata in Revisione!")
-                    st.rerun()
-                else:
-                    st.warning("Trascrizione vuota. Prova un audio più pulito.")
+        st.subheader("Revisione ricetta")
+        val_ricetta = st.text_area(
+                "Testo ufficiale (usato per generare)",
+                key="ricetta",
+                height=260,
+                on_change=reset_confirmation
+        )
 
-    with tab_testo:
-        txt_in = st.text_area("Scrivi/Incolla", key="manual_input_text", height=200)
+        speculative = st.checkbox(
+            "⚡ Pre-genera alla conferma", value=False, key="speculative_mode",
+            help="Alla conferma parte subito la generazione con le impostazioni correnti: "
+                 "se al Genera non cambiano, il testo è già pronto. Costa token se poi cambi impostazioni."
+        )
 
-        col_t1, col_t2 = st.columns(2)
-        if col_t1.button("Copia in Revisione", type="primary", use_container_width=True):
-            if txt_in and txt_in.strip():
-                st.session_state.ricetta = txt_in.strip()
-                reset_confirmation()
+        # Confirmation button
+        if st.button("✅ Conferma Ricetta", type="primary", use_container_width=True):
+            if val_ricetta.strip():
+                st.session_state.recipe_confirmed = True
+                st.session_state.last_confirmed_ricetta = val_ricetta
+                if speculative:
+                    # impostazioni dell'ultimo Genera (o i default del form)
+                    from speculation import get_speculator
+                    spec_ricetta = val_ricetta.strip()
+                    spec_type = st.session_state.get("sp_out_type") or "Menu"
+                    spec_length = st.session_state.get("sp_length") or "Corto"
+                    spec_regs = [
+                        r for r in (st.session_state.get("sp_registri_multi") or default_regs)
+                        if not get_cache().contains("model", ("gen", spec_ricetta, r, spec_type, spec_length))
+                    ]
+                    get_speculator().start(_session_id(), spec_ricetta, spec_regs, spec_type, spec_length)
                 st.rerun()
             else:
-                st.warning("Scrivi qualcosa prima di copiare.")
-        
-        if col_t2.button("Cancella testo", use_container_width=True, on_click=clear_manual_input_callback):
-            pass
-
-
-    st.divider()
-
-    st.subheader("Revisione ricetta")
-    val_ricetta = st.text_area(
-            "Testo ufficiale (usato per generare)",
-            key="ricetta",
-            height=260,
-            on_change=reset_confirmation
-    )
-
-    # Confirmation button
-    if st.button("✅ Conferma Ricetta", type="primary", use_container_width=True):
-        if val_ricetta.strip():
-            st.session_state.recipe_confirmed = True
-            st.session_state.last_confirmed_ricetta = val_ricetta
-            st.rerun()
-        else:
-            st.warning("La ricetta è vuota.")
+                st.warning("La ricetta è vuota.")
     
-    if st.session_state.get("recipe_confirmed", False):
-        st.success("Ricetta confermata. Puoi generare.")
-
-
-
-# =====================
-# RIGHT: output persistente
-# =====================
-with right:
-    st.subheader("Output")
-
-    ricetta = (st.session_state.ricetta or "").strip()
-
-    if genera:
-        # SICUREZZA: Verifica se il testo è cambiato rispetto all'ultima conferma
-        if st.session_state.get("recipe_confirmed") and ricetta != st.session_state.get("last_confirmed_ricetta", ""):
-            st.session_state.recipe_confirmed = False
-            st.error("⚠️ Hai modificato il testo: devi confermare di nuovo la ricetta.")
-            st.stop()
-
-        if not ricetta:
-             # Should be caught by disabled, but safety check
-            st.error("Manca la ricetta.")
-        elif not st.session_state.get("recipe_confirmed", False):
-             st.error("Devi confermare la ricetta.")
-        else:
-            st.session_state.outputs = {}
-            st.session_state.archival_results = {}  # Pulizia risultati precedenti
-            st.session_state.last_params = {
-                "registri": registri_sel,
-                "tipo": out_type,
-                "lunghezza": length
-            }
-            for r in registri_sel:
-                with st.spinner(f"Genero: {r}…"):
-                    # 1. Italian generation
-                    base_text = generate_output(ricetta, r, out_type, length)
-                    final_output = base_text
+        if st.session_state.get("recipe_confirmed", False):
+            st.success("Ricetta confermata. Puoi generare.")
+            # estrazione locale (nessuna chiamata al modello): è anche ciò che finisce in archivio
+            from recipe_normalizer import normalize_recipe
+            norm = normalize_recipe(st.session_state.get("last_confirmed_ricetta", ""))
+            if norm.ingredients:
+                st.caption("Ingredienti rilevati: " + norm.ingredients_text())
+            if norm.techniques:
+                st.caption("Tecniche: " + norm.techniques_text())
+
+
+
+    # =====================
+    # RIGHT: output persistente
+    # =====================
+    with right:
+        st.subheader("Output")
+
+        ricetta = (st.session_state.ricetta or "").strip()
+
+        if genera:
+            # SICUREZZA: Verifica se il testo è cambiato rispetto all'ultima conferma
+            if st.session_state.get("recipe_confirmed") and ricetta != st.session_state.get("last_confirmed_ricetta", ""):
+                st.session_state.recipe_confirmed = False
+                st.error("⚠️ Hai modificato il testo: devi confermare di nuovo la ricetta.")
+                st.stop()
+
+            if not ricetta:
+                 # Should be caught by disabled, but safety check
+                st.error("Manca la ricetta.")
+            elif not st.session_state.get("recipe_confirmed", False):
+                 st.error("Devi confermare la ricetta.")
+            else:
+                st.session_state.outputs = {}
+                st.session_state.archival_results = {}  # Pulizia risultati precedenti
+                st.session_state.last_params = {
+                    "registri": registri_sel,
+                    "tipo": out_type,
+                    "lunghezza": length
+                }
+                speculator = None
+                if st.session_state.get("speculative_mode"):
+                    from speculation import get_speculator
+                    speculator = get_speculator()
+
+                def generate_base(r):
+                    # testo già pre-generato alla conferma (stessi parametri), altrimenti chiamata al modello
+                    text = speculator.take(_session_id(), ricetta, r, out_type, length) if speculator else None
+                    return text if text is not None else generate_output(ricetta, r, out_type, length)
+
+                for r in registri_sel:
+                    with st.spinner(f"Genero: {r}…"):
+                        # 1. Italian generation
+                        gen_key = ("gen", ricetta, r, out_type, length)
+                        if not use_model_cache:
+                            get_cache().invalidate("model", gen_key)
+                        base_text = get_cache().get_or_create(
+                            "model", gen_key, lambda: generate_base(r)
+                        )
+                        final_output = base_text
                     
-                    # 2. Translate if needed
-                    for lang in extra_langs:
-                         with st.spinner(f"Traduco in {lang}..."):
-                             tr_text = translate_text(base_text, lang, r)
-                             final_output += f"\n\n--- {lang.upper()} ---\n{tr_text}"
+                        # 2. Translate if needed
+                        for lang in extra_langs:
+                             with st.spinner(f"Traduco in {lang}..."):
+                                 tr_text = get_cache().get_or_create(
+                                     "model", ("tr", base_text, lang, r), lambda: translate_text(base_text, lang, r)
+                                 )
+                                 final_output += f"\n\n--- {lang.upper()} ---\n{tr_text}"
                     
-                    st.session_state.outputs[r] = final_output
-
-    # Mostra sempre ultimo output generato (persistente)
-    if st.session_state.outputs:
-        params = st.session_state.last_params or {}
-        st.caption(f"Ultima generazione: {params.get('tipo','')} / {params.get('lunghezza','')}")
-
-        for r, txt in st.session_state.outputs.items():
-            with st.expander(r, expanded=True):
-                st.write(txt)
-                st.code(txt, language="markdown")
-
-                filename = f"{r}_{params.get('tipo','')}_{params.get('lunghezza','')}.docx".replace(" ", "_")
-                titolo = f"Voce del Piatto — {r} — {params.get('tipo','')} — {params.get('lunghezza','')}"
-                docx_bytes = export_docx(titolo, txt)
-                # --- AZIONI (Download e Archiviazione) ---
-                col_d1, col_d2 = st.columns(2)
-                
-                with col_d1:
-                    st.download_button(
-                        "Scarica DOCX",
-                        data=docx_bytes,
-                        file_name=filename,
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        key=f"btn_dl_{r.replace(' ', '_')}",
-                        use_container_width=True
-                    )
+                        st.session_state.outputs[r] = final_output
+
+                if speculator:
+                    # registri / parametri pre-generati ma non richiesti
+                    speculator.discard(_session_id())
+
+        # Mostra sempre ultimo output generato (persistente)
+        if st.session_state.outputs:
+            params = st.session_state.last_params or {}
+            st.caption(f"Ultima generazione: {params.get('tipo','')} / {params.get('lunghezza','')}")
+
+            # Export unico: tutti i registri e tutte le lingue in un solo DOCX (generato al click)
+            sezioni = tuple(st.session_state.outputs.items())
+            st.download_button(
+                "📄 Scarica tutto (DOCX)",
+                data=lambda sezioni=sezioni, params=params: export_docx_combined(
+                    "Voce del Piatto",
+                    f"{params.get('tipo','')} — {params.get('lunghezza','')}",
+                    sezioni
+                ),
+                file_name=f"Voce_del_Piatto_{params.get('tipo','')}_{params.get('lunghezza','')}.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key="btn_dl_all",
+                use_container_width=True
+            )
 
-                with col_d2:
-                    # Alternativa stabile al popover per evitare TypeError in certi ambienti
-                    exp_key = f"exp_arch_{r.replace(' ', '_')}"
-                    if exp_key not in st.session_state:
-                        st.session_state[exp_key] = False
-                    
-                    with st.expander("📂 Archivia piatto", expanded=st.session_state[exp_key]):
-                        st.subheader("Dati per l'archivio:")
-                        
-                        # --- SINCRONIZZAZIONE INTEGRATA ---
-                        with st.container(border=True):
-                            st.write("🔄 Sincronizza archivio locale")
-                            up_file = st.file_uploader("Carica il tuo Excel per non perdere le modifiche", type=["xlsx"], key=f"up_{r.replace(' ', '_')}")
-                            if up_file:
-                                file_key = f"{up_file.name}_{up_file.size}"
-                                if st.session_state.get("last_synced_file") != file_key:
-                                    with open(ARCHIVE_FILE, "wb") as f:
-                                        f.write(up_file.getbuffer())
-                                    st.session_state["last_synced_file"] = file_key
-                                    st.success("Archivio sincronizzato!")
-                                    st.rerun()
-                        
-                        st.write("---")
-                        titolo_piatto = st.text_input("Titolo del piatto", key=f"title_{r.replace(' ', '_')}")
-                        tags_piatto = st.text_input("Tags (es. mare, primo, etc.)", key=f"tags_{r.replace(' ', '_')}")
-                        
-                        st.divider()
-                        do_gen_img = st.checkbox("Genera immagine AI", value=True, key=f"gen_img_{r.replace(' ', '_')}")
-                        img_model = st.selectbox("Modello immagine", ["gpt-image-1.5", "gpt-image-1-mini", "dall-e-3", "dall-e-2"], index=0, key=f"model_img_{r.replace(' ', '_')}", disabled=not do_gen_img)
-                        
-                        if st.button("Conferma Archiviazione", key=f"btn_arch_{r.replace(' ', '_')}", type="primary", use_container_width=True):
-                            if not titolo_piatto.strip():
-                                st.warning("Inserisci un titolo per il piatto.")
-                            else:
-                                with st.spinner("Archiviazione in corso..."):
-                                    try:
-                                        img_bytes = None
-                                        if do_gen_img:
-                                            with st.spinner(f"Generazione immagine ({img_model})..."):
-                                                img_bytes = generate_dish_image(ricetta, model=img_model)
-                                        
-                                        serial, img_filename = add_archive_entry(
-                                            titolo=titolo_piatto.strip(),
-                                            ricetta=ricetta,
-                                            frase=txt,
-                                            immagine_bytes=img_bytes,
-                                            tags=tags_piatto.strip()
-                                        )
-                                        
-                                        if serial:
-                                            with open(ARCHIVE_FILE, "rb") as f:
-                                                excel_bytes = f.read()
-                                            
-                                            st.session_state.archival_results[f"res_{r.replace(' ', '_')}"] = {
-                                                "excel_bytes": excel_bytes,
-                                                "img_bytes": img_bytes,
-                                                "serial": serial,
-                                                "img_filename": f"{serial}.png"
-                                            }
-                                            st.success(f"Piatto archiviato! (Seriale: {serial})")
-                                            st.balloons()
-                                        else:
-                                            st.error("Errore durante il salvataggio dei dati.")
-                                    except Exception as e:
-                                        st.error(f"Errore durante l'archiviazione: {e}")
-                        
-                        # --- DOWNLOAD IMMEDIATI (DOPO SUCCESSO) ---
-                        res_key = f"res_{r.replace(' ', '_')}"
-                        if res_key in st.session_state.archival_results:
-                            res = st.session_state.archival_results[res_key]
-                            st.divider()
-                            st.write("📥 Scarica subito sul tuo PC:")
-                            
-                            st.download_button(
-                                "📊 Scarica Excel Aggiornato",
-                                data=res["excel_bytes"],
-                                file_name="archivio_piatti.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key=f"dl_xl_{res_key}",
-                                use_container_width=True
-                            )
-                            
-                            if res["img_bytes"]:
-                                st.download_button(
-                                    f"🖼️ Scarica Immagine ({res['img_filename']})",
-                                    data=res["img_bytes"],
-                                    file_name=res["img_filename"],
-                                    mime="image/png",
-                                    key=f"dl_img_{res_key}",
-                                    use_container_width=True
-                                )
-                        
-                        if st.button("Pulisci / Chiudi", key=f"btn_canc_{r.replace(' ', '_')}", use_container_width=True):
-                            if res_key in st.session_state.archival_results:
-                                del st.session_state.archival_results[res_key]
-                            st.session_state[exp_key] = False
-                            st.rerun()
-
-    else:
-        st.markdown("""
-        <div style="
-            background:#F6F6F6;
-            border:1px solid #E6E6E6;
-            padding:14px 16px;
-            border-radius:10px;
-            color:#1F1F1F;">
-            <b>Nessun output ancora.</b> Inserisci ricetta e premi <b>Genera</b>.
-        </div>
-        """, unsafe_allow_html=True)
+            for r, txt in st.session_state.outputs.items():
+                with st.expander(r, expanded=True):
+                    st.write(txt)
+                    st.code(txt, language="markdown")
 
+                    filename = f"{r}_{params.get('tipo','')}_{params.get('lunghezza','')}.docx".replace(" ", "_")
+                    titolo = f"Voce del Piatto — {r} — {params.get('tipo','')} — {params.get('lunghezza','')}"
+                    # --- AZIONI (Download e Archiviazione) ---
+                    col_d1, col_d2 = st.columns(2)
+                
+                    with col_d1:
+                        st.download_button(
+                            "Scarica DOCX",
+                            # generato solo al click (e memoizzato per titolo + testo)
+                            data=lambda titolo=titolo, txt=txt: export_docx(titolo, txt),
+                            file_name=filename,
+                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                            key=f"btn_dl_{r.replace(' ', '_')}",
+                            use_container_width=True
+                        )
+
+                    with col_d2:
+                        archive_panel(r, txt, ricetta)
 
+        else:
+            st.markdown("""
+            <div style="
+                background:#F6F6F6;
+                border:1px solid #E6E6E6;
+                padding:14px 16px;
+                border-radius:10px;
+                color:#1F1F1F;">
+                <b>Nessun output ancora.</b> Inserisci ricetta e premi <b>Genera</b>.
+            </div>
+            """, unsafe_allow_html=True)
+
+    st.caption(f"Rerun completo della pagina in {(time.perf_counter() - _RUN_T0) * 1000:.0f} ms")
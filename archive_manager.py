@@ -1,24 +1,137 @@
 import os
+import io
+import zipfile
+import tempfile
+import threading
 import pandas as pd
 from datetime import datetime
 
+from image_store import IMAGES_DIR, store_image
+from profiling import traced
+from recipe_normalizer import normalize_recipe
+
+# =====================
+# Archivio piatti (Excel + immagini)
+# =====================
 ARCHIVE_FILE = "archivio_piatti.xlsx"
-IMAGES_DIR = "archived_images"
+
+# Le sessioni Streamlit girano come thread dello stesso processo: senza lock due
+# archiviazioni contemporanee leggono lo stesso seriale e l'ultima scrittura vince.
+_ARCHIVE_LOCK = threading.RLock()
+
+ARCHIVE_COLUMNS = [
+    "seriale",
+    "titolo",
+    "ricetta",
+    "frase_iconica",
+    "immagine_path",
+    "tags",
+    "data_archiviazione",
+    "ingredienti",
+    "tecniche"
+]
+
+def create_archive_zip():
+    """
+    Crea un file ZIP contenente l'Excel e le immagini archiviate (master + indice).
+    Le varianti compresse non vengono incluse: si rigenerano dai master.
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'a', zipfile.ZIP_DEFLATED, False) as zip_file:
+        if os.path.exists(ARCHIVE_FILE):
+            zip_file.write(ARCHIVE_FILE, ARCHIVE_FILE)
+        if os.path.exists(IMAGES_DIR):
+            for root, dirs, files in os.walk(IMAGES_DIR):
+                dirs[:] = [d for d in dirs if d != "variants"]
+                for file in files:
+                    path = os.path.join(root, file)
+                    # PNG già compressi: STORED evita di ricomprimerli per nulla
+                    compress = zipfile.ZIP_STORED if file.endswith(".png") else zipfile.ZIP_DEFLATED
+                    zip_file.write(path, path, compress_type=compress)
+    return buf.getvalue()
+
+# =====================
+# Snapshot Parquet (letture veloci)
+# =====================
+# Accanto all'Excel si tiene archivio_piatti.parquet, legato alla firma
+# (mtime + size) dell'Excel da cui è stato scritto. Se l'Excel cambia da fuori
+# (sincronizzazione, modifica a mano) lo snapshot non vale più e si rigenera
+# alla prima lettura. L'Excel resta la fonte di verità: senza pyarrow si legge solo quello.
+SNAPSHOT_META_KEY = b"voce_xlsx_signature"
+
+def snapshot_path(xlsx_path=ARCHIVE_FILE):
+    return os.path.splitext(xlsx_path)[0] + ".parquet"
+
+def _xlsx_signature(xlsx_path):
+    st = os.stat(xlsx_path)
+    return f"{st.st_mtime_ns}:{st.st_size}".encode("ascii")
+
+def write_snapshot(xlsx_path, df):
+    """Scrive lo snapshot Parquet di df (già salvato in xlsx_path). Ritorna il path o None."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    columns = {}
+    for col in df.columns:
+        try:
+            columns[str(col)] = pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # colonna mista (es. numeri e testo inseriti a mano in Excel): si salva come testo
+            columns[str(col)] = pa.array(df[col].map(lambda v: None if pd.isna(v) else str(v)), type=pa.string())
+    table = pa.table(columns).replace_schema_metadata({SNAPSHOT_META_KEY: _xlsx_signature(xlsx_path)})
+
+    path = snapshot_path(xlsx_path)
+    fd, tmp = tempfile.mkstemp(suffix=".parquet.tmp", dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+def _fresh_snapshot_columns(xlsx_path):
+    """Colonne dello snapshot se è allineato all'Excel, altrimenti None."""
+    path = snapshot_path(xlsx_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(path)
+    except Exception:
+        return None
+    if (schema.metadata or {}).get(SNAPSHOT_META_KEY) != _xlsx_signature(xlsx_path):
+        return None
+    return schema.names
+
+@traced("read_archive")
+def read_archive(xlsx_path=ARCHIVE_FILE, columns=None):
+    """
+    DataFrame dell'archivio con le sole colonne richieste (None = tutte).
+    Legge lo snapshot Parquet se aggiornato; altrimenti l'Excel, e rigenera lo snapshot.
+    """
+    names = _fresh_snapshot_columns(xlsx_path)
+    if names is not None:
+        wanted = names if columns is None else [c for c in columns if c in names]
+        return pd.read_parquet(snapshot_path(xlsx_path), columns=wanted)
+
+    df = pd.read_excel(xlsx_path, engine="openpyxl")
+    try:
+        write_snapshot(xlsx_path, df)
+    except Exception:
+        pass  # lo snapshot è solo un acceleratore (es. cartella in sola lettura)
+    return df if columns is None else df[[c for c in columns if c in df.columns]]
 
 def initialize_archive():
     """Crea il file Excel con gli header se non esiste."""
     if not os.path.exists(ARCHIVE_FILE):
-        df = pd.DataFrame(columns=[
-            "seriale", 
-            "titolo", 
-            "ricetta", 
-            "frase_iconica", 
-            "immagine_path", 
-            "tags", 
-            "data_archiviazione"
-        ])
+        df = pd.DataFrame(columns=ARCHIVE_COLUMNS)
         df.to_excel(ARCHIVE_FILE, index=False)
-    
+
     if not os.path.exists(IMAGES_DIR):
         os.makedirs(IMAGES_DIR)
 
@@ -26,39 +139,93 @@ def get_next_serial():
     """Ritorna il prossimo seriale disponibile."""
     if not os.path.exists(ARCHIVE_FILE):
         return 1
-    df = pd.read_excel(ARCHIVE_FILE)
-    if df.empty:
+    try:
+        df = read_archive(ARCHIVE_FILE, columns=["seriale"])
+        if df.empty:
+            return 1
+        return int(df["seriale"].max()) + 1
+    except Exception:
         return 1
-    return df["seriale"].max() + 1
 
-def add_entry(titolo, ricetta, frase, immagine_bytes, tags):
-    """Aggiunge una riga all'archivio Excel e salva l'immagine."""
+@traced("add_archive_entry")
+def add_archive_entry(titolo, ricetta, frase, immagine_bytes, tags):
+    """Aggiunge una riga all'archivio Excel e salva l'immagine (se presente)."""
+    with _ARCHIVE_LOCK:
+        return _add_archive_entry(titolo, ricetta, frase, immagine_bytes, tags)
+
+def _add_archive_entry(titolo, ricetta, frase, immagine_bytes, tags):
     initialize_archive()
-    
+
     serial = get_next_serial()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # Salva immagine
-    img_filename = f"piatto_{serial}_{timestamp}.png"
-    img_path = os.path.join(IMAGES_DIR, img_filename)
-    
-    with open(img_path, "wb") as f:
-        f.write(immagine_bytes)
-    
+
+    img_path = ""
+    img_filename = ""
+    if immagine_bytes:
+        # Master lossless + varianti, deduplicati per hash (vedi image_store.py)
+        img_path = store_image(serial, immagine_bytes, IMAGES_DIR)
+        img_filename = os.path.relpath(img_path, IMAGES_DIR).replace(os.sep, "/")
+
     # Prepara dati
+    normalized = normalize_recipe(ricetta or "")
     new_data = {
         "seriale": serial,
         "titolo": titolo,
         "ricetta": ricetta,
         "frase_iconica": frase,
-        "immagine_path": img_path,
+        "immagine_path": img_filename,
         "tags": tags,
-        "data_archiviazione": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "data_archiviazione": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        # campi strutturati estratti localmente (recipe_normalizer.py)
+        "ingredienti": normalized.ingredients_text(),
+        "tecniche": normalized.techniques_text()
     }
-    
+
     # Carica, appendi e salva
-    df = pd.read_excel(ARCHIVE_FILE)
-    df = pd.concat([df, pd.DataFrame([new_data])], ignore_index=True)
-    df.to_excel(ARCHIVE_FILE, index=False)
-    
+    # Leggi l'intero foglio per evitare sovrascritture parziali
+    if os.path.exists(ARCHIVE_FILE):
+        df = read_archive(ARCHIVE_FILE)
+    else:
+        # Fallback se il file è sparito tra initialize e qui
+        df = pd.DataFrame(columns=ARCHIVE_COLUMNS)
+
+    # Assicuriamoci che i tipi siano coerenti per il concat
+    new_row_df = pd.DataFrame([new_data])
+    df = pd.concat([df, new_row_df], ignore_index=True)
+
+    # Salvataggio forzato su file
+    with pd.ExcelWriter(ARCHIVE_FILE, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False)
+    write_snapshot(ARCHIVE_FILE, df)
+
     return serial, img_path
+
+def replace_entry_image(serial, immagine_bytes):
+    """Sostituisce l'immagine di un piatto già archiviato (es. scelta di una candidata alternativa)."""
+    with _ARCHIVE_LOCK:
+        img_path = store_image(serial, immagine_bytes, IMAGES_DIR)
+        img_filename = os.path.relpath(img_path, IMAGES_DIR).replace(os.sep, "/")
+
+        update_entries("immagine_path", {serial: img_filename})
+
+    return img_path
+
+@traced("update_entries")
+def update_entries(column, values_by_serial, xlsx_path=ARCHIVE_FILE):
+    """
+    Scrive più valori di una colonna (seriale -> valore) con una sola lettura e
+    una sola scrittura dell'Excel. La colonna viene creata se manca.
+    Le righe senza seriale numerico (Excel ritoccato a mano) restano come sono.
+    Ritorna i seriali effettivamente presenti in archivio.
+    """
+    with _ARCHIVE_LOCK:
+        df = read_archive(xlsx_path)
+        if column not in df.columns:
+            df[column] = ""
+        df[column] = df[column].astype(object)
+        serials = pd.to_numeric(df["seriale"], errors="coerce")
+        mask = serials.notna() & serials.isin(values_by_serial)
+        df.loc[mask, column] = serials[mask].astype(int).map(values_by_serial)
+        with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False)
+        write_snapshot(xlsx_path, df)
+    return set(serials[mask].astype(int))
@@ -0,0 +1,203 @@
+"""
+Preparazione dell'audio prima della trascrizione.
+
+I WAV registrati dal telefono sono stereo 44,1/48 kHz a 16 bit (circa 10 MB al
+minuto) e spesso hanno secondi di silenzio in testa e in coda. Per la
+trascrizione basta molto meno:
+    decodifica -> taglio del silenzio iniziale/finale -> mono -> 16 kHz -> ricodifica
+
+Decodifica: WAV PCM con il modulo wave (nessuna dipendenza); gli altri formati
+(mp3, m4a, aac) solo se c'è ffmpeg nel PATH, altrimenti si invia l'originale.
+Ricodifica: Opus in OGG se c'è ffmpeg (circa 0,2 MB al minuto), altrimenti WAV
+mono 16 kHz 16 bit (circa 1,9 MB al minuto).
+
+L'originale si usa solo se serve: decodifica impossibile, risultato non più
+piccolo, oppure trascrizione vuota dell'audio preparato (vedi ai_services).
+"""
+import io
+import os
+import time
+import wave
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+
+import numpy as np
+
+TARGET_RATE = 16000
+OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+SILENCE_DBFS = float(os.getenv("AUDIO_SILENCE_DBFS", "-45"))  # sotto questa energia è silenzio
+SILENCE_PAD_S = 0.25       # margine lasciato prima/dopo il parlato
+FRAME_S = 0.02             # finestre da 20 ms per l'energia
+
+
+@dataclass
+class PreparedAudio:
+    data: bytes
+    suffix: str
+    report: dict = field(default_factory=dict)
+
+
+def _ffmpeg():
+    return shutil.which(os.getenv("FFMPEG_BINARY", "ffmpeg"))
+
+
+# =====================
+# Decodifica
+# =====================
+def _decode_wav(audio_bytes):
+    """(campioni float32 [frame, canali] in -1..1, sample rate) da un WAV PCM."""
+    with wave.open(io.BytesIO(audio_bytes), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        samples = np.where(ints & 0x800000, ints - 0x1000000, ints).astype(np.float32) / 8388608
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"WAV a {width * 8} bit non supportato")
+    return samples.reshape(-1, channels), rate
+
+
+def _decode_ffmpeg(audio_bytes, suffix):
+    """Qualsiasi formato -> float32 mono 16 kHz, tramite ffmpeg (stdin/stdout, niente file)."""
+    out = subprocess.run(
+        [_ffmpeg(), "-v", "error", "-i", "pipe:0", "-ac", "1", "-ar", str(TARGET_RATE), "-f", "f32le", "pipe:1"],
+        input=audio_bytes, capture_output=True, check=True,
+    ).stdout
+    return np.frombuffer(out, dtype="<f4").reshape(-1, 1), TARGET_RATE
+
+
+def decode(audio_bytes, suffix):
+    if suffix.lower() == ".wav" or audio_bytes[:4] == b"RIFF":
+        try:
+            return _decode_wav(audio_bytes)
+        except (wave.Error, ValueError, EOFError):
+            pass  # WAV float / compresso: ci prova ffmpeg
+    if _ffmpeg():
+        return _decode_ffmpeg(audio_bytes, suffix)
+    return None
+
+
+# =====================
+# Elaborazione
+# =====================
+def to_mono(samples):
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
+
+def trim_silence(mono, rate):
+    """Toglie il silenzio iniziale e finale (energia per finestre da 20 ms), con un piccolo margine."""
+    frame = max(1, int(rate * FRAME_S))
+    n = len(mono) // frame
+    if n == 0:
+        return mono
+    rms = np.sqrt(np.mean(mono[:n * frame].reshape(n, frame) ** 2, axis=1) + 1e-12)
+    loud = np.flatnonzero(20 * np.log10(rms) > SILENCE_DBFS)
+    if loud.size == 0:
+        return mono  # tutto sotto soglia: meglio non decidere qui
+    pad = int(SILENCE_PAD_S * rate)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(mono), (loud[-1] + 1) * frame + pad)
+    return mono[start:end]
+
+
+def _lowpass(mono, rate, cutoff):
+    """FIR passa-basso (sinc finestrata) prima di scendere di frequenza, contro l'aliasing."""
+    taps = 63
+    t = np.arange(taps) - (taps - 1) / 2
+    h = np.sinc(2 * cutoff / rate * t) * np.hamming(taps)
+    return np.convolve(mono, (h / h.sum()).astype(np.float32), mode="same")
+
+
+def resample(mono, rate, target=TARGET_RATE):
+    if rate == target or len(mono) == 0:
+        return mono
+    if rate > target:
+        mono = _lowpass(mono, rate, 0.45 * target)
+    n_out = int(round(len(mono) * target / rate))
+    x_out = np.arange(n_out) * (rate / target)
+    return np.interp(x_out, np.arange(len(mono)), mono).astype(np.float32)
+
+
+# =====================
+# Codifica
+# =====================
+def _encode_wav(mono, rate):
+    pcm = (np.clip(mono, -1, 1) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def _encode_opus(mono, rate):
+    return subprocess.run(
+        [_ffmpeg(), "-v", "error", "-f", "f32le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+         "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1"],
+        input=mono.astype("<f4").tobytes(), capture_output=True, check=True,
+    ).stdout
+
+
+def encode(mono, rate):
+    """(bytes, suffisso, codec): Opus se possibile, altrimenti WAV PCM 16 bit."""
+    if _ffmpeg():
+        try:
+            return _encode_opus(mono, rate), ".ogg", "opus"
+        except subprocess.CalledProcessError:
+            pass  # ffmpeg senza libopus
+    return _encode_wav(mono, rate), ".wav", "pcm16"
+
+
+def prepare_audio(audio_bytes, suffix):
+    """
+    Audio pronto per la trascrizione, con un report:
+    original_bytes, sent_bytes, duration_s, trimmed_s, codec, preprocess_ms, used_original.
+    """
+    t0 = time.perf_counter()
+    report = {"original_bytes": len(audio_bytes), "codec": None, "used_original": True}
+
+    def original(reason):
+        report.update(sent_bytes=len(audio_bytes), reason=reason, preprocess_ms=(time.perf_counter() - t0) * 1000)
+        return PreparedAudio(audio_bytes, suffix, report)
+
+    try:
+        decoded = decode(audio_bytes, suffix)
+    except (subprocess.CalledProcessError, OSError) as e:
+        return original(f"decodifica fallita: {e}")
+    if decoded is None:
+        return original("formato non decodificabile senza ffmpeg")
+
+    samples, rate = decoded
+    mono = to_mono(samples)
+    duration = len(mono) / rate
+    mono = resample(trim_silence(mono, rate), rate)
+    data, new_suffix, codec = encode(mono, TARGET_RATE)
+
+    report.update(duration_s=round(duration, 2), trimmed_s=round(duration - len(mono) / TARGET_RATE, 2), codec=codec)
+    if len(data) >= len(audio_bytes):
+        return original("già compatto")
+    report.update(sent_bytes=len(data), used_original=False, preprocess_ms=(time.perf_counter() - t0) * 1000)
+    return PreparedAudio(data, new_suffix, report)
+
+
+def format_audio_report(report):
+    mb = lambda n: n / (1024 * 1024)
+    text = f"Audio inviato: {mb(report['sent_bytes']):.2f} MB (originale {mb(report['original_bytes']):.2f} MB"
+    if not report["used_original"]:
+        text += f", {report['codec']} 16 kHz mono, {report.get('trimmed_s', 0):.1f} s di silenzio tolti"
+    text += f", preparazione {report.get('preprocess_ms', 0):.0f} ms)"
+    if "transcribe_ms" in report:
+        text += f" · trascrizione {report['transcribe_ms']:.0f} ms"
+    if "discarded_ms" in report:
+        text += f" (+ {report['discarded_ms']:.0f} ms per l'audio preparato, trascrizione vuota)"
+    return text
@@ -0,0 +1,451 @@
+"""
+Lavori batch offline sull'archivio: rigenerazione e traduzione in blocco.
+
+Quando cambia prompts/system.txt o si aggiunge una lingua, rifare l'archivio
+con generate_output / translate_text una chiamata alla volta è lento e costa
+di più. Qui:
+    1. dall'archivio si costruisce un file JSONL di richieste (formato Batch API)
+    2. lo si invia a un backend batch e lo si interroga finché non finisce
+    3. i risultati passano il controllo locale di model_router e vengono
+       scritti nell'archivio in blocco (una sola scrittura dell'Excel)
+
+Ogni lavoro ha un manifest (BATCH_JOBS_DIR/<lavoro>/manifest.json) con lo stato
+per seriale: rilanciando lo stesso comando si riprende da dove si era rimasti
+(batch già inviati vengono solo interrogati) e i seriali già scritti con la
+stessa richiesta vengono saltati. Se la richiesta cambia (ricetta, prompt,
+modello) il seriale si rifà. I risultati scartati dal controllo si ritentano
+al giro successivo col livello di modello seguente.
+
+Backend:
+    openai  Batch API (file JSONL + /v1/batches, finestra 24h, costo ridotto)
+    local   stesse richieste eseguite subito col client di ai_services (prove, test, fake)
+
+Uso:
+    python batch_jobs.py regenerate --registro classico_elegante --tipo Menu --lunghezza Corto
+    python batch_jobs.py translate --lingua Inglese --backend local
+    python batch_jobs.py status regenerate_classico_elegante_menu_corto
+
+Colonne scritte (le esistenti, frase_iconica compresa, non si toccano):
+    regenerate  frase_<registro>_<tipo>_<lunghezza>
+    translate   frase_iconica_<lingua>   (traduzione della parte italiana di frase_iconica)
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ai_services
+import archive_manager
+from model_router import check_generation, check_translation, models_for
+
+BATCH_JOBS_DIR = os.getenv("BATCH_JOBS_DIR", os.path.join(".cache", "batch_jobs"))
+MAX_REQUESTS_PER_BATCH = int(os.getenv("BATCH_MAX_REQUESTS", "5000"))
+ENDPOINT = "/v1/chat/completions"
+
+# stati del manifest per seriale
+PENDING, SUBMITTED, REJECTED, FAILED, WRITTEN = "pending", "submitted", "rejected", "failed", "written"
+_BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", str(text).lower()).strip("_")
+
+
+def _sig(body):
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _base_text(frase):
+    """Parte italiana di un testo archiviato (prima dei blocchi '--- LINGUA ---')."""
+    return re.split(r"\n*--- [^\n]+ ---\n", str(frase or ""), maxsplit=1)[0].strip()
+
+
+# =====================
+# Lavori
+# =====================
+class RegenerateJob:
+    kind = "regenerate"
+
+    def __init__(self, registro, out_type, length):
+        self.registro, self.out_type, self.length = registro, out_type, length
+        self.name = _slug(f"regenerate_{registro}_{out_type}_{length}")
+        self.column = _slug(f"frase_{registro}_{out_type}_{length}")
+        self.models = models_for("generation", ai_services.GEN_MODEL, registro, length)
+        self.source_columns = ["seriale", "ricetta"]
+
+    def body(self, row, model, capped=True):
+        ricetta = str(row["ricetta"] or "").strip()
+        if not ricetta:
+            return None
+        from generation_budget import get_budget
+        budget = get_budget(self.registro, self.out_type, self.length)
+        body = {"model": model, "messages": ai_services.build_generation_messages(ricetta, self.registro, self.out_type, self.length)}
+        if capped and ai_services.TOKEN_BUDGET and budget.max_tokens:
+            body["max_tokens"] = budget.max_tokens
+        return body
+
+    def check(self, row, text):
+        return check_generation(text, str(row["ricetta"] or ""), self.registro, self.out_type, self.length)
+
+
+class TranslateJob:
+    kind = "translate"
+
+    def __init__(self, language, registro):
+        self.language, self.registro = language, registro
+        self.name = _slug(f"translate_{language}")
+        self.column = _slug(f"frase_iconica_{language}")
+        self.models = models_for("translation", ai_services.GEN_MODEL)
+        self.source_columns = ["seriale", "frase_iconica"]
+
+    def body(self, row, model, capped=True):
+        text = _base_text(row["frase_iconica"])
+        if not text:
+            return None
+        prompt = ai_services.build_translation_prompt(text, self.language, self.registro)
+        return {"model": model, "messages": [{"role": "user", "content": prompt}]}
+
+    def check(self, row, text):
+        return check_translation(text, _base_text(row["frase_iconica"]))
+
+
+# =====================
+# Backend
+# =====================
+def parse_output_line(line):
+    """(custom_id, testo, errore, troncato) da una riga di output della Batch API."""
+    rec = json.loads(line)
+    response = rec.get("response") or {}
+    if rec.get("error") or response.get("status_code", 200) != 200:
+        return rec["custom_id"], None, str(rec.get("error") or response.get("body")), False
+    choices = (response.get("body") or {}).get("choices") or [{}]
+    text = ((choices[0].get("message") or {}).get("content") or "").strip()
+    return rec["custom_id"], text, None, choices[0].get("finish_reason") == "length"
+
+
+class OpenAIBatchBackend:
+    """Batch API di OpenAI: risultati entro la finestra di completamento, a costo ridotto."""
+    name = "openai"
+
+    def __init__(self, client=None, completion_window="24h"):
+        self.client = client or ai_services.get_client()
+        self.completion_window = completion_window
+
+    def submit(self, jsonl_path):
+        with open(jsonl_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=self.completion_window
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield parse_output_line(line)
+
+
+class LocalBatchBackend:
+    """
+    Stand-in locale con la stessa interfaccia: esegue le richieste del JSONL col
+    client di ai_services (anche quello finto dei benchmark) e scrive l'output nel
+    formato della Batch API. Gli id restano validi finché gira il processo;
+    un batch locale perso (processo riavviato) risulta "expired" e si reinvia.
+    """
+    name = "local"
+    _batches = {}
+    _lock = threading.Lock()
+
+    def __init__(self, workers=4):
+        self.workers = workers
+
+    def submit(self, jsonl_path):
+        batch_id = "local_" + hashlib.sha256(f"{jsonl_path}{time.time()}".encode()).hexdigest()[:12]
+        out_path = jsonl_path + ".out"
+        with self._lock:
+            self._batches[batch_id] = {"status": "in_progress", "output": out_path}
+        threading.Thread(target=self._run, args=(batch_id, jsonl_path, out_path), daemon=True).start()
+        return batch_id
+
+    def _call(self, line):
+        req = json.loads(line)
+        try:
+            resp = ai_services.get_client().chat.completions.create(**req["body"])
+            choice = resp.choices[0]
+            body = {"choices": [{"message": {"role": "assistant", "content": choice.message.content},
+                                 "finish_reason": getattr(choice, "finish_reason", None)}],
+                    "usage": ai_services._usage(resp)}
+            return {"custom_id": req["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+        except Exception as e:
+            return {"custom_id": req["custom_id"], "response": None, "error": {"message": str(e)}}
+
+    def _run(self, batch_id, jsonl_path, out_path):
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            records = list(pool.map(self._call, lines))
+        with open(out_path, "w", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        with self._lock:
+            self._batches[batch_id]["status"] = "completed"
+
+    def status(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id, {}).get("status", "expired")
+
+    def results(self, batch_id):
+        with self._lock:
+            out_path = self._batches[batch_id]["output"]
+        with open(out_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield parse_output_line(line)
+
+
+BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+
+
+# =====================
+# Manifest
+# =====================
+def job_dir(name):
+    return os.path.join(BATCH_JOBS_DIR, name)
+
+
+def load_manifest(name):
+    path = os.path.join(job_dir(name), "manifest.json")
+    if not os.path.exists(path):
+        return {"name": name, "items": {}, "batches": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    """Scrittura atomica: un'interruzione non lascia un manifest a metà."""
+    os.makedirs(job_dir(manifest["name"]), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=job_dir(manifest["name"]), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(job_dir(manifest["name"]), "manifest.json"))
+
+
+def summary(manifest):
+    counts = {}
+    for item in manifest["items"].values():
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    return counts
+
+
+# =====================
+# Esecuzione
+# =====================
+def _rows(job, serials=None):
+    df = archive_manager.read_archive(archive_manager.ARCHIVE_FILE, columns=job.source_columns)
+    rows = {int(r["seriale"]): r for r in df.where(df.notna(), "").to_dict("records")}
+    return {s: r for s, r in rows.items() if serials is None or s in serials}
+
+
+def prepare(job, manifest, rows):
+    """Richieste da inviare: seriali nuovi, cambiati, falliti o scartati (questi col livello successivo)."""
+    requests = []
+    for serial, row in rows.items():
+        base = job.body(row, job.models[0])
+        if base is None:
+            continue
+        base_sig = _sig(base)  # cambia con ricetta, prompt, parametri o modelli
+        item = manifest["items"].get(str(serial), {})
+        status, tier = item.get("status"), item.get("tier", 0)
+        if item.get("base_sig") != base_sig:
+            tier = 0
+        elif status in (WRITTEN, SUBMITTED) or (status == PENDING and "text" in item):
+            continue
+        elif status == REJECTED:
+            if tier + 1 >= len(job.models):
+                continue  # scartato anche dal modello più forte: resta da rivedere a mano
+            tier += 1
+        # max_tokens solo al primo livello: dopo un testo tagliato dal tetto si chiede senza
+        uncapped = tier > 0 or bool(item.get("uncapped") and item.get("base_sig") == base_sig)
+        body = job.body(row, job.models[tier], capped=False) if uncapped else base
+        sig = _sig(body)
+        manifest["items"][str(serial)] = {"status": PENDING, "base_sig": base_sig, "sig": sig, "tier": tier}
+        if uncapped:
+            manifest["items"][str(serial)]["uncapped"] = True
+        requests.append({"custom_id": f"{job.name}:{serial}:{sig}", "method": "POST", "url": ENDPOINT, "body": body})
+    return requests
+
+
+def submit(job, manifest, backend, requests):
+    for start in range(0, len(requests), MAX_REQUESTS_PER_BATCH):
+        chunk = requests[start:start + MAX_REQUESTS_PER_BATCH]
+        path = os.path.join(job_dir(job.name), f"input_{int(time.time() * 1000)}_{start}.jsonl")
+        os.makedirs(job_dir(job.name), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for req in chunk:
+                f.write(json.dumps(req, ensure_ascii=False) + "\n")
+        batch_id = backend.submit(path)
+        manifest["batches"][batch_id] = {"status": "submitted", "input": path, "backend": backend.name, "n": len(chunk)}
+        for req in chunk:
+            serial = req["custom_id"].split(":")[1]
+            manifest["items"][serial].update(status=SUBMITTED, batch_id=batch_id)
+        save_manifest(manifest)
+        print(f"Inviato batch {batch_id} ({len(chunk)} richieste)")
+
+
+def collect(job, manifest, backend, rows, poll_s):
+    """Interroga i batch aperti finché non finiscono; ritorna {seriale: testo} da scrivere."""
+    to_write = {}
+    while True:
+        open_batches = [b for b, info in manifest["batches"].items() if info["status"] not in _BATCH_DONE]
+        if not open_batches:
+            return to_write
+        for batch_id in open_batches:
+            status = backend.status(batch_id)
+            if status not in _BATCH_DONE:
+                continue
+            manifest["batches"][batch_id]["status"] = status
+            received = set()
+            if status == "completed":
+                for custom_id, text, error, truncated in backend.results(batch_id):
+                    _, serial, sig = custom_id.split(":")
+                    item = manifest["items"].get(serial)
+                    if item is None or item.get("sig") != sig:
+                        continue  # richiesta superata da una più recente
+                    received.add(serial)
+                    row = rows.get(int(serial))
+                    problems = [error] if error else (job.check(row, text) if row is not None else [])
+                    if truncated:
+                        # testo tagliato da max_tokens: livello successivo, oppure stesso livello senza tetto
+                        problems = ["testo tagliato da max_tokens"] + problems
+                        if item["tier"] + 1 < len(job.models):
+                            item.update(status=REJECTED, problems=problems)
+                        else:
+                            item.update(status=FAILED, problems=problems, uncapped=True)
+                    elif error:
+                        item.update(status=FAILED, problems=problems)
+                    elif problems and item["tier"] + 1 < len(job.models):
+                        item.update(status=REJECTED, problems=problems)
+                    else:
+                        # ultimo livello: si accetta comunque (come model_router.route), ma si annota
+                        item.update(status=PENDING, text=text, problems=problems)
+                        to_write[int(serial)] = text
+            # richieste del batch senza risposta (batch fallito / scaduto): si ritentano al prossimo giro
+            for serial, item in manifest["items"].items():
+                if item.get("batch_id") == batch_id and item["status"] == SUBMITTED and serial not in received:
+                    item["status"] = FAILED
+            save_manifest(manifest)
+            print(f"Batch {batch_id}: {status}")
+        if any(info["status"] not in _BATCH_DONE for info in manifest["batches"].values()):
+            time.sleep(poll_s)
+
+
+def write_back(job, manifest, to_write):
+    # anche i testi ricevuti ma non ancora scritti in un giro interrotto
+    for serial, item in manifest["items"].items():
+        if item["status"] == PENDING and "text" in item:
+            to_write.setdefault(int(serial), item["text"])
+    if not to_write:
+        return 0
+    written = archive_manager.update_entries(job.column, to_write)
+    for serial in written:
+        item = manifest["items"][str(serial)]
+        item["status"] = WRITTEN
+        item.pop("text", None)
+    save_manifest(manifest)
+    return len(written)
+
+
+def run(job, backend, serials=None, poll_s=30.0):
+    manifest = load_manifest(job.name)
+    manifest.setdefault("column", job.column)
+    rows = _rows(job, serials)
+
+    # i batch aperti di un giro precedente si interrogano con lo stesso backend
+    for batch_id, info in manifest["batches"].items():
+        if info["status"] not in _BATCH_DONE and info["backend"] != backend.name:
+            raise SystemExit(f"Il batch {batch_id} è del backend '{info['backend']}': rilancia con quello.")
+
+    to_write = collect(job, manifest, backend, rows, poll_s)
+    write_back(job, manifest, to_write)
+
+    # un giro per livello di modello: gli scartati ripartono subito col livello successivo
+    for round_ in range(len(job.models)):
+        requests = prepare(job, manifest, rows)
+        save_manifest(manifest)
+        if not requests:
+            if round_ == 0:
+                print("Niente da fare: archivio già aggiornato.")
+            break
+        submit(job, manifest, backend, requests)
+        to_write = collect(job, manifest, backend, rows, poll_s)
+        n = write_back(job, manifest, to_write)
+        print(f"Scritti {n} valori nella colonna '{job.column}'")
+    return summary(manifest)
+
+
+def _parse_serials(spec):
+    if not spec:
+        return None
+    serials = set()
+    for part in spec.split(","):
+        a, _, b = part.partition("-")
+        serials.update(range(int(a), int(b or a) + 1))
+    return serials
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rigenerazione / traduzione dell'archivio via batch.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--backend", choices=sorted(BACKENDS), default="openai")
+        p.add_argument("--serials", help="es. 1-50,72 (default: tutto l'archivio)")
+        p.add_argument("--poll", type=float, default=30.0, help="secondi tra un controllo e l'altro")
+
+    p = sub.add_parser("regenerate", help="rigenera i testi di un registro / tipo / lunghezza")
+    p.add_argument("--registro", required=True)
+    p.add_argument("--tipo", choices=["Menu", "Cameriere"], default="Menu")
+    p.add_argument("--lunghezza", choices=["Corto", "Lungo"], default="Corto")
+    common(p)
+
+    p = sub.add_parser("translate", help="traduce frase_iconica in una lingua")
+    p.add_argument("--lingua", required=True)
+    p.add_argument("--registro", default="classico_elegante", help="registro da citare nel prompt di traduzione")
+    common(p)
+
+    p = sub.add_parser("status", help="stato di un lavoro")
+    p.add_argument("job")
+
+    args = parser.parse_args(argv)
+    if args.command == "status":
+        manifest = load_manifest(args.job)
+        print(json.dumps({"items": summary(manifest), "batches": manifest["batches"]}, indent=1))
+        return
+
+    if not os.path.exists(archive_manager.ARCHIVE_FILE):
+        sys.exit(f"Archivio non trovato: {archive_manager.ARCHIVE_FILE}")
+    if args.registro not in ai_services.get_registri():
+        sys.exit(f"Registro sconosciuto: {args.registro}")
+    if args.command == "regenerate":
+        job = RegenerateJob(args.registro, args.tipo, args.lunghezza)
+    else:
+        job = TranslateJob(args.lingua, args.registro)
+
+    counts = run(job, BACKENDS[args.backend](), _parse_serials(args.serials), args.poll)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
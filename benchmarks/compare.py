@@ -0,0 +1,54 @@
+"""
+Confronta due file di risultati di run_benchmarks.py (mediane).
+
+Uso:
+    python benchmarks/compare.py benchmarks/results/abc123.json benchmarks/results/def456.json
+    python benchmarks/compare.py old.json new.json --threshold 15
+
+Exit code 1 se almeno un benchmark peggiora oltre la soglia (%).
+"""
+import sys
+import json
+import argparse
+
+
+def _flatten(results):
+    for group, benches in results.items():
+        for name, stats in benches.items():
+            yield f"{group}/{name}", stats["median_ms"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto risultati benchmark.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="soglia di regressione in %% (default 10)")
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        cand = json.load(f)
+
+    base_map = dict(_flatten(base["results"]))
+    cand_map = dict(_flatten(cand["results"]))
+
+    print(f"{'benchmark':60s} {base['meta']['commit']:>12s} {cand['meta']['commit']:>12s} {'delta':>8s}")
+    regressions = 0
+    for name in sorted(set(base_map) | set(cand_map)):
+        b, c = base_map.get(name), cand_map.get(name)
+        if b is None or c is None:
+            print(f"{name:60s} {str(b):>12s} {str(c):>12s} {'n/a':>8s}")
+            continue
+        delta = (c - b) / b * 100 if b else 0.0
+        flag = ""
+        if delta > args.threshold:
+            flag = "  <-- regressione"
+            regressions += 1
+        print(f"{name:60s} {b:12.3f} {c:12.3f} {delta:+7.1f}%{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
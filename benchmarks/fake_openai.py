@@ -0,0 +1,94 @@
+"""
+Client OpenAI finto, in-process, per benchmark e test offline.
+
+Implementa solo quello che usa ai_services:
+    chat.completions.create, audio.transcriptions.create, images.generate
+e risponde con contenuti fissi dopo una latenza opzionale.
+
+Uso:
+    import ai_services
+    from benchmarks.fake_openai import FakeOpenAI
+    ai_services.set_client(FakeOpenAI(latency=0.0))
+"""
+import io
+import time
+import base64
+from types import SimpleNamespace
+
+FAKE_TEXT = (
+    "Tagliolini al burro di malga, tartufo nero e scorza di limone. "
+    "Mantecatura lenta, profumo netto di sottobosco."
+)
+
+
+def _png_bytes(size=64, color=(220, 210, 190)):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model=None, messages=None, max_tokens=None, stream=False, **kwargs):
+        self.owner._sleep()
+        self.owner.calls["chat"] += 1
+        text, finish_reason = self.owner.text, "stop"
+        if max_tokens and len(text) // 4 > max_tokens:
+            # come l'API: testo tagliato al tetto (~4 caratteri per token)
+            text, finish_reason = text[:max_tokens * 4], "length"
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages or [])
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_chars // 4,
+            completion_tokens=len(text) // 4,
+            total_tokens=prompt_chars // 4 + len(text) // 4,
+        )
+        if stream:
+            words = text.split()
+            return iter(
+                SimpleNamespace(choices=[SimpleNamespace(
+                    delta=SimpleNamespace(content=word + " "),
+                    finish_reason=finish_reason if i == len(words) - 1 else None,
+                )], usage=None)
+                for i, word in enumerate(words)
+            )
+        message = SimpleNamespace(content=text, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage, model=model)
+
+
+class _Transcriptions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model=None, file=None, **kwargs):
+        self.owner._sleep()
+        self.owner.calls["transcription"] += 1
+        return SimpleNamespace(text=self.owner.text)
+
+
+class _Images:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def generate(self, model=None, prompt=None, n=1, **kwargs):
+        self.owner._sleep()
+        self.owner.calls["images"] += 1
+        b64 = base64.b64encode(self.owner.image_bytes).decode("ascii")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=b64, url=None) for _ in range(n)])
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.0, text=FAKE_TEXT, image_size=64):
+        self.latency = latency
+        self.text = text
+        self.image_bytes = _png_bytes(image_size)
+        self.calls = {"chat": 0, "transcription": 0, "images": 0}
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.audio = SimpleNamespace(transcriptions=_Transcriptions(self))
+        self.images = _Images(self)
+
+    def _sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
@@ -0,0 +1,231 @@
+"""
+Server HTTP locale che imita le API OpenAI usate dall'app (solo stdlib).
+
+Endpoint:
+    POST /v1/chat/completions        (anche stream=true, SSE)
+    POST /v1/audio/transcriptions
+    POST /v1/images/generations
+
+Latenze configurabili per endpoint, errori 500 e 429 (rate limit) casuali.
+
+Uso:
+    python benchmarks/fake_openai_server.py --port 8765 --latency lognormal:-0.7,0.5 \\
+        --latency-images uniform:2,6 --error-rate 0.01 --rate-limit 0.05
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake streamlit run app.py
+
+Specifiche di latenza (secondi):
+    fixed:0.3        sempre 0.3
+    uniform:0.2,1.5  uniforme tra 0.2 e 1.5
+    lognormal:mu,s   lognormale (mediana = e^mu)
+"""
+import io
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_TEXT = (
+    "Tagliolini al burro di malga, tartufo nero e scorza di limone. "
+    "Mantecatura lenta, profumo netto di sottobosco."
+)
+
+
+def parse_latency(spec):
+    """Ritorna una funzione senza argomenti che estrae una latenza (s) dalla distribuzione."""
+    if not spec:
+        return lambda: 0.0
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Distribuzione di latenza sconosciuta: {spec}")
+
+
+def _png_b64(size=256):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), (220, 210, 190)).save(buf, "PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class FakeConfig:
+    def __init__(self, latency=None, latency_chat=None, latency_transcription=None, latency_images=None,
+                 error_rate=0.0, rate_limit=0.0, text=FAKE_TEXT, image_size=256):
+        default = latency
+        self.latency = {
+            "chat": parse_latency(latency_chat or default),
+            "transcription": parse_latency(latency_transcription or default),
+            "images": parse_latency(latency_images or default),
+        }
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.text = text
+        self.image_b64 = _png_b64(image_size)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors_500": 0, "errors_429": 0}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # silenzioso: il load test produce migliaia di richieste
+        pass
+
+    @property
+    def cfg(self):
+        return self.server.fake_config
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_failures(self):
+        """True se è stata inviata una risposta d'errore simulata."""
+        r = random.random()
+        if r < self.cfg.rate_limit:
+            with self.cfg.lock:
+                self.cfg.stats["errors_429"] += 1
+            self._send_json(429, {"error": {"message": "Rate limit (fake)", "type": "rate_limit_exceeded"}},
+                            headers={"Retry-After": "1"})
+            return True
+        if r < self.cfg.rate_limit + self.cfg.error_rate:
+            with self.cfg.lock:
+                self.cfg.stats["errors_500"] += 1
+            self._send_json(500, {"error": {"message": "Internal error (fake)", "type": "server_error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        with self.cfg.lock:
+            self.cfg.stats["requests"] += 1
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            endpoint = "chat"
+        elif path.endswith("/audio/transcriptions"):
+            endpoint = "transcription"
+        elif path.endswith("/images/generations"):
+            endpoint = "images"
+        else:
+            self._send_json(404, {"error": {"message": f"Endpoint non simulato: {self.path}"}})
+            return
+
+        time.sleep(max(0.0, self.cfg.latency[endpoint]()))
+        if self._inject_failures():
+            return
+
+        if endpoint == "chat":
+            self._chat(json.loads(raw or b"{}"))
+        elif endpoint == "transcription":
+            self._send_json(200, {"text": self.cfg.text})
+        else:
+            req = json.loads(raw or b"{}")
+            n = int(req.get("n") or 1)
+            self._send_json(200, {"created": int(time.time()), "data": [{"b64_json": self.cfg.image_b64}] * n})
+
+    def _chat(self, req):
+        text = self.cfg.text
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in req.get("messages") or [])
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(text) // 4,
+            "total_tokens": prompt_chars // 4 + len(text) // 4,
+        }
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": req.get("model", "fake")}
+
+        if not req.get("stream"):
+            self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }]))
+            return
+
+        # SSE: una parola per chunk, chiusura con [DONE]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            chunk = dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0,
+                "delta": {"content": word + (" " if i < len(words) - 1 else "")},
+                "finish_reason": None,
+            }])
+            try:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return  # il client ha chiuso lo stream in anticipo
+        final = dict(base, object="chat.completion.chunk", usage=usage,
+                     choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.close_connection = True
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """Avvia il server in un thread daemon. Ritorna (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.fake_config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_config_args(parser):
+    parser.add_argument("--latency", default="fixed:0.05", help="distribuzione di default (es. lognormal:-0.7,0.5)")
+    parser.add_argument("--latency-chat")
+    parser.add_argument("--latency-transcription")
+    parser.add_argument("--latency-images")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="quota di risposte 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="quota di risposte 429")
+
+
+def config_from_args(args):
+    return FakeConfig(
+        latency=args.latency,
+        latency_chat=args.latency_chat,
+        latency_transcription=args.latency_transcription,
+        latency_images=args.latency_images,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server OpenAI finto per test di carico.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.fake_config = config_from_args(args)
+    print(f"Fake OpenAI su http://{args.host}:{args.port}/v1 (Ctrl+C per fermare)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.fake_config.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Test di carico del flusso "ricetta -> testi -> immagine -> archivio" contro il
+server OpenAI finto (benchmarks/fake_openai_server.py).
+
+Ogni sessione simulata (un thread, come una sessione Streamlit) ripete il flusso:
+    generate_output per i registri scelti -> translate_text per le lingue
+    -> generate_dish_images (senza cache) -> add_archive_entry
+usando il client OpenAI reale (HTTP, retry e pool di connessioni compresi).
+L'archivio viene scritto in una cartella temporanea.
+
+Uso:
+    python benchmarks/load_test.py --sessions 10 --flows 5
+    python benchmarks/load_test.py --sessions 20 --latency lognormal:-0.7,0.5 --latency-images uniform:2,6 --rate-limit 0.05
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8765/v1     # server già avviato a parte
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+import ai_services
+import archive_manager
+from generation_budget import variant_report
+from model_router import routing_report
+from benchmarks.fake_openai_server import add_config_args, config_from_args, start_server
+from benchmarks.run_benchmarks import SAMPLE_RECIPE
+
+LANGUAGES = ["Inglese", "Francese"]
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(samples):
+    return {
+        "n": len(samples),
+        "p50_ms": round(percentile(samples, 50), 1),
+        "p95_ms": round(percentile(samples, 95), 1),
+        "p99_ms": round(percentile(samples, 99), 1),
+        "max_ms": round(max(samples), 1),
+        "mean_ms": round(statistics.fmean(samples), 1),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, step, ms):
+        with self.lock:
+            self.samples[step].append(ms)
+
+    def timed(self, step, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            with self.lock:
+                self.errors[f"{step}: {type(e).__name__}"] += 1
+            raise
+        finally:
+            self.add(step, (time.perf_counter() - t0) * 1000)
+
+
+def run_flow(rec, session, flow, registri, languages, image_model):
+    # ricetta diversa per flusso: niente hit sulla cache immagini tra sessioni
+    ricetta = f"{SAMPLE_RECIPE} (sessione {session}, flusso {flow})"
+    t0 = time.perf_counter()
+    testi = {}
+    for registro in registri:
+        testi[registro] = rec.timed("generate_output", ai_services.generate_output, ricetta, registro, "Menu", "Corto")
+        for lang in languages:
+            rec.timed("translate_text", ai_services.translate_text, testi[registro], lang, registro)
+    paths = rec.timed("generate_dish_images", ai_services.generate_dish_images, ricetta,
+                      model=image_model, n=1, use_cache=False)
+    with open(paths[0], "rb") as f:
+        img = f.read()
+    rec.timed("add_archive_entry", archive_manager.add_archive_entry,
+              f"Carico {session}-{flow}", ricetta, testi[registri[0]], img, "load")
+    rec.add("flow", (time.perf_counter() - t0) * 1000)
+
+
+def run_session(rec, session, flows, registri, languages, image_model, think_time):
+    done = 0
+    for flow in range(flows):
+        try:
+            run_flow(rec, session, flow, registri, languages, image_model)
+            done += 1
+        except Exception:
+            pass  # già contato dal Recorder
+        if think_time:
+            time.sleep(random.uniform(0, think_time))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico con server OpenAI finto.")
+    parser.add_argument("--sessions", type=int, default=10, help="sessioni concorrenti")
+    parser.add_argument("--flows", type=int, default=3, help="flussi completi per sessione")
+    parser.add_argument("--registers", type=int, default=2, help="registri generati per flusso")
+    parser.add_argument("--languages", type=int, default=1, help="traduzioni per registro")
+    parser.add_argument("--image-model", default="gpt-image-1.5")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa massima (s) tra flussi")
+    parser.add_argument("--max-retries", type=int, default=2, help="retry del client OpenAI (429/5xx)")
+    parser.add_argument("--base-url", help="server già avviato; altrimenti ne parte uno in-process")
+    parser.add_argument("--json", help="salva il report JSON in questo file")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_server(config_from_args(args))
+
+    ai_services.set_client(OpenAI(base_url=base_url, api_key="fake", max_retries=args.max_retries))
+    registri = list(ai_services.get_registri())[:args.registers]
+    languages = LANGUAGES[:args.languages]
+
+    rec = Recorder()
+    prev = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="voce_load_") as tmp:
+        os.chdir(tmp)
+        ai_services.IMAGE_CACHE_DIR = os.path.join(tmp, "dish_images")
+        try:
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+                futures = [
+                    pool.submit(run_session, rec, s, args.flows, registri, languages, args.image_model, args.think_time)
+                    for s in range(args.sessions)
+                ]
+                completed = sum(f.result() for f in futures)
+            elapsed = time.perf_counter() - t0
+            serials = archive_manager.get_next_serial() - 1
+        finally:
+            os.chdir(prev)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "elapsed_s": round(elapsed, 2),
+        "flows_completed": completed,
+        "flows_failed": args.sessions * args.flows - completed,
+        "throughput_flows_per_s": round(completed / elapsed, 3) if elapsed else None,
+        "archived_rows": int(serials),
+        "steps": {step: summarize(samples) for step, samples in rec.samples.items()},
+        "errors": dict(rec.errors),
+        "variants": variant_report(),
+        "routing": routing_report(),
+    }
+    if server is not None:
+        report["server"] = dict(server.fake_config.stats)
+        server.shutdown()
+
+    print(f"{'step':24s} {'n':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for step, s in report["steps"].items():
+        print(f"{step:24s} {s['n']:6d} {s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['p99_ms']:9.1f} {s['max_ms']:9.1f}")
+    print(f"\n{completed} flussi in {elapsed:.1f}s -> {report['throughput_flows_per_s']} flussi/s "
+          f"({report['flows_failed']} falliti, {report['archived_rows']} righe in archivio)")
+    if report["variants"]:
+        print(f"\n{'variante':40s} {'n':>5s} {'token':>7s} {'lat ms':>8s} {'stop':>5s}")
+        for v in report["variants"]:
+            name = f"{v['registro']} / {v['tipo']} / {v['lunghezza']}"
+            print(f"{name:40s} {v['n']:5d} {v['token_medi']:7.1f} {v['latenza_media_ms']:8.1f} {v['stop_anticipati']:5d}")
+    for r in report["routing"]:
+        print(f"routing {r['compito']}: {r['escalation']}/{r['chiamate']} escalation, "
+              f"latenza risparmiata {r['latenza_risparmiata_s']} s ({r['latenza_media_ms']})")
+    if report["errors"]:
+        print("Errori:", json.dumps(report["errors"], indent=1))
+    if "server" in report:
+        print("Server:", json.dumps(report["server"]))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
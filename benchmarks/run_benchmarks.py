@@ -0,0 +1,309 @@
+"""
+Benchmark: archivio, rendering cover, assemblaggio prompt e preparazione audio.
+
+Crea archivi sintetici (default 100 / 1k / 10k piatti, con immagini) in una
+cartella temporanea e misura le funzioni calde. Nessuna chiamata OpenAI reale:
+ai_services usa il client finto di benchmarks/fake_openai.py.
+
+Uso:
+    python benchmarks/run_benchmarks.py                      # -> benchmarks/results/<commit>.json
+    python benchmarks/run_benchmarks.py --sizes 100 1000 --repeat 3
+    python benchmarks/compare.py results/old.json results/new.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+import pandas as pd
+from PIL import Image
+
+import ai_services
+import archive_manager
+import image_store
+from shared_cache import get_cache
+from benchmarks.fake_openai import FakeOpenAI
+from modules_cover.cover_data import load_piatti
+from modules_cover.cover_layouts import load_layouts
+from modules_cover.cover_render import crop_fill, wrap_text_to_lines, render_cover_pdf, COMPRESSION_PROFILES
+
+DEFAULT_SIZES = [100, 1000, 10000]
+DISTINCT_IMAGES = 20  # le altre immagini sono duplicati (deduplicati dall'image store)
+
+SAMPLE_RECIPE = (
+    "Tagliolini all'uovo 120 g | burro di malga 40 g | tartufo nero 15 g | limone non trattato 1 | "
+    "Parmigiano 24 mesi 20 g. Cuocere i tagliolini 2 minuti, mantecare con burro e acqua di cottura, "
+    "completare con scorza di limone e lamelle di tartufo."
+)
+SAMPLE_PHRASE = "Burro di malga, tartufo nero e scorza di limone: una mantecatura lenta che profuma di bosco. " * 2
+
+
+def measure(fn, repeat=5, warmup=1):
+    """Esegue fn più volte; ritorna min/mediana/max in ms."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "repeat": repeat,
+    }
+
+
+def _png(color, size=1024):
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def build_archive(workdir, n):
+    """Archivio sintetico con n piatti in workdir (Excel + image store + cartella cover)."""
+    os.makedirs(workdir, exist_ok=True)
+    prev = os.getcwd()
+    os.chdir(workdir)
+    try:
+        tags = ["primo", "secondo", "dolce", "antipasto", "mare", "contorno"]
+        rows = [{
+            "seriale": i,
+            "titolo": f"Piatto {i}",
+            "ricetta": SAMPLE_RECIPE,
+            "frase_iconica": SAMPLE_PHRASE,
+            "immagine_path": "",
+            "tags": tags[i % len(tags)],
+            "data_archiviazione": "2026-01-01 12:00:00",
+        } for i in range(1, n + 1)]
+        pd.DataFrame(rows, columns=archive_manager.ARCHIVE_COLUMNS).to_excel(archive_manager.ARCHIVE_FILE, index=False)
+
+        root = image_store.IMAGES_DIR
+        distinct = min(n, DISTINCT_IMAGES)
+        for i in range(1, distinct + 1):
+            image_store.store_image(i, _png((i * 11 % 255, 120, 200 - i * 7 % 200)), root)
+
+        # i restanti seriali puntano alle stesse immagini (scrittura indice in blocco)
+        index = image_store.load_index(root)
+        hashes = [index["serials"][str(i)] for i in range(1, distinct + 1)]
+        for i in range(distinct + 1, n + 1):
+            index["serials"][str(i)] = hashes[i % distinct]
+        image_store._save_index(root, index)
+
+        # struttura attesa dal Cover Menu: <base>/archivio_piatti.xlsx + <base>/img
+        cover_dir = os.path.join(workdir, "cover")
+        os.makedirs(os.path.join(cover_dir, "assets"), exist_ok=True)
+        shutil.copy(archive_manager.ARCHIVE_FILE, os.path.join(cover_dir, "archivio_piatti.xlsx"))
+        shutil.copytree(root, os.path.join(cover_dir, "img"))
+        Image.new("RGB", (2480, 3508), (245, 238, 225)).save(os.path.join(cover_dir, "assets", "background_a4.png"))
+    finally:
+        os.chdir(prev)
+    return cover_dir
+
+
+def bench_archive(workdir, n, repeat):
+    cover_dir = build_archive(workdir, n)
+    prev = os.getcwd()
+    os.chdir(workdir)
+    try:
+        img = _png((10, 20, 30))
+        out = {
+            "get_next_serial": measure(archive_manager.get_next_serial, repeat),
+            # senza cache condivisa: si misura la lettura vera
+            "load_piatti": measure(lambda: (get_cache().invalidate("archive"), load_piatti(cover_dir)), repeat),
+            # metadati immagini: scansione veloce (cartella invariata) e completa
+            "refresh_metadata": measure(lambda: image_store.refresh_metadata(os.path.join(cover_dir, "img")), repeat),
+            "refresh_metadata[full]": measure(
+                lambda: image_store.refresh_metadata(os.path.join(cover_dir, "img"), full=True), repeat
+            ),
+            "create_archive_zip": measure(archive_manager.create_archive_zip, repeat),
+            # ogni chiamata aggiunge una riga: poche ripetizioni
+            "add_archive_entry": measure(
+                lambda: archive_manager.add_archive_entry("Bench", SAMPLE_RECIPE, SAMPLE_PHRASE, img, "primo"),
+                repeat=min(repeat, 3), warmup=0
+            ),
+        }
+    finally:
+        os.chdir(prev)
+    return out, cover_dir
+
+
+def bench_formats(workdir, repeat):
+    """Excel vs snapshot Parquet vs Arrow IPC (feather, memory-mapped) sullo stesso archivio."""
+    import pyarrow.feather as feather
+
+    xlsx = os.path.join(workdir, archive_manager.ARCHIVE_FILE)
+    cover_cols = ["seriale", "titolo", "frase_iconica"]
+    df = pd.read_excel(xlsx)
+    parquet = archive_manager.write_snapshot(xlsx, df)
+    ipc = os.path.join(workdir, "archivio_piatti.arrow")
+    feather.write_feather(df, ipc, compression="uncompressed")
+
+    slow = dict(repeat=min(repeat, 3), warmup=0)  # openpyxl: secondi a 10k righe
+    out = {
+        "xlsx_all": measure(lambda: pd.read_excel(xlsx), **slow),
+        "xlsx_cover_cols": measure(lambda: pd.read_excel(xlsx, usecols=cover_cols), **slow),
+        "parquet_all": measure(lambda: pd.read_parquet(parquet), repeat),
+        "parquet_cover_cols": measure(lambda: pd.read_parquet(parquet, columns=cover_cols), repeat),
+        "arrow_ipc_cover_cols": measure(lambda: feather.read_table(ipc, columns=cover_cols, memory_map=True), repeat),
+        "read_archive[seriale]": measure(lambda: archive_manager.read_archive(xlsx, columns=["seriale"]), repeat),
+    }
+    sizes = {name: os.path.getsize(path) for name, path in (("xlsx", xlsx), ("parquet", parquet), ("arrow_ipc", ipc))}
+    return out, sizes
+
+
+def bench_render(cover_dir, repeat):
+    piatti = load_piatti(cover_dir)
+    by_serial = {p["seriale"]: p for p in piatti}
+    background = os.path.join(cover_dir, "assets", "background_a4.png")
+    src_img = next(p["img_path"] for p in piatti if p["img_path"])
+
+    out = {
+        "crop_fill_image": measure(lambda: crop_fill(Image.open(src_img).convert("RGB"), 1100, 950), repeat),
+        "wrap_text_to_lines": measure(lambda: wrap_text_to_lines(SAMPLE_PHRASE, "Helvetica", 8, 240), repeat * 20),
+    }
+    pdf_path = os.path.join(cover_dir, "bench.pdf")
+    pdf_sizes = {}
+    for key, layout in load_layouts().items():
+        items = [{"seriale": p["seriale"], "img": True, "frase": True} for p in piatti[:layout.capacity]]
+        for profile in COMPRESSION_PROFILES:
+            out[f"render_cover_pdf[{key},{profile}]"] = measure(
+                lambda items=items, key=key, profile=profile: render_cover_pdf(
+                    pdf_path, key, None, None, items, by_serial, background, profile=profile
+                ),
+                repeat
+            )
+            pdf_sizes[f"{key},{profile}"] = os.path.getsize(pdf_path)
+    return out, pdf_sizes
+
+
+def bench_prompt(repeat):
+    from recipe_normalizer import _normalize, normalize_recipe
+
+    ai_services.set_client(FakeOpenAI(latency=0.0))
+    registro = next(iter(ai_services.get_registri()))
+    return {
+        "normalize_recipe[uncached]": measure(
+            lambda: (_normalize.cache_clear(), normalize_recipe(SAMPLE_RECIPE)), repeat * 20
+        ),
+        "build_generation_prompt": measure(
+            lambda: ai_services.build_generation_prompt(SAMPLE_RECIPE, registro, "Menu", "Corto"), repeat * 20
+        ),
+        "generate_output[fake]": measure(
+            lambda: ai_services.generate_output(SAMPLE_RECIPE, registro, "Menu", "Corto"), repeat * 20
+        ),
+    }
+
+
+def _phone_wav(seconds=60, rate=44100, silence_s=3.0):
+    """WAV stereo 16 bit come da telefono: silenzio, 'parlato' (toni a raffica), silenzio."""
+    import wave
+    import numpy as np
+    t = np.arange(int(rate * seconds)) / rate
+    voice = 0.3 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 3 * t) > 0)
+    silence = np.zeros(int(rate * silence_s))
+    mono = np.concatenate([silence, voice, silence])
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes((np.stack([mono, mono], axis=1) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def bench_audio(repeat):
+    """Preparazione audio e trascrizione (server finto via HTTP: conta anche l'upload), prima/dopo."""
+    from openai import OpenAI
+    from audio_preprocess import prepare_audio
+    from benchmarks.fake_openai_server import FakeConfig, start_server
+
+    wav = _phone_wav()
+    server, base_url = start_server(FakeConfig(latency="fixed:0"))
+    ai_services.set_client(OpenAI(base_url=base_url, api_key="fake", max_retries=0))
+    prepared = prepare_audio(wav, ".wav")
+    results = {
+        "prepare_audio[60s]": measure(lambda: prepare_audio(wav, ".wav"), repeat),
+        "transcribe[original]": measure(lambda: ai_services._transcribe(wav, ".wav"), repeat),
+        "transcribe[prepared]": measure(lambda: ai_services._transcribe(prepared.data, prepared.suffix), repeat),
+    }
+    server.shutdown()
+    ai_services.set_client(FakeOpenAI(latency=0.0))
+    sizes = {"original": len(wav), "prepared": len(prepared.data), "codec": prepared.report["codec"]}
+    return results, sizes
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark archivio / cover / prompt.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="file JSON di output (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {"prompt": bench_prompt(args.repeat)}
+    print("prompt:", json.dumps(results["prompt"], indent=1))
+    results["audio"], audio_sizes = bench_audio(args.repeat)
+    print("audio:", json.dumps(results["audio"], indent=1), "bytes:", audio_sizes)
+
+    format_sizes = {}
+    with tempfile.TemporaryDirectory(prefix="voce_bench_") as tmp:
+        cover_dir = None
+        for n in args.sizes:
+            t0 = time.perf_counter()
+            results[f"archive_{n}"], dir_n = bench_archive(os.path.join(tmp, str(n)), n, args.repeat)
+            cover_dir = cover_dir or dir_n
+            print(f"archive_{n} ({time.perf_counter() - t0:.1f}s):", json.dumps(results[f"archive_{n}"], indent=1))
+
+            results[f"formats_{n}"], format_sizes[n] = bench_formats(os.path.join(tmp, str(n)), args.repeat)
+            print(f"formats_{n}:", json.dumps(results[f"formats_{n}"], indent=1), "bytes:", format_sizes[n])
+
+        results["render"], pdf_sizes = bench_render(cover_dir, args.repeat)
+        print("render:", json.dumps(results["render"], indent=1), "bytes:", pdf_sizes)
+
+    payload = {
+        "meta": {
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "format_sizes": format_sizes,
+            "audio_sizes": audio_sizes,
+            "pdf_sizes": pdf_sizes,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"Risultati salvati in {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark di avvio: tempo di import (a freddo) per modulo.
+
+Ogni modulo viene importato in un processo Python nuovo con `-X importtime`,
+così i tempi non si contaminano a vicenda.
+
+Uso:
+    python benchmarks/startup_imports.py
+    python benchmarks/startup_imports.py --json startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Librerie esterne e moduli dell'app (nell'ordine in cui la pagina Tool li carica)
+MODULES = [
+    "streamlit",
+    "yaml",
+    "pandas",
+    "openpyxl",
+    "docx",
+    "openai",
+    "requests",
+    "reportlab.pdfgen.canvas",
+    "PIL.Image",
+    "ai_services",
+    "archive_manager",
+    "docx_export",
+    "modules_cover.cover_app_ui",
+]
+
+
+def import_time_ms(module):
+    """Tempo cumulativo di import (ms) di `module` in un interprete pulito, None se non installato."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        return None
+
+    # righe: "import time:  self [us] | cumulative | imported package"
+    for line in reversed(proc.stderr.splitlines()):
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2].rstrip()
+        if name.strip() == module and not name.startswith("  "):
+            return int(parts[1]) / 1000.0
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo di import per modulo (a freddo).")
+    parser.add_argument("--json", help="salva i risultati in questo file JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        ms = import_time_ms(module)
+        results[module] = ms
+        label = "non installato" if ms is None else f"{ms:8.1f} ms"
+        print(f"{module:32s} {label}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "import_ms": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
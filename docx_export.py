@@ -0,0 +1,93 @@
+import io
+import re
+
+from shared_cache import get_cache
+from profiling import traced
+from docx import Document
+from docx.shared import Pt, RGBColor
+
+PRIMARY_RGB = RGBColor(0xC9, 0xA2, 0x27)  # zafferano (come la UI)
+BASE_LANGUAGE = "Italiano"
+
+# separatore delle traduzioni nell'output: "\n\n--- INGLESE ---\n"
+_LANG_SEP = re.compile(r"^---\s*(.+?)\s*---\s*$", re.MULTILINE)
+
+
+def _save(doc) -> bytes:
+    bio = io.BytesIO()
+    doc.save(bio)
+    bio.seek(0)
+    return bio.read()
+
+
+@traced("export_docx")
+def export_docx(titolo: str, contenuto: str) -> bytes:
+    """DOCX di un singolo testo. Memoizzato per (titolo, contenuto) nella cache condivisa."""
+    return get_cache().get_or_create("docx", ("single", titolo, contenuto), lambda: _build_docx(titolo, contenuto))
+
+
+def _build_docx(titolo, contenuto):
+    doc = Document()
+    doc.add_heading(titolo, level=1)
+
+    for par in contenuto.split("\n"):
+        doc.add_paragraph(par)
+
+    return _save(doc)
+
+
+def split_languages(testo: str):
+    """
+    Divide un output in blocchi per lingua.
+    Ritorna lista [(lingua, testo), ...]; il primo blocco è l'italiano.
+    """
+    parts = _LANG_SEP.split(testo)
+    blocks = [(BASE_LANGUAGE, parts[0].strip())]
+    for i in range(1, len(parts) - 1, 2):
+        blocks.append((parts[i].strip().capitalize(), parts[i + 1].strip()))
+    return [(lang, txt) for lang, txt in blocks if txt]
+
+
+def apply_document_styles(doc):
+    """Stili dei documenti esportati (impostati una volta sugli stili, non per paragrafo)."""
+    normal = doc.styles["Normal"]
+    normal.font.name = "Georgia"
+    normal.font.size = Pt(11)
+
+    for name, size in (("Title", 22), ("Heading 1", 15), ("Heading 2", 12)):
+        style = doc.styles[name]
+        style.font.name = "Georgia"
+        style.font.size = Pt(size)
+        style.font.color.rgb = PRIMARY_RGB
+
+
+@traced("export_docx_combined")
+def export_docx_combined(titolo: str, sottotitolo: str, sezioni: tuple) -> bytes:
+    """
+    Un solo DOCX con tutti i registri e tutte le lingue, costruito in un solo passaggio.
+
+    sezioni: tupla di (registro, testo) — hashable, così il risultato è memoizzato.
+    """
+    return get_cache().get_or_create(
+        "docx", ("combined", titolo, sottotitolo, sezioni),
+        lambda: _build_docx_combined(titolo, sottotitolo, sezioni)
+    )
+
+
+def _build_docx_combined(titolo, sottotitolo, sezioni):
+    doc = Document()
+    apply_document_styles(doc)
+
+    doc.add_heading(titolo, level=0)
+    if sottotitolo:
+        doc.add_paragraph(sottotitolo)
+
+    for registro, testo in sezioni:
+        doc.add_heading(registro, level=1)
+        for lang, blocco in split_languages(testo):
+            doc.add_heading(lang, level=2)
+            for par in blocco.split("\n"):
+                if par.strip():
+                    doc.add_paragraph(par)
+
+    return _save(doc)
@@ -0,0 +1,181 @@
+"""
+Budget di generazione per variante (registro × Menu/Cameriere × Corto/Lungo).
+
+I limiti di frasi stanno già nel prompt di sistema (prompts/system.txt):
+    Versione CORTA: massimo 2 frasi          (vale per Menu e Cameriere)
+    Menu lungo: massimo 4 frasi
+    Cameriere corto: 2–3 frasi               (si prende il massimo)
+Qui diventano:
+    - max_tokens della richiesta (frasi × token per frase + margine), come tetto;
+    - un contatore di frasi sullo stream, che chiude la richiesta appena il
+      limite è raggiunto (early stop).
+Il tetto vale solo dove l'early stop è attivo (dove le frasi si contano); se
+una risposta lo raggiunge comunque (finish_reason "length", testo tagliato a
+metà) ai_services la rifà senza tetto.
+Token per frase, margine ed early stop si regolano nella sezione "budget" di
+rules/registri.yaml, anche per singolo registro.
+
+Tiene anche le statistiche per variante (token in uscita, latenza, stop
+anticipati), mostrate nella pagina Admin e nel test di carico.
+"""
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+
+DEFAULT_TOKENS_PER_SENTENCE = 45
+DEFAULT_MARGIN_TOKENS = 20
+
+_REGISTER_HEADER = re.compile(r'^VINCOLI\b.*\bREGISTRO\s+"([^"]+)"', re.IGNORECASE)
+_VERSION_LIMIT = re.compile(r"versione\s+(corta|lunga)\s*:\s*(.+)$", re.IGNORECASE)
+_VARIANT_LIMIT = re.compile(r"(menu|cameriere)\s+(corto|lungo)\s*:\s*(.+)$", re.IGNORECASE)
+_MAX_NUMBER = re.compile(r"(\d+)\s*(?:[–-]\s*(\d+))?\s*fras", re.IGNORECASE)
+
+# fine frase: . ! ? … seguiti da spazio / a capo (non "2.5", non "ecc.," a metà)
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»”)]*(?=\s)")
+_ABBREVIATIONS = {"ecc", "es", "sig", "dott", "n", "pag", "prof", "st"}
+
+
+def _max_sentences(text):
+    m = _MAX_NUMBER.search(text)
+    if not m:
+        return None
+    return int(m.group(2) or m.group(1))
+
+
+def parse_sentence_limits(system_text):
+    """{(label registro, "Menu"/"Cameriere", "Corto"/"Lungo"): massimo frasi}."""
+    limits = {}
+    label = None
+    for line in system_text.splitlines():
+        line = line.strip(" \t-•")
+        header = _REGISTER_HEADER.match(line)
+        if header:
+            label = header.group(1)
+            continue
+        if label is None:
+            continue
+        m = _VARIANT_LIMIT.search(line)
+        if m and _max_sentences(m.group(3)):
+            limits[(label, m.group(1).capitalize(), m.group(2).capitalize())] = _max_sentences(m.group(3))
+            continue
+        m = _VERSION_LIMIT.search(line)
+        if m and _max_sentences(m.group(2)):
+            length = "Corto" if m.group(1).lower() == "corta" else "Lungo"
+            for out_type in ("Menu", "Cameriere"):
+                limits.setdefault((label, out_type, length), _max_sentences(m.group(2)))
+    return limits
+
+
+@dataclass(frozen=True)
+class Budget:
+    max_sentences: int      # None = nessun limite noto
+    max_tokens: int         # None = nessun tetto
+    early_stop: bool
+
+
+@lru_cache(maxsize=None)
+def _limits():
+    from ai_services import get_system_prompt
+    return parse_sentence_limits(get_system_prompt())
+
+
+def get_budget(registro, out_type, length):
+    """Budget per la variante; registro è la chiave in registri.yaml (o direttamente la label)."""
+    from ai_services import get_rules
+    rules = get_rules()
+    reg = rules["registri"].get(registro) or {}
+    label = reg.get("label", registro) if isinstance(reg, dict) else registro
+
+    conf = rules.get("budget") or {}
+    conf = dict(conf, **((conf.get("registri") or {}).get(registro) or {}))
+    per_sentence = int(conf.get("token_per_frase", DEFAULT_TOKENS_PER_SENTENCE))
+    margin = int(conf.get("margine_token", DEFAULT_MARGIN_TOKENS))
+
+    max_sentences = _limits().get((label, out_type, length))
+    if max_sentences is None:
+        return Budget(None, None, False)
+    early_stop = bool(conf.get("early_stop", True))
+    # senza conteggio delle frasi (es. Minimal: elenchi) un tetto taglierebbe il testo senza che nessuno se ne accorga
+    max_tokens = max_sentences * per_sentence + margin if early_stop else None
+    return Budget(max_sentences, max_tokens, early_stop)
+
+
+class SentenceCounter:
+    """
+    Conta le frasi di un testo che arriva a pezzi (stream). feed() ritorna True
+    quando il limite è raggiunto; text() è il testo fino all'ultima frase ammessa.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._buf = ""
+        self._pos = 0       # oltre l'ultimo terminatore già contato
+        self._cut = None
+        self.count = 0
+
+    def feed(self, delta):
+        if self._cut is not None:
+            return True
+        self._buf += delta
+        # un terminatore a fine buffer non è ancora seguito dallo spazio: verrà contato col pezzo successivo
+        for m in _SENTENCE_END.finditer(self._buf, self._pos):
+            self._pos = m.end()
+            word = re.search(r"(\w+)\W*$", self._buf[:m.start()])
+            if m.group(0).startswith(".") and word and word.group(1).lower() in _ABBREVIATIONS:
+                continue
+            self.count += 1
+            if self.count >= self.limit:
+                self._cut = m.end()
+                return True
+        return False
+
+    def stopped(self):
+        return self._cut is not None
+
+    def text(self):
+        return (self._buf[:self._cut] if self._cut is not None else self._buf).strip()
+
+
+def count_sentences(text):
+    """Frasi di un testo completo (l'ultima conta anche senza punto finale)."""
+    counter = SentenceCounter(float("inf"))
+    counter.feed(text.strip() + " ")
+    return counter.count + bool(counter._buf[counter._pos:].strip())
+
+
+# =====================
+# Statistiche per variante
+# =====================
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+
+def record(registro, out_type, length, completion_tokens, latency_ms, stopped_early, truncated=False):
+    with _STATS_LOCK:
+        s = _STATS.setdefault(
+            (registro, out_type, length), {"n": 0, "tokens": 0, "latency_ms": 0.0, "early_stops": 0, "truncated": 0}
+        )
+        s["n"] += 1
+        s["tokens"] += completion_tokens
+        s["latency_ms"] += latency_ms
+        s["early_stops"] += int(stopped_early)
+        s["truncated"] += int(truncated)
+
+
+def variant_report():
+    """Righe per variante: chiamate, token medi in uscita, latenza media, stop anticipati, tetti raggiunti, budget."""
+    with _STATS_LOCK:
+        items = [(k, dict(v)) for k, v in _STATS.items()]
+    rows = []
+    for (registro, out_type, length), s in sorted(items):
+        budget = get_budget(registro, out_type, length)
+        rows.append({
+            "registro": registro, "tipo": out_type, "lunghezza": length, "n": s["n"],
+            "token_medi": round(s["tokens"] / s["n"], 1),
+            "latenza_media_ms": round(s["latency_ms"] / s["n"], 1),
+            "stop_anticipati": s["early_stops"],
+            "tetto_raggiunto": s["truncated"],   # risposte tagliate da max_tokens e rifatte senza tetto
+            "max_frasi": budget.max_sentences, "max_tokens": budget.max_tokens,
+        })
+    return rows
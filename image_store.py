@@ -0,0 +1,391 @@
+"""
+Archivio immagini: master lossless + varianti compresse, deduplicate per hash.
+
+Struttura dentro la cartella immagini (default archived_images/):
+    masters/<hash>.png            master lossless
+    variants/<hash>_<nome>.<ext>  varianti (thumb / screen / print)
+    index.json                    seriale -> hash, hash -> file e dimensioni,
+                                  metadati per file
+
+Metadati per file (sezione "files", percorso relativo -> dimensioni px,
+formato, modo, byte, hash del contenuto, colore dominante, mtime): scritti
+all'archiviazione e aggiornati da refresh_metadata con una scansione delle
+cartelle (os.scandir), che apre solo i file nuovi o cambiati. Elenco piatti,
+layout e chiavi di cache li leggono dall'indice senza decodificare immagini.
+
+Le vecchie immagini <seriale>.png restano leggibili (fallback) e si possono
+migrare con:  python image_store.py migrate [cartella] [archivio.xlsx]
+Scansione completa dei metadati:  python image_store.py scan [cartella]
+"""
+import os
+import io
+import sys
+import json
+import hashlib
+import time
+import threading
+
+from PIL import Image
+
+IMAGES_DIR = "archived_images"
+INDEX_FILE = "index.json"
+
+# nome -> (lato massimo px, formato PIL, estensione, opzioni di salvataggio)
+VARIANTS = {
+    "thumb": (256, "WEBP", "webp", {"quality": 80, "method": 4}),
+    "screen": (768, "WEBP", "webp", {"quality": 85, "method": 4}),
+    "print": (2048, "JPEG", "jpg", {"quality": 90, "optimize": True, "progressive": True}),
+}
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+STORE_DIRS = ("masters", "variants")
+
+_LOCK = threading.Lock()
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()[:32]
+
+
+def _index_path(root):
+    return os.path.join(root, INDEX_FILE)
+
+
+def load_index(root=IMAGES_DIR):
+    path = _index_path(root)
+    if not os.path.exists(path):
+        return {"serials": {}, "images": {}, "files": {}, "dirs": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    # indici scritti prima dei metadati per file
+    index.setdefault("files", {})
+    index.setdefault("dirs", {})
+    return index
+
+
+def _save_index(root, index):
+    path = _index_path(root)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# =====================
+# Metadati per file
+# =====================
+def _rel(path):
+    return path.replace(os.sep, "/")
+
+
+def dominant_color(img):
+    """Colore più frequente (#rrggbb) su una miniatura 64 px quantizzata a 8 colori."""
+    small = img.convert("RGB")
+    small.thumbnail((64, 64), Image.Resampling.NEAREST)
+    quant = small.quantize(colors=8)
+    count, idx = max(quant.getcolors())
+    r, g, b = quant.getpalette()[idx * 3:idx * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def _meta(px, fmt, mode, data, st, color):
+    return {
+        "px": list(px),
+        "format": fmt,
+        "mode": mode,
+        "bytes": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": content_hash(data),
+        "color": color,
+    }
+
+
+def read_file_meta(path):
+    """Metadati di un file immagine su disco (decodifica ridotta per il colore)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    st = os.stat(path)
+    with Image.open(io.BytesIO(data)) as img:
+        px, fmt, mode = img.size, img.format, img.mode
+        img.draft("RGB", (64, 64))  # JPEG: decodifica già ridotta
+        return _meta(px, fmt, mode, data, st, dominant_color(img))
+
+
+def _dir_mtimes(root):
+    out = {}
+    for d in STORE_DIRS:
+        try:
+            out[d] = os.stat(os.path.join(root, d)).st_mtime
+        except OSError:
+            pass
+    return out
+
+
+def _scan(root, index, full):
+    """
+    Aggiorna index["files"]; ritorna il numero di file (ri)letti e rimossi.
+    La radice (immagini legacy) si scorre sempre; masters/ e variants/ solo se
+    full o se la cartella è cambiata dall'ultima scansione (mtime).
+    """
+    files = index["files"]
+    dirs = _dir_mtimes(root)
+    folders = [""] + [d for d in STORE_DIRS if full or index["dirs"].get(d) != dirs.get(d)]
+    seen, updated = set(), 0
+    for folder in folders:
+        try:
+            entries = list(os.scandir(os.path.join(root, folder)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTS):
+                continue
+            rel = _rel(os.path.join(folder, entry.name)) if folder else entry.name
+            seen.add(rel)
+            st = entry.stat()
+            old = files.get(rel)
+            if old and old["mtime"] == st.st_mtime and old["bytes"] == st.st_size:
+                continue
+            try:
+                files[rel] = read_file_meta(entry.path)
+                updated += 1
+            except (OSError, Image.UnidentifiedImageError):
+                files.pop(rel, None)
+    scanned = set(folders)
+    stale = [rel for rel in files if rel not in seen and (rel.split("/")[0] if "/" in rel else "") in scanned]
+    for rel in stale:
+        del files[rel]
+    index["dirs"] = dirs
+    return updated, len(stale)
+
+
+# radice -> firma della cartella (file nella radice, mtime di masters/variants) all'ultima scansione
+_LAST_SCAN = {}
+
+
+def _folder_signature(root):
+    files = []
+    for entry in os.scandir(root):
+        if entry.is_file() and (entry.name == INDEX_FILE or entry.name.lower().endswith(IMAGE_EXTS)):
+            st = entry.stat()
+            files.append((entry.name, st.st_mtime, st.st_size))
+    return sorted(files), _dir_mtimes(root)
+
+
+def refresh_metadata(root=IMAGES_DIR, full=False):
+    """
+    Allinea i metadati dell'indice ai file su disco. Se la cartella non è
+    cambiata dall'ultima scansione non legge nemmeno l'indice; lo scrive solo
+    se qualcosa è cambiato (la firma di index.json resta valida come chiave di cache).
+    Ritorna {"updated", "removed", "ms"}.
+    """
+    t0 = time.perf_counter()
+    if not os.path.isdir(root):
+        return {"updated": 0, "removed": 0, "ms": 0.0}
+    key = os.path.abspath(root)
+    with _LOCK:
+        if not full and _LAST_SCAN.get(key) == _folder_signature(root):
+            return {"updated": 0, "removed": 0, "ms": (time.perf_counter() - t0) * 1000}
+        index = load_index(root)
+        before = dict(index["dirs"])
+        updated, removed = _scan(root, index, full)
+        if updated or removed or index["dirs"] != before:
+            _save_index(root, index)
+        _LAST_SCAN[key] = _folder_signature(root)
+    return {"updated": updated, "removed": removed, "ms": (time.perf_counter() - t0) * 1000}
+
+
+def file_meta(path, root=IMAGES_DIR, index=None):
+    """Metadati di un file dell'archivio immagini dall'indice (None se non indicizzato)."""
+    index = index if index is not None else load_index(root)
+    prefix = os.path.join(root, "")
+    rel = path[len(prefix):] if path.startswith(prefix) else os.path.relpath(path, root)
+    return index["files"].get(_rel(rel))
+
+
+def _build_image(root, image_bytes, digest, files):
+    """
+    Scrive master + varianti per un'immagine nuova. Ritorna la voce di indice;
+    i metadati dei file scritti finiscono in `files`.
+    """
+    os.makedirs(os.path.join(root, "masters"), exist_ok=True)
+    os.makedirs(os.path.join(root, "variants"), exist_ok=True)
+
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+
+    master_rel = os.path.join("masters", f"{digest}.png")
+    if img.format == "PNG":
+        master_bytes = image_bytes  # già lossless: nessuna ricodifica
+    else:
+        buf = io.BytesIO()
+        img.save(buf, "PNG", optimize=True)
+        master_bytes = buf.getvalue()
+    _write_atomic(os.path.join(root, master_rel), master_bytes)
+
+    rgb = img.convert("RGB")
+    color = dominant_color(rgb)
+    files[_rel(master_rel)] = _meta(
+        img.size, "PNG", img.mode, master_bytes, os.stat(os.path.join(root, master_rel)), color
+    )
+    entry = {
+        "master": master_rel,
+        "px": list(img.size),
+        "bytes": len(master_bytes),
+        "variants": {},
+    }
+    for name, (max_px, fmt, ext, opts) in VARIANTS.items():
+        var = rgb.copy()
+        var.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)  # mai ingrandire
+        buf = io.BytesIO()
+        var.save(buf, fmt, **opts)
+        rel = os.path.join("variants", f"{digest}_{name}.{ext}")
+        _write_atomic(os.path.join(root, rel), buf.getvalue())
+        entry["variants"][name] = {"path": rel, "px": list(var.size), "bytes": buf.tell()}
+        files[_rel(rel)] = _meta(var.size, fmt, var.mode, buf.getvalue(), os.stat(os.path.join(root, rel)), color)
+    return entry
+
+
+def store_image(serial, image_bytes, root=IMAGES_DIR):
+    """
+    Salva l'immagine del piatto `serial`.
+    Se un'immagine identica esiste già (stesso hash) riusa master e varianti.
+    Ritorna il percorso del master.
+    """
+    digest = content_hash(image_bytes)
+    with _LOCK:
+        index = load_index(root)
+        if digest not in index["images"]:
+            index["images"][digest] = _build_image(root, image_bytes, digest, index["files"])
+            # file scritti e già indicizzati: la prossima scansione non li rilegge
+            index["dirs"] = _dir_mtimes(root)
+        index["serials"][str(int(serial))] = digest
+        _save_index(root, index)
+        return os.path.join(root, index["images"][digest]["master"])
+
+
+def image_entry(serial, root=IMAGES_DIR, index=None):
+    """Voce di indice dell'immagine del piatto (None se assente o formato legacy)."""
+    index = index if index is not None else load_index(root)
+    digest = index["serials"].get(str(int(serial)))
+    return index["images"].get(digest) if digest else None
+
+
+def image_path(serial, variant="master", root=IMAGES_DIR, index=None):
+    """
+    Percorso dell'immagine del piatto nella variante richiesta.
+    Fallback: <seriale>.png legacy. None se il piatto non ha immagine.
+    """
+    entry = image_entry(serial, root, index)
+    if entry:
+        if variant == "master":
+            return os.path.join(root, entry["master"])
+        var = entry["variants"].get(variant)
+        if var:
+            return os.path.join(root, var["path"])
+    legacy = f"{int(serial)}.png"
+    if index is not None and index["files"]:
+        # indice con metadati: niente stat per ogni piatto
+        return os.path.join(root, legacy) if legacy in index["files"] else None
+    legacy = os.path.join(root, legacy)
+    return legacy if os.path.exists(legacy) else None
+
+
+# metadati riportati in image_variants: quelli che servono per scegliere e ritagliare
+_VARIANT_META = ("format", "mode", "hash")
+
+
+def image_variants(serial, root=IMAGES_DIR, index=None):
+    """
+    dict nome -> {"path": assoluto, "px": [w, h], "format", "mode", "hash"}
+    (master incluso; format / mode / hash solo se indicizzati), vuoto se legacy.
+    """
+    index = index if index is not None else load_index(root)
+    entry = image_entry(serial, root, index)
+    if not entry:
+        return {}
+    files = index["files"]
+
+    def variant(rel, px):
+        out = {"path": os.path.join(root, rel), "px": px}
+        meta = files.get(_rel(rel))
+        if meta:
+            out.update((k, meta[k]) for k in _VARIANT_META)
+        return out
+
+    out = {"master": variant(entry["master"], entry["px"])}
+    for name, var in entry["variants"].items():
+        out[name] = variant(var["path"], var["px"])
+    return out
+
+
+def best_variant(variants, min_w, min_h, allowed=None):
+    """
+    La variante più piccola che copre almeno min_w x min_h px.
+    Se nessuna basta, la più grande disponibile. None se `variants` è vuoto.
+    """
+    candidates = [
+        (v["px"][0] * v["px"][1], name, v)
+        for name, v in variants.items()
+        if allowed is None or name in allowed
+    ]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda c: c[0])
+    for _, _, v in candidates:
+        if v["px"][0] >= min_w and v["px"][1] >= min_h:
+            return v
+    return candidates[-1][2]
+
+
+def migrate_legacy(root=IMAGES_DIR, remove_legacy=True, archive_file=None):
+    """
+    Importa nel nuovo formato le immagini <seriale>.png esistenti.
+    Idempotente: i seriali già in indice vengono saltati.
+    Se i file legacy vengono rimossi, la colonna immagine_path dell'archivio
+    archive_file (default archive_manager.ARCHIVE_FILE) viene riscritta sul
+    master prima della rimozione.
+    Ritorna il numero di immagini migrate.
+    """
+    if not os.path.isdir(root):
+        return 0
+    migrated = 0
+    legacy = {}   # seriale -> (file legacy, master relativo a root, come in immagine_path)
+    for name in sorted(os.listdir(root)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() != ".png" or not stem.isdigit():
+            continue
+        path = os.path.join(root, name)
+        if image_entry(stem, root) is None:
+            with open(path, "rb") as f:
+                store_image(int(stem), f.read(), root)
+            migrated += 1
+        legacy[int(stem)] = (path, image_entry(stem, root)["master"])
+
+    if remove_legacy and legacy:
+        from archive_manager import ARCHIVE_FILE, update_entries  # import circolare a livello di modulo
+        archive_file = archive_file or ARCHIVE_FILE
+        if os.path.exists(archive_file):
+            update_entries("immagine_path", {serial: master for serial, (_path, master) in legacy.items()}, archive_file)
+        for path, _master in legacy.values():
+            os.remove(path)
+    return migrated
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        target = sys.argv[2] if len(sys.argv) > 2 else IMAGES_DIR
+        n = migrate_legacy(target, archive_file=sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Migrate {n} immagini in {target}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "scan":
+        target = sys.argv[2] if len(sys.argv) > 2 else IMAGES_DIR
+        res = refresh_metadata(target, full=True)
+        print(f"Metadati: {res['updated']} file letti, {res['removed']} rimossi in {res['ms']:.0f} ms")
+    else:
+        print("Uso: python image_store.py migrate [cartella] [archivio.xlsx] | scan [cartella]")
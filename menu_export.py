@@ -0,0 +1,229 @@
+"""
+Export menu completo (DOCX + PDF di stampa) a partire dall'archivio piatti.
+
+L'archivio viene letto in streaming (openpyxl read_only, una riga alla volta):
+la memoria resta piatta anche con centinaia di piatti.
+"""
+import os
+from functools import lru_cache
+
+from openpyxl import load_workbook
+from docx import Document
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from archive_manager import ARCHIVE_FILE
+from profiling import traced
+from docx_export import apply_document_styles
+from modules_cover.cover_render import fit_lines
+
+# Portate in ordine di menu: nome sezione -> parole chiave cercate nei tags
+COURSES = [
+    ("Antipasti", ("antipasto", "antipasti", "entrée", "starter")),
+    ("Primi", ("primo", "primi", "pasta", "risotto", "zuppa")),
+    ("Secondi", ("secondo", "secondi", "main")),
+    ("Contorni", ("contorno", "contorni")),
+    ("Dolci", ("dolce", "dolci", "dessert", "pasticceria")),
+]
+OTHER_COURSE = "Altro"
+
+# Modello DOCX opzionale (stili aziendali); se manca si usano gli stili di default
+TEMPLATE_DOCX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "menu_template.docx")
+
+# Font PDF: TTF Unicode se disponibile, altrimenti Helvetica
+_TTF_CANDIDATES = [("MenuSans", "DejaVuSans.ttf", "MenuSans-Bold", "DejaVuSans-Bold.ttf")]
+
+
+@lru_cache(maxsize=None)
+def register_menu_fonts():
+    """Registra i font del PDF una sola volta per processo. Ritorna (regular, bold)."""
+    for name, path, bold_name, bold_path in _TTF_CANDIDATES:
+        try:
+            pdfmetrics.registerFont(TTFont(name, path))
+            pdfmetrics.registerFont(TTFont(bold_name, bold_path))
+            return name, bold_name
+        except Exception:
+            continue
+    return "Helvetica", "Helvetica-Bold"
+
+
+def _split_tags(tags):
+    """Tags della cella in minuscolo, separati da virgola o punto e virgola."""
+    return [t.strip().lower() for t in str(tags or "").replace(";", ",").split(",") if t.strip()]
+
+
+def course_for_tags(tags):
+    """Portata del piatto dedotta dai tags (prima corrispondenza), altrimenti "Altro"."""
+    tokens = _split_tags(tags)
+    for course, keywords in COURSES:
+        if any(tok in keywords for tok in tokens):
+            return course
+    return OTHER_COURSE
+
+
+def iter_archive_rows(path=ARCHIVE_FILE, columns=None):
+    """Genera le righe dell'archivio come dict (streaming, senza caricare il foglio)."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        idx = {name: i for i, name in enumerate(header) if name}
+        wanted = [c for c in (columns or idx.keys()) if c in idx]
+        for values in rows:
+            yield {c: values[idx[c]] if idx[c] < len(values) else None for c in wanted}
+    finally:
+        wb.close()
+
+
+def _matches(row, serial_from=None, serial_to=None, tag=None, search=None):
+    seriale = row.get("seriale")
+    if seriale is None or not row.get("titolo"):
+        return False
+    seriale = int(seriale)
+    if serial_from is not None and seriale < serial_from:
+        return False
+    if serial_to is not None and seriale > serial_to:
+        return False
+    if tag:
+        if tag.strip().lower() not in _split_tags(row.get("tags")):
+            return False
+    if search:
+        needle = search.strip().lower()
+        haystack = " ".join(str(row.get(c) or "") for c in ("titolo", "frase_iconica", "ricetta", "tags")).lower()
+        if needle not in haystack:
+            return False
+    return True
+
+
+def select_dishes(path=ARCHIVE_FILE, serial_from=None, serial_to=None, tag=None, search=None):
+    """
+    Primo passaggio (leggero): seriali selezionati raggruppati per portata.
+    Ritorna dict ordinato: portata -> [seriale, ...]
+    """
+    cols = ["seriale", "titolo", "tags"] + (["frase_iconica", "ricetta"] if search else [])
+    groups = {course: [] for course, _ in COURSES}
+    groups[OTHER_COURSE] = []
+    for row in iter_archive_rows(path, columns=cols):
+        if _matches(row, serial_from, serial_to, tag, search):
+            groups[course_for_tags(row.get("tags"))].append(int(row["seriale"]))
+    return {course: serials for course, serials in groups.items() if serials}
+
+
+def search_dishes(path=ARCHIVE_FILE, serial_from=None, serial_to=None, tag=None, search=None, limit=None):
+    """Righe dell'archivio che rispettano i filtri (stessi criteri dell'export), al massimo `limit`."""
+    cols = ["seriale", "titolo", "frase_iconica", "tags", "immagine_path", "data_archiviazione", "ricetta"]
+    found = []
+    for row in iter_archive_rows(path, columns=cols):
+        if _matches(row, serial_from, serial_to, tag, search):
+            row["seriale"] = int(row["seriale"])
+            row["portata"] = course_for_tags(row.get("tags"))
+            found.append(row)
+            if limit and len(found) >= limit:
+                break
+    return found
+
+
+class _PdfMenuWriter:
+    """Scrive il PDF di stampa pagina per pagina (testo, niente immagini)."""
+
+    def __init__(self, path, titolo):
+        self.font, self.font_bold = register_menu_fonts()
+        self.c = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+        self.c.setTitle(titolo)
+        self.w, self.h = A4
+        self.margin = 20 * mm
+        self.text_w = self.w - 2 * self.margin
+        self.y = self.h - self.margin
+        self._line(titolo, self.font_bold, 22, gap=10 * mm, center=True)
+
+    def _ensure(self, needed):
+        if self.y - needed < self.margin:
+            self.c.showPage()
+            self.y = self.h - self.margin
+
+    def _line(self, text, font, size, gap=0, center=False):
+        self.c.setFont(font, size)
+        if center:
+            self.c.drawCentredString(self.w / 2, self.y - size, text)
+        else:
+            self.c.drawString(self.margin, self.y - size, text)
+        self.y -= size * 1.3 + gap
+
+    def section(self, name):
+        self._ensure(40 * mm)  # evita titoli di sezione orfani a fondo pagina
+        self.y -= 4 * mm
+        self._line(name, self.font_bold, 15, gap=3 * mm)
+
+    def dish(self, titolo, frase):
+        title_lines = fit_lines(titolo, self.font_bold, 12, self.text_w, 2)
+        phrase_lines = fit_lines(frase, self.font, 10, self.text_w, 6) if frase else []
+        self._ensure(len(title_lines) * 12 * 1.3 + len(phrase_lines) * 10 * 1.3 + 5 * mm)
+        for ln in title_lines:
+            self._line(ln, self.font_bold, 12)
+        for ln in phrase_lines:
+            self._line(ln, self.font, 10)
+        self.y -= 5 * mm
+
+    def save(self):
+        self.c.showPage()
+        self.c.save()
+
+
+@traced("export_menu")
+def export_menu(out_dir, titolo="Menu", serial_from=None, serial_to=None, tag=None, search=None,
+                archive_path=ARCHIVE_FILE, basename="menu"):
+    """
+    Esporta i piatti selezionati in un DOCX e in un PDF, con una sezione per portata.
+
+    I piatti vengono letti in streaming e scritti subito in entrambi i documenti
+    (un passaggio sul foglio per ogni portata presente).
+
+    Ritorna dict: {"docx_path", "pdf_path", "count", "sections": {portata: n}}
+    """
+    groups = select_dishes(archive_path, serial_from, serial_to, tag, search)
+
+    os.makedirs(out_dir, exist_ok=True)
+    docx_path = os.path.join(out_dir, f"{basename}.docx")
+    pdf_path = os.path.join(out_dir, f"{basename}.pdf")
+
+    doc = Document(TEMPLATE_DOCX) if os.path.exists(TEMPLATE_DOCX) else Document()
+    apply_document_styles(doc)
+    doc.add_heading(titolo, level=0)
+    # stili risolti una volta: style="Heading 1" rifà la ricerca per nome a ogni paragrafo
+    course_style = doc.styles["Heading 1"]
+    dish_style = doc.styles["Heading 2"]
+
+    pdf = _PdfMenuWriter(pdf_path, titolo)
+
+    count = 0
+    for course, serials in groups.items():
+        wanted = set(serials)
+        doc.add_paragraph(course, style=course_style)
+        pdf.section(course)
+
+        for row in iter_archive_rows(archive_path, columns=["seriale", "titolo", "frase_iconica"]):
+            if row.get("seriale") is None or int(row["seriale"]) not in wanted:
+                continue
+            titolo_piatto = str(row.get("titolo") or "").strip()
+            frase = str(row.get("frase_iconica") or "").strip()
+
+            doc.add_paragraph(titolo_piatto, style=dish_style)
+            if frase:
+                doc.add_paragraph(frase)
+            pdf.dish(titolo_piatto, frase)
+            count += 1
+
+    doc.save(docx_path)
+    pdf.save()
+
+    return {
+        "docx_path": docx_path,
+        "pdf_path": pdf_path,
+        "count": count,
+        "sections": {course: len(serials) for course, serials in groups.items()},
+    }
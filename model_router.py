@@ -0,0 +1,252 @@
+"""
+Routing dei modelli a livelli, con controllo di qualità locale.
+
+Ogni compito (generazione per registro / lunghezza, traduzione, OCR) prova i
+livelli configurati in rules/routing.yaml in ordine, tipicamente un modello
+veloce ed economico e poi uno più forte. Dopo ogni risposta un controllo a
+regole, senza chiamate al modello, decide se va bene:
+    - generazione: numero di frasi (limiti di prompts/system.txt), parole di
+      marketing / claim vietate, ingredienti noti che non sono nella ricetta
+    - traduzione:  testo non vuoto, diverso dall'originale, lunghezza plausibile
+    - OCR:         testo non troppo corto
+Si passa al livello successivo solo se il controllo fallisce; l'ultimo livello
+viene accettato comunque.
+
+Con il routing acceso (default, MODEL_ROUTING=0 lo spegne) il primo livello è
+il modello configurato per il compito (GEN_MODEL / VISION_MODEL), salvo un
+modello esplicito in routing.yaml; ogni testo scartato dal controllo costa una
+seconda chiamata al livello strong (gpt-4o, MODEL_TIER_STRONG per cambiarlo,
+MODEL_TIER_STRONG=off per non fare escalation).
+
+Statistiche per compito (escalation, latenza per modello, latenza risparmiata
+rispetto a usare sempre il modello più forte) nella pagina Admin.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from functools import lru_cache
+
+import yaml
+
+from profiling import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUTING_FILE = os.getenv("ROUTING_FILE", os.path.join(BASE_DIR, "rules", "routing.yaml"))
+ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "1") != "0"
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_routing():
+    if not os.path.exists(ROUTING_FILE):
+        return {}
+    with open(ROUTING_FILE, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def _tier_model(name, fallback):
+    """
+    Modello di un livello: MODEL_TIER_<NOME>, poi tiers in routing.yaml; un livello
+    dichiarato senza modello (es. fast) è il modello del compito (GEN_MODEL /
+    VISION_MODEL). "off" toglie il livello. Un nome che non è un livello è già un modello.
+    """
+    model = os.getenv(f"MODEL_TIER_{name.upper()}")
+    if model is None:
+        tiers = get_routing().get("tiers") or {}
+        model = tiers.get(name) or (fallback if name in tiers else name)
+    return None if model == "off" else model
+
+
+def models_for(task, fallback, registro=None, length=None):
+    """
+    Modelli da provare in ordine; [fallback] se il routing è spento o non configurato.
+    Livelli che risolvono allo stesso modello contano una volta sola.
+    """
+    conf = get_routing().get("tasks", {}).get(task)
+    if not ROUTING_ENABLED or not conf:
+        return [fallback]
+    overrides = conf.get("overrides") or {}
+    tiers = (
+        overrides.get(f"{registro}/{length}")
+        or overrides.get(registro or "")
+        or overrides.get(length or "")
+        or conf.get("default")
+        or []
+    )
+    models = []
+    for t in tiers:
+        model = _tier_model(t, fallback)
+        if model and model not in models:
+            models.append(model)
+    return models or [fallback]
+
+
+# =====================
+# Controllo locale
+# =====================
+def _gate():
+    return get_routing().get("gate", {})
+
+
+@lru_cache(maxsize=None)
+def _word_re(words):
+    if not words:
+        return None
+    return re.compile(r"\b(" + "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)) + r")\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def _stem_re(word):
+    # "pomodori" / "pomodoro", "nocciole" / "nocciola": radice più al massimo una lettera,
+    # poi fine parola ("pepe" non trova "peperoncino", "noci" non trova "nocciole")
+    word = word.casefold()
+    stem = word[:-1] if len(word) > 3 else word
+    return re.compile(r"\b" + re.escape(stem) + r"\w?\b")
+
+
+def check_generation(text, ricetta, registro, out_type, length):
+    """Lista dei problemi trovati (vuota = testo accettato)."""
+    from generation_budget import count_sentences, get_budget
+    from recipe_normalizer import normalize_recipe
+
+    if not text.strip():
+        return ["testo vuoto"]
+    problems = []
+
+    budget = get_budget(registro, out_type, length)
+    # dove i punti non separano frasi (Minimal: elenchi) il conteggio non ha senso
+    if budget.max_sentences and budget.early_stop:
+        n = count_sentences(text)
+        if n > budget.max_sentences:
+            problems.append(f"{n} frasi (massimo {budget.max_sentences})")
+
+    banned = _word_re(tuple(_gate().get("parole_vietate") or ()))
+    if banned:
+        found = sorted({m.group(1).lower() for m in banned.finditer(text)})
+        if found:
+            problems.append("parole vietate: " + ", ".join(found))
+
+    known = _word_re(tuple(_gate().get("ingredienti_noti") or ()))
+    if known:
+        source = normalize_recipe(ricetta).clean.casefold()
+        invented = sorted({
+            m.group(1).lower() for m in known.finditer(text)
+            if not _stem_re(m.group(1)).search(source)
+        })
+        if invented:
+            problems.append("ingredienti non presenti nella ricetta: " + ", ".join(invented))
+    return problems
+
+
+def check_translation(text, source):
+    if not text.strip():
+        return ["traduzione vuota"]
+    if text.strip() == source.strip():
+        return ["testo non tradotto"]
+    low, high = _gate().get("traduzione_rapporto") or (0.4, 2.5)
+    ratio = len(text) / max(1, len(source))
+    if not low <= ratio <= high:
+        return [f"lunghezza anomala ({ratio:.1f}× l'originale)"]
+    return []
+
+
+def check_ocr(text):
+    if len(text.strip()) < int(_gate().get("ocr_min_caratteri", 20)):
+        return ["testo estratto troppo corto"]
+    return []
+
+
+# =====================
+# Esecuzione con escalation
+# =====================
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+
+def route(task, models, attempt, check):
+    """
+    attempt(model) -> risultato, check(risultato) -> lista problemi.
+    Ritorna (risultato, [tentativi]) con un tentativo per modello provato:
+    {"model", "latency_ms", "problems"}.
+    """
+    attempts = []
+    for i, model in enumerate(models):
+        t0 = time.perf_counter()
+        with span(f"modello: {task} · {model}"):
+            result = attempt(model)
+        latency_ms = (time.perf_counter() - t0) * 1000
+        problems = check(result) if i < len(models) - 1 else []
+        attempts.append({"model": model, "latency_ms": latency_ms, "problems": problems})
+        if not problems:
+            break
+        logger.info("%s: %s scartato (%s), provo %s", task, model, "; ".join(problems), models[i + 1])
+    _record(task, models, attempts)
+    return result, attempts
+
+
+def _record(task, models, attempts):
+    with _STATS_LOCK:
+        s = _STATS.setdefault(task, {"calls": 0, "escalations": 0, "by_model": {}, "first_n": 0, "first_ms": 0.0})
+        s["strongest"] = models[-1]
+        s["calls"] += 1
+        s["escalations"] += len(attempts) > 1
+        for a in attempts:
+            m = s["by_model"].setdefault(a["model"], {"n": 0, "latency_ms": 0.0})
+            m["n"] += 1
+            m["latency_ms"] += a["latency_ms"]
+        if len(models) > 1 and len(attempts) == 1:
+            # accettato al primo livello: il confronto col modello forte si fa nel report
+            s["first_n"] += 1
+            s["first_ms"] += attempts[0]["latency_ms"]
+
+
+def _baseline_ms(task, strongest, avg, observed):
+    """
+    Latenza di riferimento del modello più forte per il compito: media osservata
+    nel compito, altrimenti quella dello stesso modello in altri compiti, altrimenti
+    latenza_forte_ms configurata in routing.yaml. (ms, fonte) oppure (None, None).
+    """
+    if strongest in avg:
+        return avg[strongest], "osservata"
+    if strongest in observed:
+        n, ms = observed[strongest]
+        return ms / n, "altri compiti"
+    configured = (get_routing().get("tasks", {}).get(task) or {}).get("latenza_forte_ms")
+    if configured:
+        return float(configured), "configurata"
+    return None, None
+
+
+def routing_report():
+    """
+    Per compito: chiamate, quota di escalation, latenza media per modello e
+    latenza risparmiata stimata (latenza di riferimento del modello più forte,
+    vedi _baseline_ms, meno quella dei testi accettati al primo livello).
+    """
+    with _STATS_LOCK:
+        items = [(task, dict(s, by_model={k: dict(v) for k, v in s["by_model"].items()})) for task, s in _STATS.items()]
+    observed = {}
+    for _task, s in items:
+        for model, m in s["by_model"].items():
+            n, ms = observed.get(model, (0, 0.0))
+            observed[model] = (n + m["n"], ms + m["latency_ms"])
+    rows = []
+    for task, s in sorted(items):
+        avg = {model: m["latency_ms"] / m["n"] for model, m in s["by_model"].items()}
+        base_ms, base_src = _baseline_ms(task, s["strongest"], avg, observed)
+        saved = None
+        if base_ms is not None:
+            saved = max(0.0, s["first_n"] * base_ms - s["first_ms"])
+        rows.append({
+            "compito": task,
+            "chiamate": s["calls"],
+            "escalation": s["escalations"],
+            "quota_escalation": round(s["escalations"] / s["calls"], 3),
+            "latenza_media_ms": ", ".join(f"{model}: {ms:.0f}" for model, ms in sorted(avg.items())),
+            "latenza_risparmiata_s": round(saved / 1000, 2) if saved is not None else None,
+            "riferimento_forte": base_src,
+        })
+    return rows
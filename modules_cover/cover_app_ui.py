@@ -1,13 +1,160 @@
 import streamlit as st
 import os
+import time
 from modules_cover.cover_data import load_piatti
-from modules_cover.cover_render import render_cover_pdf
+from modules_cover.cover_render import format_render_report, COMPRESSION_PROFILES, DEFAULT_PROFILE
+from modules_cover.cover_cache import render_cover_pdf_cached
+from modules_cover.cover_preview import render_cover_preview
+from modules_cover.cover_layouts import load_layouts
+from profiling import profiled
+from ui_utils import rerun_fragment
 
 
 
 
 
+@st.fragment
+@profiled("draft_editor")
+def draft_editor(base_dir, layout, max_piatti, piatti, piatto_by_seriale):
+    """
+    Selezione, ordinamento e anteprima della bozza. È un frammento: ↑/↓/🗑️ e
+    checkbox rieseguono solo questa sezione (dati e layout restano quelli del rerun completo).
+    """
+    t0 = time.perf_counter()
+    with st.expander(f"1) Seleziona piatti (max {max_piatti})", expanded=True):
+
+        # Scelte disponibili (non già selezionate)
+        selected_seriali = [it["seriale"] for it in st.session_state.draft_items]
+        available = [p for p in piatti if p["seriale"] not in selected_seriali]
+
+        # Mostro un selectbox per aggiungere 1 alla volta (UX controllata)
+        def label_piatto(p):
+            badge = "🖼️" if p["img_path"] else "—"
+            return f"{p['seriale']:>3} {badge}  {p['titolo']}"
+
+        if len(st.session_state.draft_items) < max_piatti and available:
+            pick = st.selectbox(
+                "Aggiungi un piatto",
+                options=[p["seriale"] for p in available],
+                format_func=lambda s: label_piatto(piatto_by_seriale[s]),
+                key="pick_seriale"
+            )
+            col_add, col_info = st.columns([1, 3])
+            with col_add:
+                add_disabled = len(st.session_state.draft_items) >= max_piatti
+                if st.button("➕ Aggiungi", disabled=add_disabled, use_container_width=True):
+                    p = piatto_by_seriale[pick]
+                    st.session_state.draft_items.append({
+                        "seriale": pick,
+                        "img": bool(p["img_path"]),   # default: ON solo se esiste file
+                        "frase": bool(p["frase"])     # default: ON solo se frase non vuota
+                    })
+                    rerun_fragment()
+            with col_info:
+                st.caption("Suggerimento: puoi disattivare immagine/frase per ogni riga nella lista sotto.")
+        else:
+            if len(st.session_state.draft_items) >= max_piatti:
+                st.info("Hai raggiunto il numero massimo per questo layout.")
+            elif not available:
+                st.info("Nessun altro piatto disponibile da aggiungere.")
+
+        st.write("---")
+        col_list, col_prev = st.columns([3, 2], gap="large")
+
+        with col_list:
+            st.subheader("Selezionati (bozza)")
+
+            if not st.session_state.draft_items:
+                st.caption("Nessun piatto selezionato.")
+            else:
+                # Tabella “righe” con toggle per riga
+                for idx, it in enumerate(st.session_state.draft_items):
+                    s = it["seriale"]
+                    p = piatto_by_seriale.get(s, {})
+                    titolo = p.get("titolo", f"Seriale {s}")
+                    has_img = bool(p.get("img_path"))
+                    has_frase = bool(p.get("frase"))
+
+                    # funzione spostamento
+                    def move_item(i, direction):
+                        j = i + direction
+                        if 0 <= j < len(st.session_state.draft_items):
+                            items = st.session_state.draft_items
+                            items[i], items[j] = items[j], items[i]
+                            st.session_state.draft_items = items
+                            rerun_fragment()
+
+                    c1, c2, c3, c4, c5, c6 = st.columns([5, 1, 1, 1, 1, 1])
+
+                    with c1:
+                        st.write(f"**{idx+1}. {titolo}**  _(#{s})_")
+
+                    with c2:
+                        if st.button("↑", key=f"up_{s}_{idx}", disabled=(idx == 0)):
+                            move_item(idx, -1)
+
+                    with c3:
+                        if st.button("↓", key=f"down_{s}_{idx}", disabled=(idx == len(st.session_state.draft_items)-1)):
+                            move_item(idx, 1)
+
+                    with c4:
+                        it["img"] = st.checkbox(
+                            "Img",
+                            value=it["img"],
+                            disabled=not has_img,
+                            key=f"img_{s}_{idx}"
+                        )
+
+                    with c5:
+                        it["frase"] = st.checkbox(
+                            "Frase",
+                            value=it["frase"],
+                            disabled=not has_frase,
+                            key=f"fr_{s}_{idx}"
+                        )
+
+                    with c6:
+                        if st.button("🗑️", key=f"rm_{s}_{idx}", help="Rimuovi"):
+                            st.session_state.draft_items.pop(idx)
+                            rerun_fragment()
+
+                st.write("---")
+                col_ok, col_cancel = st.columns(2)
+
+                with col_ok:
+                    if st.button("✅ Conferma", use_container_width=True):
+                        st.session_state.confirmed_items = [dict(x) for x in st.session_state.draft_items]
+                        st.session_state.confirmed_layout = layout
+                        st.success("Selezione confermata.")
+                        st.rerun()  # il riepilogo è fuori dal frammento
+
+                with col_cancel:
+                    if st.button("↩️ Annulla", use_container_width=True):
+                        # ripristina la bozza all'ultima confermata (o vuota)
+                        st.session_state.draft_items = [dict(x) for x in st.session_state.confirmed_items]
+                        st.info("Modifiche annullate.")
+                        rerun_fragment()
+
+        # Anteprima live: stessa geometria del PDF, miniature al posto dei crop
+        with col_prev:
+            st.caption("Anteprima")
+            if st.session_state.draft_items:
+                t_prev = time.perf_counter()
+                png = render_cover_preview(
+                    layout_key=layout,
+                    items=st.session_state.draft_items,
+                    piatto_by_seriale=piatto_by_seriale,
+                    background_image_path=os.path.join(base_dir, "assets", "background_a4.png")
+                )
+                st.image(png, use_container_width=True)
+                st.caption(f"Anteprima in {(time.perf_counter() - t_prev) * 1000:.0f} ms")
+
+    st.caption(f"Sezione aggiornata in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+@profiled("cover_ui")
 def cover_ui(base_dir=r"c:\cover_menu"):
+    t_run = time.perf_counter()
     BASE_DIR = base_dir
 
 
@@ -20,15 +167,8 @@ def cover_ui(base_dir=r"c:\cover_menu"):
     # Caricamento dati
     piatti = load_piatti(BASE_DIR)
 
-    # Layout
-    layout_map = {
-        "LO1 (1x1)": 1,
-        "LO2 (2x1)": 2,
-        "LO3 (3x1)": 3,
-        "LO4 (2x2)": 4,
-        "LO5 (3x2 hero)": 5,
-        "LO6 (3x2)": 6,
-    }
+    # Layout (da modules_cover/layouts.yaml): nome -> numero massimo di piatti
+    layout_map = {key: lay.capacity for key, lay in load_layouts().items()}
     layout = st.selectbox("Seleziona Layout", list(layout_map.keys()))
     max_piatti = layout_map[layout]
 
@@ -56,118 +196,9 @@ def cover_ui(base_dir=r"c:\cover_menu"):
     piatto_by_seriale = {p["seriale"]: p for p in piatti}
 
     # -----------------------------
-    # WIZARD: selezione in expander
+    # WIZARD: selezione in expander (frammento)
     # -----------------------------
-    with st.expander(f"1) Seleziona piatti (max {max_piatti})", expanded=True):
-
-        # Scelte disponibili (non già selezionate)
-        selected_seriali = [it["seriale"] for it in st.session_state.draft_items]
-        available = [p for p in piatti if p["seriale"] not in selected_seriali]
-
-        # Mostro un selectbox per aggiungere 1 alla volta (UX controllata)
-        def label_piatto(p):
-            badge = "🖼️" if p["img_path"] else "—"
-            return f"{p['seriale']:>3} {badge}  {p['titolo']}"
-
-        if len(st.session_state.draft_items) < max_piatti and available:
-            pick = st.selectbox(
-                "Aggiungi un piatto",
-                options=[p["seriale"] for p in available],
-                format_func=lambda s: label_piatto(piatto_by_seriale[s]),
-                key="pick_seriale"
-            )
-            col_add, col_info = st.columns([1, 3])
-            with col_add:
-                add_disabled = len(st.session_state.draft_items) >= max_piatti
-                if st.button("➕ Aggiungi", disabled=add_disabled, use_container_width=True):
-                    p = piatto_by_seriale[pick]
-                    st.session_state.draft_items.append({
-                        "seriale": pick,
-                        "img": bool(p["img_path"]),   # default: ON solo se esiste file
-                        "frase": bool(p["frase"])     # default: ON solo se frase non vuota
-                    })
-                    st.rerun()
-            with col_info:
-                st.caption("Suggerimento: puoi disattivare immagine/frase per ogni riga nella lista sotto.")
-        else:
-            if len(st.session_state.draft_items) >= max_piatti:
-                st.info("Hai raggiunto il numero massimo per questo layout.")
-            elif not available:
-                st.info("Nessun altro piatto disponibile da aggiungere.")
-
-        st.write("---")
-        st.subheader("Selezionati (bozza)")
-
-        if not st.session_state.draft_items:
-            st.caption("Nessun piatto selezionato.")
-        else:
-            # Tabella “righe” con toggle per riga
-            for idx, it in enumerate(st.session_state.draft_items):
-                s = it["seriale"]
-                p = piatto_by_seriale.get(s, {})
-                titolo = p.get("titolo", f"Seriale {s}")
-                has_img = bool(p.get("img_path"))
-                has_frase = bool(p.get("frase"))
-
-                # funzione spostamento
-                def move_item(i, direction):
-                    j = i + direction
-                    if 0 <= j < len(st.session_state.draft_items):
-                        items = st.session_state.draft_items
-                        items[i], items[j] = items[j], items[i]
-                        st.session_state.draft_items = items
-                        st.rerun()
-
-                c1, c2, c3, c4, c5, c6 = st.columns([5, 1, 1, 1, 1, 1])
-
-                with c1:
-                    st.write(f"**{idx+1}. {titolo}**  _(#{s})_")
-
-                with c2:
-                    if st.button("↑", key=f"up_{s}_{idx}", disabled=(idx == 0)):
-                        move_item(idx, -1)
-
-                with c3:
-                    if st.button("↓", key=f"down_{s}_{idx}", disabled=(idx == len(st.session_state.draft_items)-1)):
-                        move_item(idx, 1)
-
-                with c4:
-                    it["img"] = st.checkbox(
-                        "Img",
-                        value=it["img"],
-                        disabled=not has_img,
-                        key=f"img_{s}_{idx}"
-                    )
-
-                with c5:
-                    it["frase"] = st.checkbox(
-                        "Frase",
-                        value=it["frase"],
-                        disabled=not has_frase,
-                        key=f"fr_{s}_{idx}"
-                    )
-
-                with c6:
-                    if st.button("🗑️", key=f"rm_{s}_{idx}", help="Rimuovi"):
-                        st.session_state.draft_items.pop(idx)
-                        st.rerun()
-
-            st.write("---")
-            col_ok, col_cancel = st.columns(2)
-
-            with col_ok:
-                if st.button("✅ Conferma", use_container_width=True):
-                    st.session_state.confirmed_items = [dict(x) for x in st.session_state.draft_items]
-                    st.session_state.confirmed_layout = layout
-                    st.success("Selezione confermata.")
-                    st.rerun()
-
-            with col_cancel:
-                if st.button("↩️ Annulla", use_container_width=True):
-                    # ripristina la bozza all'ultima confermata (o vuota)
-                    st.session_state.draft_items = [dict(x) for x in st.session_state.confirmed_items]
-                    st.info("Modifiche annullate.")
-                    st.rerun()
+    draft_editor(BASE_DIR, layout, max_piatti, piatti, piatto_by_seriale)
 
     # -----------------------------
     # RIEPILOGO (fuori expander)
@@ -186,43 +217,54 @@ def cover_ui(base_dir=r"c:\cover_menu"):
 
     st.write("----")
 
+    profiles = list(COMPRESSION_PROFILES)
+    pdf_profile = st.radio(
+        "Qualità immagini",
+        profiles,
+        index=profiles.index(DEFAULT_PROFILE) if DEFAULT_PROFILE in profiles else 0,
+        format_func={"screen": "Schermo (leggero)", "print": "Stampa (300 dpi)"}.get,
+        horizontal=True,
+        key="cover_pdf_profile",
+    )
+
     if st.button("📄 Genera PDF", use_container_width=True):
 
         if not st.session_state.confirmed_items:
             st.warning("Nessuna selezione confermata.")
         else:
             out_dir = os.path.join(BASE_DIR, "output")
-            os.makedirs(out_dir, exist_ok=True)
-
-            out_path = os.path.join(out_dir, "cover_test.pdf")
 
             background_image_path = os.path.join(BASE_DIR, "assets", "background_a4.png")
 
-            render_cover_pdf(
-                output_path=out_path,
+            # Cache per contenuto: stessa selezione -> stesso PDF, senza ri-render
+            res = render_cover_pdf_cached(
+                out_dir=out_dir,
                 layout_key=st.session_state.confirmed_layout,
-                header_title=None,
-                header_subtitle=None,
                 items=st.session_state.confirmed_items,
                 piatto_by_seriale=piatto_by_seriale,
-                background_image_path=background_image_path
+                background_image_path=background_image_path,
+                profile=pdf_profile
             )
 
-            st.success("Cover Menu generato con successo.")
-
-            with open(out_path, "rb") as f:
-                st.download_button(
-                    "⬇️ Scarica PDF",
-                    data=f.read(),
-                    file_name="cover_test.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
-                )
+            if res["cached"]:
+                st.success("Cover Menu pronto (dalla cache).")
+            else:
+                st.success("Cover Menu generato con successo.")
+            st.caption(format_render_report(res["report"]))
+
+            st.download_button(
+                "⬇️ Scarica PDF",
+                data=res["pdf_bytes"],
+                file_name="cover_menu.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
 
 
 
 
     st.write("----")
     st.write("Layout scelto:", layout)
+    st.caption(f"Rerun completo della pagina in {(time.perf_counter() - t_run) * 1000:.0f} ms")
 if __name__ == "__main__":
     cover_ui()
@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from shared_cache import get_cache
+from modules_cover.cover_layouts import LAYOUTS_FILE
+from modules_cover.cover_render import render_cover_pdf, DEFAULT_PROFILE, COMPRESSION_PROFILES
+
+# Da incrementare quando cambia l'output del renderer (invalida la cache su disco)
+RENDER_VERSION = 3
+
+# namespace della cache condivisa: chiave -> (pdf_bytes, report)
+CACHE_NAMESPACE = "cover_pdf"
+
+
+def _file_sig(path):
+    """Firma economica di un file: (mtime, size) oppure None se non esiste."""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def cover_cache_key(layout_key, items, piatto_by_seriale, background_image_path=None, profile=None):
+    """Hash del contenuto: layout, items, dati dei piatti usati, profilo di compressione e mtime degli asset."""
+    piatti = []
+    for it in items:
+        p = piatto_by_seriale[it["seriale"]]
+        piatti.append({
+            "seriale": it["seriale"],
+            "img": bool(it.get("img")),
+            "frase": bool(it.get("frase")),
+            "titolo": p.get("titolo"),
+            "testo_frase": p.get("frase"),
+            "img_path": p.get("img_path"),
+            # hash del contenuto dall'indice immagini; stat del file solo se manca
+            "img_sig": (p.get("img_meta") or {}).get("hash") or _file_sig(p.get("img_path")),
+        })
+
+    payload = {
+        "v": RENDER_VERSION,
+        "layout": layout_key,
+        "profile": profile,
+        "layouts_sig": _file_sig(LAYOUTS_FILE),
+        "background": background_image_path,
+        "background_sig": _file_sig(background_image_path),
+        "piatti": piatti,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _remember(key, pdf_bytes, report):
+    get_cache().put(CACHE_NAMESPACE, key, (pdf_bytes, report), size=len(pdf_bytes))
+
+
+def render_cover_pdf_cached(out_dir, layout_key, items, piatto_by_seriale,
+                            background_image_path=None, header_title=None, header_subtitle=None,
+                            profile=None):
+    """
+    Come render_cover_pdf, ma con cache per contenuto.
+
+    Il file di output ha un nome univoco derivato dalla chiave (cover_<hash>.pdf),
+    quindi utenti diversi non si sovrascrivono; selezioni identiche riusano lo stesso file.
+
+    Ritorna dict: {"pdf_bytes": bytes, "path": str, "report": dict, "cached": bool}
+    """
+    profile = profile if profile in COMPRESSION_PROFILES else DEFAULT_PROFILE
+    key = cover_cache_key(layout_key, items, piatto_by_seriale, background_image_path, profile)
+    out_path = os.path.join(out_dir, f"cover_{key[:16]}.pdf")
+    report_path = out_path[:-4] + ".json"
+
+    # 1) memoria di processo (cache condivisa tra sessioni)
+    hit = get_cache().get(CACHE_NAMESPACE, key)
+    if hit and os.path.exists(out_path):
+        return {"pdf_bytes": hit[0], "path": out_path, "report": hit[1], "cached": True}
+
+    # 2) disco (es. dopo un riavvio)
+    if os.path.exists(out_path) and os.path.exists(report_path):
+        with open(out_path, "rb") as f:
+            pdf_bytes = f.read()
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        _remember(key, pdf_bytes, report)
+        return {"pdf_bytes": pdf_bytes, "path": out_path, "report": report, "cached": True}
+
+    # 3) render: file temporaneo + rename atomico (render concorrenti non si corrompono)
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf", dir=out_dir)
+    os.close(fd)
+    try:
+        report = render_cover_pdf(
+            output_path=tmp_path,
+            layout_key=layout_key,
+            header_title=header_title,
+            header_subtitle=header_subtitle,
+            items=items,
+            piatto_by_seriale=piatto_by_seriale,
+            background_image_path=background_image_path,
+            profile=profile
+        )
+        with open(tmp_path, "rb") as f:
+            pdf_bytes = f.read()
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    report["output_path"] = out_path
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+
+    _remember(key, pdf_bytes, report)
+    return {"pdf_bytes": pdf_bytes, "path": out_path, "report": report, "cached": False}
@@ -1,7 +1,13 @@
 import os
 import pandas as pd
 
+from shared_cache import get_cache, file_signature
+from profiling import traced
+from archive_manager import read_archive
+from image_store import INDEX_FILE, load_index, image_path, image_variants, file_meta, refresh_metadata
 
+
+@traced("load_piatti")
 def load_piatti(base_dir):
     """
     Legge archivio_piatti.xlsx e restituisce lista di dict:
@@ -10,26 +16,44 @@ def load_piatti(base_dir):
             "seriale": int,
             "titolo": str,
             "frase": str,
-            "img_path": str | None
+            "img_path": str | None,
+            "img_meta": {"px", "format", "mode", "bytes", "hash", "color", "mtime"} | None,
+            "img_variants": {nome: {"path": str, "px": [w, h], "format", "mode", "hash"}}
         }
     ]
+
+    Il risultato è condiviso tra le sessioni finché Excel e indice immagini non
+    cambiano: va trattato in sola lettura. Le immagini non vengono aperte:
+    dimensioni, formato e hash arrivano dall'indice (aggiornato con una
+    scansione della cartella che rilegge solo i file cambiati).
     """
 
     excel_path = os.path.join(base_dir, "archivio_piatti.xlsx")
     img_dir = os.path.join(base_dir, "img")
 
-    if not os.path.exists(excel_path):
+    excel_sig = file_signature(excel_path)
+    if excel_sig is None:
         raise FileNotFoundError(f"Excel non trovato: {excel_path}")
 
-    df = pd.read_excel(excel_path, engine="openpyxl")
+    refresh_metadata(img_dir)
+    key = (excel_sig, file_signature(os.path.join(img_dir, INDEX_FILE)))
+    return list(get_cache().get_or_create("archive", key, lambda: _read_piatti(excel_path, img_dir)))
 
-    piatti = []
 
-    for _, row in df.iterrows():
+def _read_piatti(excel_path, img_dir):
+    # solo le colonne usate dalla cover (snapshot Parquet se aggiornato)
+    df = read_archive(excel_path, columns=["seriale", "titolo", "frase_iconica"])
+    index = load_index(img_dir)
+
+    piatti = []
 
-        seriale = row.get("seriale")
-        titolo = row.get("titolo")
-        frase = row.get("frase_iconica")
+    # zip sulle colonne: molto più rapido di iterrows su archivi grandi
+    missing = [None] * len(df)
+    for seriale, titolo, frase in zip(
+        df["seriale"] if "seriale" in df else missing,
+        df["titolo"] if "titolo" in df else missing,
+        df["frase_iconica"] if "frase_iconica" in df else missing,
+    ):
 
         # Salta righe senza seriale o titolo
         if pd.isna(seriale) or pd.isna(titolo):
@@ -39,16 +63,16 @@ def load_piatti(base_dir):
         titolo = str(titolo).strip()
         frase = "" if pd.isna(frase) else str(frase).strip()
 
-        # Risoluzione immagine: seriale.png
-        img_path = os.path.join(img_dir, f"{seriale}.png")
-        if not os.path.exists(img_path):
-            img_path = None
+        # Risoluzione immagine: image store (master + varianti) o seriale.png legacy
+        img_path = image_path(seriale, "master", img_dir, index)
 
         piatti.append({
             "seriale": seriale,
             "titolo": titolo,
             "frase": frase,
-            "img_path": img_path
+            "img_path": img_path,
+            "img_meta": file_meta(img_path, img_dir, index) if img_path else None,
+            "img_variants": image_variants(seriale, img_dir, index)
         })
 
     return piatti
@@ -0,0 +1,181 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import yaml
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+
+LAYOUTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts.yaml")
+
+# chiavi di stile sovrascrivibili a livello default / layout / hero / cella
+STYLE_KEYS = ("titolo_size", "titolo_max_righe", "frase_size", "frase_max_righe", "img_ratio")
+
+
+@dataclass(frozen=True)
+class CellGeometry:
+    """Geometria precalcolata di una cella (punti PDF, origine in basso a sinistra)."""
+    index: int
+    x: float
+    y: float
+    w: float
+    h: float
+    is_hero: bool
+    # area immagine
+    img_x: float
+    img_y: float
+    img_w: float
+    img_h: float
+    # area testo
+    text_x: float
+    text_w: float
+    text_gap: float
+    phrase_gap: float
+    line_gap: float
+    # font
+    title_font: str
+    title_size: float
+    title_max_lines: int
+    phrase_font: str
+    phrase_size: float
+    phrase_max_lines: int
+
+    def image_target_px(self, dpi):
+        """Dimensione in pixel dell'area immagine alla risoluzione indicata."""
+        return (
+            max(200, int((self.img_w / 72.0) * dpi)),
+            max(200, int((self.img_h / 72.0) * dpi)),
+        )
+
+
+@dataclass(frozen=True)
+class CompiledLayout:
+    key: str
+    rows: int
+    cols: int
+    page_w: float
+    page_h: float
+    cells: tuple
+
+    @property
+    def capacity(self):
+        return len(self.cells)
+
+
+def _compile_layout(key, spec, pagina, font, default, hero, page_size):
+    rows, cols = spec["griglia"]
+    page_w, page_h = page_size
+
+    margin = pagina.get("margine_mm", 10) * mm
+    header_space = pagina.get("header_mm", 30) * mm
+    pad = pagina.get("pad_cella_mm", 6) * mm
+    text_gap = pagina.get("gap_testo_mm", 6) * mm
+    phrase_gap = pagina.get("gap_frase_mm", 2) * mm
+    line_gap = pagina.get("interlinea", 1.2)
+
+    dyn_left = margin
+    dyn_top = page_h - margin - header_space
+    dyn_w = (page_w - margin) - dyn_left
+    dyn_h = dyn_top - margin
+
+    cell_w = dyn_w / cols
+    cell_h = dyn_h / rows
+
+    layout_style = {k: spec[k] for k in STYLE_KEYS if k in spec}
+
+    # celle unite: (riga, col) di partenza -> definizione; celle coperte da saltare
+    merged = {}
+    covered = set()
+    for m in spec.get("celle_unite") or []:
+        r0, c0 = m["riga"], m["col"]
+        rs, cs = m.get("rowspan", 1), m.get("colspan", 1)
+        merged[(r0, c0)] = m
+        for r in range(r0, r0 + rs):
+            for c in range(c0, c0 + cs):
+                if (r, c) != (r0, c0):
+                    covered.add((r, c))
+
+    cells = []
+    for r in range(rows):
+        for c in range(cols):
+            if (r, c) in covered:
+                continue
+
+            m = merged.get((r, c), {})
+            rs, cs = m.get("rowspan", 1), m.get("colspan", 1)
+            is_hero = bool(m.get("hero", False))
+
+            style = dict(default)
+            style.update(layout_style)
+            if is_hero:
+                style.update(hero)
+            style.update({k: m[k] for k in STYLE_KEYS if k in m})
+
+            # coordinate cella (riga 0 in alto)
+            x = dyn_left + c * cell_w
+            y = dyn_top - (r + rs) * cell_h
+            w = cell_w * cs
+            h = cell_h * rs
+
+            img_h = h * style["img_ratio"]
+            phrase_max_lines = style.get("frase_max_righe")
+            if phrase_max_lines is None:
+                phrase_max_lines = 4 if h >= 70 * mm else 3
+
+            cells.append(CellGeometry(
+                index=len(cells),
+                x=x, y=y, w=w, h=h,
+                is_hero=is_hero,
+                img_x=x + pad,
+                img_y=y + h - img_h - pad,
+                img_w=w - 2 * pad,
+                img_h=img_h,
+                text_x=x + pad,
+                text_w=w - 2 * pad,
+                text_gap=text_gap,
+                phrase_gap=phrase_gap,
+                line_gap=line_gap,
+                title_font=font.get("titolo", "Helvetica-Bold"),
+                title_size=style["titolo_size"],
+                title_max_lines=style["titolo_max_righe"],
+                phrase_font=font.get("frase", "Helvetica"),
+                phrase_size=style["frase_size"],
+                phrase_max_lines=phrase_max_lines,
+            ))
+
+    return CompiledLayout(
+        key=key, rows=rows, cols=cols,
+        page_w=page_w, page_h=page_h,
+        cells=tuple(cells),
+    )
+
+
+@lru_cache(maxsize=8)
+def _compile_file(path, mtime, page_size):
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+
+    pagina = cfg.get("pagina") or {}
+    font = cfg.get("font") or {}
+    default = cfg.get("default") or {}
+    hero = cfg.get("hero") or {}
+
+    return {
+        key: _compile_layout(key, spec, pagina, font, default, hero, page_size)
+        for key, spec in (cfg.get("layouts") or {}).items()
+    }
+
+
+def load_layouts(path=LAYOUTS_FILE, page_size=A4):
+    """
+    Ritorna dict: nome layout -> CompiledLayout.
+    Il file viene compilato una sola volta e ricompilato solo se cambia (mtime).
+    """
+    return _compile_file(path, os.path.getmtime(path), tuple(page_size))
+
+
+def get_layout(layout_key, path=LAYOUTS_FILE, page_size=A4):
+    layouts = load_layouts(path, page_size)
+    if layout_key not in layouts:
+        raise KeyError(f"Layout sconosciuto: {layout_key}")
+    return layouts[layout_key]
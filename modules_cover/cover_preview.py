@@ -0,0 +1,110 @@
+import io
+import os
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import A4
+
+from modules_cover.cover_layouts import get_layout
+from modules_cover.cover_render import plan_cell, crop_fill, pick_image
+from shared_cache import get_cache
+from modules_cover.cover_cache import cover_cache_key
+
+PREVIEW_WIDTH_PX = 420
+THUMB_MAX_PX = 256
+
+# Font TrueType simili a Helvetica (Linux / Windows); fallback sul font di Pillow
+_FONT_CANDIDATES = {
+    "Helvetica-Bold": ["DejaVuSans-Bold.ttf", "arialbd.ttf", "Arial Bold.ttf", "LiberationSans-Bold.ttf"],
+    "Helvetica": ["DejaVuSans.ttf", "arial.ttf", "Arial.ttf", "LiberationSans-Regular.ttf"],
+}
+
+# namespace della cache condivisa:
+#   ("thumb", path, mtime | hash, max_px) -> PIL.Image RGB
+#   ("png", cache_key, width_px)   -> PNG bytes
+CACHE_NAMESPACE = "cover_preview"
+
+
+def load_thumbnail(img_path, max_px=THUMB_MAX_PX, meta=None):
+    """
+    Miniatura RGB (lato max max_px), decodificata una volta e tenuta in memoria.
+    Con i metadati dell'indice immagini la chiave è l'hash, senza stat del file.
+    """
+    version = meta["hash"] if meta else os.path.getmtime(img_path)
+    key = ("thumb", os.path.abspath(img_path), version, max_px)
+
+    def decode():
+        with Image.open(img_path) as img:
+            img.draft("RGB", (max_px, max_px))  # JPEG: decodifica già ridotta
+            thumb = img.convert("RGB")
+            thumb.thumbnail((max_px, max_px), Image.Resampling.BILINEAR)
+        return thumb
+
+    return get_cache().get_or_create(CACHE_NAMESPACE, key, decode)
+
+
+@lru_cache(maxsize=32)
+def _font(font_name, size_px):
+    for candidate in _FONT_CANDIDATES.get(font_name, []):
+        try:
+            return ImageFont.truetype(candidate, size_px)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size_px)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def render_cover_preview(layout_key, items, piatto_by_seriale,
+                         background_image_path=None, width_px=PREVIEW_WIDTH_PX):
+    """
+    Anteprima PNG a bassa risoluzione della cover.
+    Usa la stessa geometria (layouts.yaml) e lo stesso posizionamento testo (plan_cell)
+    di render_cover_pdf, ma con miniature al posto dei crop a piena risoluzione.
+    """
+    key = ("png", cover_cache_key(layout_key, items, piatto_by_seriale, background_image_path), width_px)
+    png = get_cache().get(CACHE_NAMESPACE, key)
+    if png is not None:
+        return png
+
+    layout = get_layout(layout_key, page_size=A4)
+    scale = width_px / layout.page_w
+    height_px = int(round(layout.page_h * scale))
+
+    def px(v):
+        return int(round(v * scale))
+
+    if background_image_path and os.path.exists(background_image_path):
+        canvas_img = load_thumbnail(background_image_path, max_px=max(width_px, height_px))
+        canvas_img = canvas_img.resize((width_px, height_px), Image.Resampling.BILINEAR)
+    else:
+        canvas_img = Image.new("RGB", (width_px, height_px), (255, 255, 255))
+
+    draw = ImageDraw.Draw(canvas_img)
+
+    n = min(len(items), len(layout.cells))
+    for cell, it in zip(layout.cells[:n], items[:n]):
+        p = piatto_by_seriale[it["seriale"]]
+        plan = plan_cell(cell, p, it)
+
+        if plan["image"]:
+            w, h = max(1, px(cell.img_w)), max(1, px(cell.img_h))
+            src, meta = pick_image(p, w, h)
+            thumb = crop_fill(load_thumbnail(src, meta=meta), w, h, Image.Resampling.BILINEAR)
+            canvas_img.paste(thumb, (px(cell.img_x), px(layout.page_h - cell.img_y - cell.img_h)))
+
+        # y PDF = baseline dal basso -> y PIL = baseline dall'alto
+        for ln in plan["lines"]:
+            size_px = max(4, px(ln.size))
+            font = _font(ln.font, size_px)
+            x, y = px(ln.x), px(layout.page_h - ln.y)
+            if isinstance(font, ImageFont.FreeTypeFont):
+                draw.text((x, y), ln.text, fill=(0, 0, 0), font=font, anchor="ls")
+            else:  # font bitmap: niente anchor, si sposta a mano
+                draw.text((x, y - size_px), ln.text, fill=(0, 0, 0), font=font)
+
+    buf = io.BytesIO()
+    canvas_img.save(buf, "PNG", compress_level=1)
+    png = buf.getvalue()
+    return get_cache().put(CACHE_NAMESPACE, key, png)
@@ -1,11 +1,18 @@
+import io
 import os
+import time
+import hashlib
+from collections import namedtuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
 
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from PIL import Image
-from reportlab.lib.utils import ImageReader
+
+from modules_cover.cover_layouts import get_layout
+from image_store import best_variant
+from profiling import traced
+from shared_cache import get_cache
 
 def wrap_text_to_lines(text, font_name, font_size, max_width):
     """Ritorna una lista di righe che stanno dentro max_width."""
@@ -24,11 +31,11 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
         lines.append(cur)
     return lines
 
-def draw_wrapped(c, text, x, y_top, max_width, font_name, font_size, max_lines, line_gap=1.2, align="left"):
-    """
-    align: "left" o "center"
-    """
-    c.setFont(font_name, font_size)
+TextLine = namedtuple("TextLine", "text x y font size")
+
+
+def fit_lines(text, font_name, font_size, max_width, max_lines):
+    """Wrap del testo; se eccede max_lines tronca l'ultima riga con "…"."""
     lines = wrap_text_to_lines(text, font_name, font_size, max_width)
 
     if len(lines) > max_lines:
@@ -38,25 +45,46 @@ def draw_wrapped(c, text, x, y_top, max_width, font_name, font_size, max_lines,
             last = last[:-1]
         lines[-1] = (last + "…") if last else "…"
 
+    return lines
+
+
+def layout_wrapped(text, x, y_top, max_width, font_name, font_size, max_lines, line_gap=1.2, align="left"):
+    """
+    Posiziona le righe senza disegnarle.
+    Ritorna (lista TextLine, y sotto l'ultima riga).
+    """
+    out = []
     y = y_top
     step = font_size * line_gap
-    for ln in lines:
+    for ln in fit_lines(text, font_name, font_size, max_width, max_lines):
         if align == "center":
             line_width = stringWidth(ln, font_name, font_size)
             x_draw = x + (max_width - line_width) / 2
         else:
             x_draw = x
-        c.drawString(x_draw, y, ln)
+        out.append(TextLine(ln, x_draw, y, font_name, font_size))
         y -= step
 
-    return y
+    return out, y
 
 
-def crop_fill_image(img_path, target_w_px, target_h_px):
+def draw_wrapped(c, text, x, y_top, max_width, font_name, font_size, max_lines, line_gap=1.2, align="left"):
     """
-    Ritorna un'immagine PIL croppata e ridimensionata per riempire target (crop center).
+    align: "left" o "center"
     """
-    img = Image.open(img_path).convert("RGB")
+    lines, y = layout_wrapped(text, x, y_top, max_width, font_name, font_size, max_lines, line_gap, align)
+    draw_text_lines(c, lines)
+    return y
+
+
+def draw_text_lines(c, lines):
+    for ln in lines:
+        c.setFont(ln.font, ln.size)
+        c.drawString(ln.x, ln.y, ln.text)
+
+
+def crop_fill(img, target_w_px, target_h_px, resample=Image.Resampling.LANCZOS):
+    """Crop centrale di un'immagine PIL già aperta per riempire target."""
     iw, ih = img.size
     target_ratio = target_w_px / target_h_px
     img_ratio = iw / ih
@@ -72,214 +100,335 @@ def crop_fill_image(img_path, target_w_px, target_h_px):
         top = (ih - new_h) // 2
         img = img.crop((0, top, iw, top + new_h))
 
-    img = img.resize((target_w_px, target_h_px), Image.Resampling.LANCZOS)
-    return img
+    return img.resize((target_w_px, target_h_px), resample)
 
 
+def pick_image(p, min_w_px, min_h_px, allowed=None):
+    """
+    (path, metadati) del file immagine più leggero che copre min_w_px x min_h_px
+    (varianti dell'image store), altrimenti dell'immagine originale.
+    I metadati vengono dall'indice immagini (None se non indicizzata).
+    """
+    v = best_variant(p.get("img_variants") or {}, min_w_px, min_h_px, allowed)
+    if v:
+        return v["path"], (v if "hash" in v else None)
+    return p.get("img_path"), p.get("img_meta")
 
 
+# =====================
+# Profili di compressione delle immagini nel PDF
+# =====================
+# nome -> dpi delle celle, qualità JPEG, dpi del background, sovracampionamento
+# massimo accettato per incorporare il JPEG sorgente così com'è
+COMPRESSION_PROFILES = {
+    "screen": {"dpi": 150, "jpeg_quality": 80, "background_dpi": 120, "max_oversample": 1.25},
+    "print": {"dpi": 300, "jpeg_quality": 90, "background_dpi": 200, "max_oversample": 1.5},
+}
+DEFAULT_PROFILE = os.getenv("COVER_PDF_PROFILE", "screen")
 
-def render_cover_pdf(output_path, layout_key, header_title, header_subtitle,
-                     items, piatto_by_seriale,
-                     background_image_path=None):
+# namespace della cache condivisa (LRU con budget): chiave (path, mtime, size, target px, qualità)
+# oppure (hash, target px, qualità) -> (path da incorporare, passthrough)
+CELL_CACHE_NAMESPACE = "cover_cells"
 
-    """
-    items: lista confermata:
-      [{"seriale": int, "img": bool, "frase": bool}, ...]
-    """
-    
 
+def get_profile(name=None):
+    return COMPRESSION_PROFILES.get(name or DEFAULT_PROFILE, COMPRESSION_PROFILES["screen"])
 
-    W, H = A4
-    c = canvas.Canvas(output_path, pagesize=A4)
 
-    # --- BACKGROUND A4 ---
-    if background_image_path and os.path.exists(background_image_path):
-        c.drawImage(
-            ImageReader(background_image_path),
-            0, 0,
-            width=W,
-            height=H
-        )
+def _can_passthrough(fmt, mode, size, target_w_px, target_h_px, max_oversample):
+    """JPEG RGB/grigi con le proporzioni della cella e non molto più grande del necessario."""
+    if fmt != "JPEG" or mode not in ("RGB", "L"):
+        return False
+    iw, ih = size
+    if abs(iw / ih - target_w_px / target_h_px) > 0.01 * (target_w_px / target_h_px):
+        return False
+    return target_w_px <= iw <= target_w_px * max_oversample
 
-    # --- AREA DINAMICA (zona piatti sopra il background) ---
 
-    margin = 10 * mm   # margine di sicurezza interno (regolabile)
+def _write_cell(out_path, data):
+    if not os.path.exists(out_path):
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
 
-    x0 = margin
-    y0 = margin
-    x1 = W - margin
-    y1 = H - margin
 
-    dyn_left = x0
-    dyn_right = x1
-    dyn_bottom = y0
-    header_space =30 * mm
-    dyn_top = y1 - header_space
+def prepare_cell_image(src_path, target_w_px, target_h_px, quality, max_oversample=1.0, cache_dir=None,
+                       meta=None):
+    """
+    File JPEG da passare a drawImage per una cella: reportlab incorpora i JPEG
+    come DCT senza ricodificarli e, a parità di nome file, una volta sola.
+
+    - il JPEG sorgente, se ha già proporzioni e risoluzione giuste (passthrough)
+    - altrimenti il crop-fill salvato in cache come JPEG, con nome derivato
+      dal contenuto: immagini identiche finiscono nello stesso file
 
+    Con i metadati dell'indice immagini (formato, px, hash) la decisione e il
+    nome del file in cache non richiedono di aprire l'immagine: si decodifica
+    solo per produrre un crop che non è ancora su disco.
 
-    dyn_w = dyn_right - dyn_left
-    dyn_h = dyn_top - dyn_bottom
+    Ritorna (path, passthrough).
+    """
+    if meta:
+        key = (meta["hash"], target_w_px, target_h_px, quality)
+    else:
+        st_src = os.stat(src_path)
+        key = (os.path.abspath(src_path), st_src.st_mtime, st_src.st_size, target_w_px, target_h_px, quality)
+    hit = get_cache().get(CELL_CACHE_NAMESPACE, key)
+    if hit and os.path.exists(hit[0]):
+        return hit
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(src_path)), ".cache")
+
+    if meta:
+        if _can_passthrough(meta["format"], meta["mode"], meta["px"], target_w_px, target_h_px, max_oversample):
+            result = (src_path, True)
+        else:
+            digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+            out_path = os.path.join(cache_dir, f"cell_{digest}.jpg")
+            if not os.path.exists(out_path):
+                with Image.open(src_path) as img:
+                    buf = io.BytesIO()
+                    crop_fill(img.convert("RGB"), target_w_px, target_h_px).save(buf, "JPEG", quality=quality, optimize=True)
+                os.makedirs(cache_dir, exist_ok=True)
+                _write_cell(out_path, buf.getvalue())
+            result = (out_path, False)
+    else:
+        with Image.open(src_path) as img:
+            if _can_passthrough(img.format, img.mode, img.size, target_w_px, target_h_px, max_oversample):
+                result = (src_path, True)
+            else:
+                buf = io.BytesIO()
+                crop_fill(img.convert("RGB"), target_w_px, target_h_px).save(buf, "JPEG", quality=quality, optimize=True)
+                data = buf.getvalue()
+                os.makedirs(cache_dir, exist_ok=True)
+                out_path = os.path.join(cache_dir, f"cell_{hashlib.sha1(data).hexdigest()[:16]}.jpg")
+                _write_cell(out_path, data)
+                result = (out_path, False)
 
+    return get_cache().put(CELL_CACHE_NAMESPACE, key, result)
 
-    # Layout rows x cols (Righe x Colonne)
-    layout_rc = {
-        "LO1 (1x1)": (1, 1),
-        "LO2 (2x1)": (2, 1),
-        "LO3 (3x1)": (3, 1),
-        "LO4 (2x2)": (2, 2),
-        "LO5 (3x2 hero)": (3, 2),
-        "LO6 (3x2)": (3, 2),
-    }
-    rows, cols = layout_rc[layout_key]
-
-    cell_w = dyn_w / cols
-    cell_h = dyn_h / rows
-
-    # Genera lista celle (con merge per LO5)
-    cells = []
-    for r in range(rows):
-        for col in range(cols):
-            # coordinate cella (riga 0 in alto)
-            x = dyn_left + col * cell_w
-            y = dyn_top - (r + 1) * cell_h
-            w = cell_w
-            h = cell_h
-
-            # Merge LO5: riga 2 (index 1) unita su 2 colonne
-            if layout_key == "LO5 (3x2 hero)" and r == 1:
-                if col == 0:
-                    w = cell_w * 2
-                    cells.append((x, y, w, h, True))  # hero
-                # col==1 saltata
-                continue
-
-            cells.append((x, y, w, h, False))
 
-    # Assegna items in ordine di lettura alle celle
-    n = min(len(items), len(cells))
-    items = items[:n]
+# =====================
+# Background (preparato una volta, riusato come form XObject)
+# =====================
+BACKGROUND_DPI = 150
+BACKGROUND_FORM = "cover_background"
 
-    for i in range(n):
-        x, y, w, h, is_hero = cells[i]
-        it = items[i]
-        p = piatto_by_seriale[it["seriale"]]
+# namespace della cache condivisa: chiave (path, mtime, size, dpi, versione) -> info background preparato
+BACKGROUND_CACHE_NAMESPACE = "cover_background"
+# da incrementare quando cambia la preparazione (invalida i JPEG in .cache)
+_BACKGROUND_VERSION = 2
 
-        # bordo cella (wireframe)
-        # c.setLineWidth(0.7 if is_hero else 0.4)
-        # c.rect(x, y, w, h)
 
-        titolo = p["titolo"]
-        frase = p.get("frase", "")
+def prepare_background(background_image_path, page_size=A4, dpi=BACKGROUND_DPI, cache_dir=None):
+    """
+    Ridimensiona il background alla risoluzione di stampa (dpi) UNA volta
+    e lo salva in cache come JPEG (reportlab lo incorpora senza ricodifica).
 
-        # testo centrato (per wireframe)
-        pad = 6 * mm
-        text_x = x + pad
-        text_w = w - 2 * pad
+    Ritorna dict:
+      {"path": str, "source_px": (w, h), "prepared_px": (w, h),
+       "source_dpi": float, "effective_dpi": float}
+    """
+    st_src = os.stat(background_image_path)
+    key = (os.path.abspath(background_image_path), st_src.st_mtime, st_src.st_size, dpi, _BACKGROUND_VERSION)
+    info = get_cache().get(BACKGROUND_CACHE_NAMESPACE, key)
+    if info and os.path.exists(info["path"]):
+        return info
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(background_image_path)), ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    out_path = os.path.join(cache_dir, f"background_{digest}.jpg")
+
+    page_w, page_h = page_size
+    target_w_px = int(round(page_w / 72.0 * dpi))
+    target_h_px = int(round(page_h / 72.0 * dpi))
+
+    with Image.open(background_image_path) as img:
+        source_px = img.size
+        if not os.path.exists(out_path):
+            # appiattisce eventuale trasparenza su bianco
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                flat = Image.new("RGB", img.size, (255, 255, 255))
+                flat.paste(img, mask=img.split()[-1])
+                img = flat
+            else:
+                img = img.convert("RGB")
 
-        # Area immagine dentro la cella
-        img_h = h * (0.75 if is_hero else 0.65)
-        img_x = x + pad
-        img_y = y + h - img_h - pad
-        img_w = w - 2 * pad
+            # solo downsampling, proporzioni mantenute: mai ingrandire né deformare un lato
+            img.thumbnail((target_w_px, target_h_px), Image.Resampling.LANCZOS)
 
-        img_path = p.get("img_path")
-        if it.get("img") and img_path:
-            # Disegna immagine
-            dpi = 150
-            target_w_px = max(200, int((img_w / 72.0) * dpi))
-            target_h_px = max(200, int((img_h / 72.0) * dpi))
+            tmp_path = out_path + ".tmp"
+            img.save(tmp_path, "JPEG", quality=88, optimize=True)
+            os.replace(tmp_path, out_path)
 
-            pil_img = crop_fill_image(img_path, target_w_px, target_h_px)
-            c.drawImage(ImageReader(pil_img), img_x, img_y, width=img_w, height=img_h)
+    with Image.open(out_path) as prepared:
+        prepared_px = prepared.size
 
-            # Testo parte sotto immagine
-            y_text_top = img_y - 6*mm
-        else:
-            # Niente immagine: testo parte più in alto (centreremo meglio nello step successivo)
-            # --- NO IMMAGINE: centra verticalmente titolo + (eventuale) frase ---
-            pad = 6 * mm
-            text_w = w - 2 * pad
-
-            title_font = "Helvetica-Bold"
-            title_size = 13 if is_hero else 11
-            phrase_font = "Helvetica"
-            phrase_size = 8
-
-            # Stima righe effettive (wrap) per calcolare altezza blocco testo
-            title_lines = wrap_text_to_lines(titolo, title_font, title_size, text_w)
-            title_lines = title_lines[:2]
-            title_h = len(title_lines) * (title_size * 1.2)
-
-            phrase_h = 0
-            phrase_lines = []
-            if is_hero:
-                max_phrase_lines = 5
-            else:
-                if layout_key in ("LO5 (3x2 hero)", "LO6 (3x2)"):
-                    max_phrase_lines = 5
-                else:
-                    max_phrase_lines = 4 if h >= 70 * mm else 3
+    info = {
+        "path": out_path,
+        "source_px": source_px,
+        "prepared_px": prepared_px,
+        "source_dpi": round(source_px[0] / (page_w / 72.0), 1),
+        "effective_dpi": round(prepared_px[0] / (page_w / 72.0), 1),
+    }
+    return get_cache().put(BACKGROUND_CACHE_NAMESPACE, key, info)
 
 
-            if it.get("frase") and frase:
-                phrase_lines = wrap_text_to_lines(frase, phrase_font, phrase_size, text_w)
-                phrase_lines = phrase_lines[:max_phrase_lines]
-                phrase_h = len(phrase_lines) * (phrase_size * 1.2) + (2 * mm)  # include gap
+def draw_background(c, bg_info, page_size=A4):
+    """Disegna il background tramite form XObject (definito una sola volta per documento)."""
+    page_w, page_h = page_size
+    if not c.hasForm(BACKGROUND_FORM):
+        c.beginForm(BACKGROUND_FORM)
+        c.drawImage(bg_info["path"], 0, 0, width=page_w, height=page_h)
+        c.endForm()
+    c.doForm(BACKGROUND_FORM)
 
-            block_h = title_h + phrase_h
 
-            # y_top del blocco centrato
-            y_text_top = y + (h + block_h) / 2 - title_size  # leggero aggiustamento ottico
 
 
 
+def plan_cell(cell, p, it):
+    """
+    Decide contenuto e posizione di una cella (immagine + righe di testo).
+    Condiviso tra PDF e anteprima, così l'anteprima corrisponde all'output.
 
-        # Titolo: max 2 righe
-        title_font = "Helvetica-Bold"
-        title_size = 13 if is_hero else 11
-        y_cursor = y_text_top
+    Ritorna dict: {"image": img_path | None, "lines": [TextLine, ...]}
+    """
+    titolo = p["titolo"]
+    frase = p.get("frase", "") if it.get("frase") else ""
+    img_path = p.get("img_path") if it.get("img") else None
 
-        # Titolo
-        title_font = "Helvetica-Bold"
-        title_size = 13 if is_hero else 11
-        y_cursor = draw_wrapped(
-            c, titolo, text_x, y_cursor, text_w,
-            title_font, title_size,
-            max_lines=2,
-            align="center"
+    if img_path:
+        # Testo parte sotto immagine
+        y_text_top = cell.img_y - cell.text_gap
+    else:
+        # --- NO IMMAGINE: centra verticalmente titolo + (eventuale) frase ---
+        title_lines = wrap_text_to_lines(titolo, cell.title_font, cell.title_size, cell.text_w)
+        title_lines = title_lines[:cell.title_max_lines]
+        title_h = len(title_lines) * (cell.title_size * cell.line_gap)
+
+        phrase_h = 0
+        if frase:
+            phrase_lines = wrap_text_to_lines(frase, cell.phrase_font, cell.phrase_size, cell.text_w)
+            phrase_lines = phrase_lines[:cell.phrase_max_lines]
+            phrase_h = len(phrase_lines) * (cell.phrase_size * cell.line_gap) + cell.phrase_gap  # include gap
+
+        block_h = title_h + phrase_h
+
+        # y_top del blocco centrato
+        y_text_top = cell.y + (cell.h + block_h) / 2 - cell.title_size  # leggero aggiustamento ottico
+
+    # Titolo
+    lines, y_cursor = layout_wrapped(
+        titolo, cell.text_x, y_text_top, cell.text_w,
+        cell.title_font, cell.title_size,
+        max_lines=cell.title_max_lines,
+        line_gap=cell.line_gap,
+        align="center"
+    )
+
+    # Frase
+    if frase:
+        phrase_lines, _ = layout_wrapped(
+            frase, cell.text_x, y_cursor - cell.phrase_gap, cell.text_w,
+            cell.phrase_font, cell.phrase_size,
+            max_lines=cell.phrase_max_lines,
+            line_gap=cell.line_gap
         )
+        lines.extend(phrase_lines)
 
+    return {"image": img_path, "lines": lines}
 
-       # Frase
-        if it.get("frase") and frase:
-            phrase_font = "Helvetica"
-            phrase_size = 8
-            y_cursor -= 2 * mm
 
-            if is_hero:
-                max_phrase_lines = 5
-            else:
-                if layout_key in ("LO5 (3x2 hero)", "LO6 (3x2)"):
-                    max_phrase_lines = 5
-                else:
-                    max_phrase_lines = 4 if h >= 70 * mm else 3
-
-        draw_wrapped(
-            c, frase, text_x, y_cursor, text_w,
-            phrase_font, phrase_size,
-            max_lines=max_phrase_lines
-        )
+@traced("render_cover_pdf")
+def render_cover_pdf(output_path, layout_key, header_title, header_subtitle,
+                     items, piatto_by_seriale,
+                     background_image_path=None, profile=None):
+
+    """
+    items: lista confermata:
+      [{"seriale": int, "img": bool, "frase": bool}, ...]
+    profile: chiave di COMPRESSION_PROFILES (default COVER_PDF_PROFILE / "screen")
+
+    Ritorna un report dict con dimensione del PDF, tempo di render,
+    risoluzione del background e immagini incorporate.
+    """
+    t0 = time.perf_counter()
+    profile_name = profile if profile in COMPRESSION_PROFILES else DEFAULT_PROFILE
+    prof = get_profile(profile_name)
 
+    c = canvas.Canvas(output_path, pagesize=A4)
 
+    report = {"output_path": output_path, "profile": profile_name, "background": None}
 
+    # --- BACKGROUND A4 ---
+    if background_image_path and os.path.exists(background_image_path):
+        bg_info = prepare_background(background_image_path, page_size=A4, dpi=prof["background_dpi"])
+        draw_background(c, bg_info, page_size=A4)
+        report["background"] = bg_info
 
-            
+    # --- CELLE (geometria precompilata da layouts.yaml) ---
+    layout = get_layout(layout_key, page_size=A4)
+    cells = layout.cells
 
+    # Assegna items in ordine di lettura alle celle
+    n = min(len(items), len(cells))
+    images = {"references": 0, "passthrough": 0, "encoded": 0}
+    embedded = set()
 
-        # mostra anche i flag
-        # c.setFont("Helvetica", 7)
-        # c.drawString(x + 6*mm, y + 6*mm, f"#{it['seriale']}  img={it['img']}  frase={it['frase']}")
+    for cell, it in zip(cells[:n], items[:n]):
+        p = piatto_by_seriale[it["seriale"]]
+        plan = plan_cell(cell, p, it)
+
+        if plan["image"]:
+            # Disegna immagine: JPEG da file, incorporato una volta sola per nome
+            target_w_px, target_h_px = cell.image_target_px(prof["dpi"])
+            src, meta = pick_image(p, target_w_px, target_h_px)
+            img_path, passthrough = prepare_cell_image(
+                src, target_w_px, target_h_px, prof["jpeg_quality"], prof["max_oversample"], meta=meta
+            )
+            c.drawImage(img_path, cell.img_x, cell.img_y, width=cell.img_w, height=cell.img_h)
+            images["references"] += 1
+            if img_path not in embedded:
+                embedded.add(img_path)
+                images["passthrough" if passthrough else "encoded"] += 1
+
+        draw_text_lines(c, plan["lines"])
 
     c.showPage()
     c.save()
+
+    images["embedded"] = len(embedded)
+    report["images"] = images
+    report["pdf_bytes"] = os.path.getsize(output_path)
+    report["render_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return report
+
+
+def format_render_report(report):
+    """Riga leggibile per la UI: dimensione PDF, profilo, immagini e DPI del background."""
+    size_kb = report.get("pdf_bytes", 0) / 1024
+    text = f"PDF: {size_kb:.0f} KB"
+    if report.get("profile"):
+        text += f" ({report['profile']}, {report.get('render_ms', 0):.0f} ms)"
+    images = report.get("images")
+    if images and images["references"]:
+        text += (
+            f" — immagini: {images['embedded']} incorporate per {images['references']} celle"
+            f" ({images['passthrough']} JPEG originali)"
+        )
+    bg = report.get("background")
+    if not bg:
+        return text + " — nessun background"
+    sw, sh = bg["source_px"]
+    pw, ph = bg["prepared_px"]
+    return (
+        f"{text} — background {sw}×{sh}px ({bg['source_dpi']:.0f} dpi) "
+        f"→ {pw}×{ph}px ({bg['effective_dpi']:.0f} dpi)"
+    )
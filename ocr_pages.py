@@ -0,0 +1,108 @@
+"""
+OCR di ricette su più foto (una pagina per foto).
+
+Le pagine vengono estratte in parallelo (OCR_WORKERS, default 4) e ricomposte
+nell'ordine scelto in un unico testo. Ogni pagina è in cache (namespace "ocr"
+della cache condivisa) per hash dei byte: riordinare, togliere o aggiungere una
+foto non rifà l'OCR delle altre, e la stessa foto caricata da un'altra sessione
+arriva già estratta.
+
+Ordinamento opzionale per numero di pagina trovato nel testo ("Pag. 2",
+"pagina 2 di 3", "2/3", "- 2 -") in testa o in coda alla pagina.
+"""
+import os
+import re
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_cache import get_cache
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "4"))
+
+_PAGE_MARK = re.compile(
+    r"^\s*(?:"
+    r"(?:pag(?:ina)?|p)\.?\s*(\d{1,3})(?:\s*(?:di|/)\s*\d{1,3})?"   # Pag. 2, pagina 2 di 3, p. 2
+    r"|(\d{1,3})\s*/\s*\d{1,3}"                                      # 2/3
+    r"|[-–—]\s*(\d{1,3})\s*[-–—]"                                    # - 2 -
+    r")\s*$",
+    re.IGNORECASE,
+)
+_EDGE_LINES = 2  # righe in testa e in coda dove cercare il numero di pagina
+
+
+def page_key(image_bytes, mime):
+    return (hashlib.sha256(image_bytes).hexdigest(), mime)
+
+
+def ocr_page(image_bytes, mime):
+    """(testo, dalla_cache) di una pagina."""
+    from ai_services import extract_text_from_image
+    key = page_key(image_bytes, mime)
+    cached = get_cache().contains("ocr", key)
+    text = get_cache().get_or_create("ocr", key, lambda: extract_text_from_image(image_bytes, mime))
+    return text, cached
+
+
+def _edge_lines(lines):
+    idx = list(range(min(_EDGE_LINES, len(lines))))
+    return idx + [i for i in range(max(0, len(lines) - _EDGE_LINES), len(lines)) if i not in idx]
+
+
+def detect_page_number(text):
+    """(numero di pagina, indice della riga) se in testa o in coda c'è un segnapagina, altrimenti (None, None)."""
+    lines = text.splitlines()
+    for i in _edge_lines(lines):
+        m = _PAGE_MARK.match(lines[i])
+        if m:
+            return int(next(g for g in m.groups() if g)), i
+    return None, None
+
+
+def extract_pages(pages, detect_order=False, max_workers=OCR_WORKERS):
+    """
+    pages: lista di (nome, bytes, mime) nell'ordine scelto dall'utente.
+    Ritorna (pagine, report); ogni pagina è un dict con name, text, page_number, cached.
+    Con detect_order, se ogni pagina ha un numero diverso si riordina per numero.
+    """
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as pool:
+        extracted = list(pool.map(lambda p: ocr_page(p[1], p[2]), pages))
+
+    results = []
+    for (name, _data, _mime), (text, cached) in zip(pages, extracted):
+        number, line = detect_page_number(text or "")
+        results.append({"name": name, "text": text or "", "page_number": number, "mark_line": line, "cached": cached})
+
+    numbers = [r["page_number"] for r in results]
+    reordered = False
+    if detect_order and None not in numbers and len(set(numbers)) == len(numbers):
+        reordered = numbers != sorted(numbers)
+        results.sort(key=lambda r: r["page_number"])
+
+    report = {
+        "pages": len(results),
+        "cached": sum(r["cached"] for r in results),
+        "empty": sum(not r["text"].strip() for r in results),
+        "reordered": reordered,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+    return results, report
+
+
+def stitch(results):
+    """Testo unico: senza segnapagina e senza la riga ripetuta a cavallo tra due foto."""
+    out = []
+    for r in results:
+        lines = r["text"].splitlines()
+        if r["mark_line"] is not None:
+            del lines[r["mark_line"]]
+        while lines and not lines[0].strip():
+            lines.pop(0)
+        # foto sovrapposte: la prima riga della pagina ripete l'ultima della precedente
+        if out and lines and lines[0].strip() == out[-1].strip():
+            lines.pop(0)
+        out.extend(lines)
+        while out and not out[-1].strip():
+            out.pop()
+    return "\n".join(out).strip()
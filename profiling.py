@@ -0,0 +1,266 @@
+"""
+Profilo dei rerun Streamlit e tracciamento dei punti caldi.
+
+Interruttore nella pagina Admin (oppure PROFILING=1 all'avvio), valido per
+tutto il processo. Quando è acceso, ogni rerun di app.py (e ogni rerun di un
+frammento, es. archive_panel / draft_editor della Cover) viene profilato con
+cProfile e si conservano gli ultimi PROFILE_KEEP_RUNS:
+    - span: durata dei punti caldi con nome (lettura/scrittura Excel, render
+      PDF, DOCX, chiamate al modello), annidati come sono stati eseguiti
+    - top N funzioni per tempo cumulativo
+    - il profilo completo in formato .prof (snakeviz / flameprof per il flame graph)
+
+Da spento il costo è un controllo di un booleano per funzione tracciata:
+nessun profiler attivo, nessun timer, nessuna allocazione.
+
+Gli span eseguiti in altri thread (OCR in parallelo, generazione speculativa)
+finiscono nelle statistiche aggregate e, se c'è un solo rerun in corso, anche
+in quel rerun.
+"""
+import os
+import time
+import pstats
+import marshal
+import cProfile
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+PROFILE_KEEP_RUNS = int(os.getenv("PROFILE_KEEP_RUNS", "10"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+
+_enabled = os.getenv("PROFILING", "0") == "1"
+
+_LOCK = threading.Lock()
+_RUNS = deque(maxlen=PROFILE_KEEP_RUNS)   # rerun conclusi, dal più vecchio
+_SPAN_STATS = {}                          # nome -> {"n", "total_ms", "max_ms"}
+_ACTIVE = {}                              # thread id -> rerun in corso
+_local = threading.local()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(on):
+    global _enabled
+    _enabled = bool(on)
+
+
+# =====================
+# Rerun profilati
+# =====================
+class _Run:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []      # (nome, inizio_ms, durata_ms, profondità, thread)
+        self.depth = 0
+        self.profiler = cProfile.Profile()
+
+
+def start_run(label):
+    """
+    Avvia il profilo del rerun nel thread corrente; None se il profiling è spento.
+    Un rerun rimasto aperto nello stesso thread (st.rerun() a metà pagina) viene
+    chiuso come interrotto.
+    """
+    if not _enabled:
+        return None
+    stale = getattr(_local, "run", None)
+    if stale is not None:
+        finish_run(stale, interrupted=True)
+    run = _Run(label)
+    _local.run = run
+    with _LOCK:
+        _ACTIVE[threading.get_ident()] = run
+    try:
+        run.profiler.enable()
+    except ValueError:
+        # Python 3.12+: un solo profiler per processo (altra sessione in corso), restano gli span
+        run.profiler = None
+    return run
+
+
+def finish_run(run, interrupted=False):
+    """Chiude il rerun e ne conserva span e top N. Idempotente, accetta None."""
+    if run is None or getattr(_local, "run", None) is not run:
+        return
+    if run.profiler is not None:
+        run.profiler.disable()
+    _local.run = None
+    total_ms = (time.perf_counter() - run.t0) * 1000
+    with _LOCK:
+        _ACTIVE.pop(threading.get_ident(), None)
+
+    stats = pstats.Stats(run.profiler) if run.profiler is not None else None
+    record = {
+        "label": run.label,
+        "started": run.started,
+        "total_ms": total_ms,
+        "interrupted": interrupted,
+        "spans": list(run.spans),
+        "top": top_functions(stats) if stats else [],
+        "prof": marshal.dumps(stats.stats) if stats else None,  # stesso formato di dump_stats
+    }
+    with _LOCK:
+        _RUNS.append(record)
+
+
+@contextmanager
+def run_scope(label):
+    """Profilo di un blocco; se c'è già un rerun in corso nel thread vale come span."""
+    if not _enabled:
+        yield
+        return
+    if getattr(_local, "run", None) is not None:
+        with span(label):
+            yield
+        return
+    run = start_run(label)
+    try:
+        yield
+    finally:
+        finish_run(run)
+
+
+def profiled(label):
+    """Decoratore per i frammenti: il rerun del solo frammento ha il suo profilo."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with run_scope(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# =====================
+# Span sui punti caldi
+# =====================
+def _owner_run():
+    run = getattr(_local, "run", None)
+    if run is not None:
+        return run, True
+    with _LOCK:
+        if len(_ACTIVE) == 1:
+            return next(iter(_ACTIVE.values())), False
+    return None, False
+
+
+@contextmanager
+def _span(name):
+    run, same_thread = _owner_run()
+    depth = 0
+    if run is not None and same_thread:
+        depth = run.depth
+        run.depth += 1
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        if run is not None:
+            if same_thread:
+                run.depth -= 1
+            run.spans.append((name, (t0 - run.t0) * 1000, ms, depth, same_thread))
+        with _LOCK:
+            s = _SPAN_STATS.setdefault(name, {"n": 0, "total_ms": 0.0, "max_ms": 0.0})
+            s["n"] += 1
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """with span("nome"): ... — misura il blocco solo se il profiling è acceso."""
+    return _span(name) if _enabled else _NULL_SPAN
+
+
+def traced(name):
+    """Decoratore: la funzione diventa uno span con nome."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# =====================
+# Report (pagina Admin)
+# =====================
+def _func_label(func):
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def top_functions(stats, n=PROFILE_TOP_N):
+    """Le n funzioni con più tempo cumulativo (escluso il profiler stesso)."""
+    rows = []
+    for func, (_cc, ncalls, tottime, cumtime, _callers) in stats.stats.items():
+        if func[0] == __file__:
+            continue
+        rows.append({
+            "funzione": _func_label(func),
+            "chiamate": ncalls,
+            "tempo_proprio_ms": round(tottime * 1000, 1),
+            "tempo_cumulativo_ms": round(cumtime * 1000, 1),
+        })
+    rows.sort(key=lambda r: -r["tempo_cumulativo_ms"])
+    return rows[:n]
+
+
+def recent_runs():
+    """Rerun conservati, dal più recente."""
+    with _LOCK:
+        return list(reversed(_RUNS))
+
+
+def span_rows(run):
+    """Span del rerun in ordine di inizio, indentati per annidamento."""
+    return [
+        {
+            "span": "  " * depth + name + ("" if same_thread else " (altro thread)"),
+            "inizio_ms": round(start_ms, 1),
+            "durata_ms": round(ms, 1),
+            "quota": round(ms / run["total_ms"], 3) if run["total_ms"] else None,
+        }
+        for name, start_ms, ms, depth, same_thread in sorted(run["spans"], key=lambda s: s[1])
+    ]
+
+
+def span_report():
+    """Statistiche aggregate degli span da quando il profiling è acceso."""
+    with _LOCK:
+        items = [(name, dict(s)) for name, s in _SPAN_STATS.items()]
+    return [
+        {"span": name, "chiamate": s["n"], "totale_ms": round(s["total_ms"], 1),
+         "media_ms": round(s["total_ms"] / s["n"], 1), "max_ms": round(s["max_ms"], 1)}
+        for name, s in sorted(items, key=lambda kv: -kv[1]["total_ms"])
+    ]
+
+
+def reset():
+    with _LOCK:
+        _RUNS.clear()
+        _SPAN_STATS.clear()
@@ -0,0 +1,229 @@
+"""
+Normalizzazione locale (senza modello) del testo ricetta.
+
+Il testo che arriva da OCR / trascrizione contiene tabelle con ' | ', spazi
+doppi, righe ripetute. Qui lo si ripulisce e se ne ricava:
+    - clean:       testo canonico (righe pulite, senza duplicati)
+    - ingredients: ingredienti senza quantità (qualificativi mantenuti: "burro di malga")
+    - techniques:  tecniche riconosciute (vocabolario sotto)
+    - compact:     rappresentazione compatta da mettere nei prompt
+
+Le quantità servono in cucina, non nel testo del menu: il compatto le toglie
+dagli ingredienti ma lascia intatto il procedimento.
+"""
+import re
+import hashlib
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+
+# unità e quantità ("120 g", "1,5 kg", "q.b.", "2 cucchiai", "½")
+_UNITS = (
+    r"kg|g|gr|grammi|mg|l|lt|litri?|dl|cl|ml|cc|pz|pezzi|n\.?|"
+    r"cucchia(?:i|io|ini|ino)|tazz(?:a|e)|bicchier(?:e|i)|spicchi?o?|foglie?|rametti?o?|"
+    r"fett(?:a|e)|pizzic(?:o|hi)|mazzett(?:o|i)|"
+    r"bustin(?:a|e)|bust(?:a|e)|confezion(?:e|i)|pacc(?:o|hi)|panett(?:o|i)|vasett(?:o|i)|"
+    r"barattol(?:o|i)|scatol(?:a|e)|scatolett(?:a|e)|lattin(?:a|e)|manciat(?:a|e)|ciuff(?:o|i)|"
+    r"gocc(?:ia|e)|"
+    # "1 noce di burro" è una dose, "10 noci" no
+    r"noc(?:e|i)(?=\s+(?:di|d')\b)"
+)
+_NUM = r"(?:\d+(?:[.,]\d+)?(?:\s*[-–/]\s*\d+(?:[.,]\d+)?)?|[½¼¾⅓])"
+# quantità con unità (da togliere dal nome) e "q.b."
+_QTY = re.compile(
+    rf"(?<![\w.]){_NUM}\s*(?:{_UNITS})\b\.?|\bq\.?\s?b\.?(?!\w)|\bquanto basta\b",
+    re.IGNORECASE,
+)
+# conteggio senza unità a inizio o fine frammento ("2 uova", "limone 1")
+_COUNT = re.compile(rf"^\s*{_NUM}\s+(?=\D)|\s+{_NUM}\s*$")
+_TABLE_RULE = re.compile(r"^[\s|:+-]+$")          # righe separatrici tipo |---|---|
+_BULLET = re.compile(r"^\s*(?:[-*•·–]|\d+[.)])\s+")
+_SECTION = re.compile(r"^\s*(ingredienti|procedimento|preparazione|metodo|impiattamento)\s*:?\s*$", re.IGNORECASE)
+# etichetta a inizio riga ("Risotto: riso, burro", "Ingredienti: ..."): non fa parte del primo ingrediente
+_LABEL = re.compile(r"^\s*([^\W\d][^:,;.\d]{0,40}):\s+")
+_SPACES = re.compile(r"[ \t ]+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+(?=[A-ZÀ-Ú])")
+_FRAGMENT = re.compile(r"\s*[,;]\s*(?=\D)")
+_TABLE_HEADER = {"ingrediente", "ingredienti", "quantità", "quantita", "dose", "dosi", "qty", "note"}
+
+# radice -> tecnica canonica (si cercano le forme flesse: "mantecare", "mantecato", "mantecatura")
+TECHNIQUES = {
+    "mantec": "mantecatura",
+    "sbollent": "sbollentatura",
+    "bras": "brasatura",
+    "arrost": "arrostitura",
+    "rosol": "rosolatura",
+    "sfum": "sfumatura",
+    "glass": "glassatura",
+    "lacc": "laccatura",
+    "marin": "marinatura",
+    "affumic": "affumicatura",
+    "emulsion": "emulsione",
+    "grigli": "grigliatura",
+    "frigg": "frittura",
+    "fritt": "frittura",
+    "gratin": "gratinatura",
+    "stuf": "stufatura",
+    "less": "lessatura",
+    "scott": "scottatura",
+    "tost": "tostatura",
+    "ridu": "riduzione",
+    "confit": "confit",
+    "sottovuoto": "cottura sottovuoto",
+    "bassa temperatura": "cottura a bassa temperatura",
+    "vapore": "cottura a vapore",
+    "cartoccio": "cottura al cartoccio",
+    "fermentat": "fermentazione",
+    "disidrat": "disidratazione",
+    "caramell": "caramellatura",
+    "spadell": "spadellatura",
+    "fiamm": "fiammatura",
+    "crud": "crudo",
+}
+# solo a inizio parola; alcune radici sono brevi (less-, tost-) e vanno tenute strette
+_TECHNIQUE_RE = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(k) for k in TECHNIQUES), key=len, reverse=True)) + r")[a-zà-ù]*",
+    re.IGNORECASE,
+)
+# parole che iniziano come una tecnica ma non lo sono
+_TECHNIQUE_FALSE = {
+    "lessico", "crudele", "tosto", "marina", "marinara", "brasiliano", "brasiliana",
+    "frittata", "frittate", "frittella", "frittelle", "fiammifero",
+}
+
+
+@dataclass(frozen=True)
+class NormalizedRecipe:
+    clean: str
+    ingredients: tuple
+    techniques: tuple
+    compact: str
+    digest: str
+
+    def ingredients_text(self):
+        return ", ".join(self.ingredients)
+
+    def techniques_text(self):
+        return ", ".join(self.techniques)
+
+
+def clean_recipe(text: str) -> str:
+    """Testo canonico: unicode NFC, tabelle in righe con virgole, spazi compressi, righe doppie tolte."""
+    text = unicodedata.normalize("NFC", text or "").replace("\r\n", "\n").replace("\r", "\n")
+    lines, seen = [], set()
+    for raw in text.split("\n"):
+        if (_TABLE_RULE.match(raw) and "|" in raw) or (raw.strip() and set(raw.strip()) <= set("-_=*")):
+            continue
+        cells = [c.strip() for c in raw.strip().strip("|").split("|")]
+        line = ", ".join(c for c in cells if c)
+        line = _SPACES.sub(" ", line).strip(" ,;")
+        if not line:
+            continue
+        key = line.casefold()
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _fragments(clean: str):
+    """
+    (sezione, frase, [frammenti]) per ogni frase del testo pulito.
+    L'etichetta a inizio riga resta nella frase ma non nei frammenti; se è il
+    nome di una sezione ("Ingredienti: riso, burro") apre quella sezione.
+    """
+    section = None
+    for line in clean.split("\n"):
+        m = _SECTION.match(line)
+        if m:
+            section = m.group(1).lower()
+            continue
+        label = _LABEL.match(_BULLET.sub("", line))
+        if label:
+            m = _SECTION.match(label.group(1))
+            if m:
+                section = m.group(1).lower()
+        for i, sentence in enumerate(_SENTENCE.split(line)):
+            body = _BULLET.sub("", sentence)
+            if i == 0 and label:
+                body = body[label.end():]
+            yield section, sentence, _FRAGMENT.split(body.rstrip("."))
+
+
+def _is_quantity(fragment: str) -> bool:
+    # frasi di procedimento ("cuocere 2 minuti") non sono ingredienti: si guarda solo a frammenti brevi
+    return len(fragment.split()) <= 8 and bool(_QTY.search(fragment) or _COUNT.search(fragment))
+
+
+def _ingredient_name(fragment: str) -> str:
+    name = _BULLET.sub("", fragment)
+    name = _QTY.sub(" ", name)
+    name = _COUNT.sub(" ", _SPACES.sub(" ", name))
+    name = re.sub(r"\(\s*\)", " ", name)
+    name = re.sub(r"^\s*(?:di|d')\s+", "", _SPACES.sub(" ", name).strip(" ,;:.-"), flags=re.IGNORECASE)
+    return name.strip(" ,;:.-")
+
+
+def extract_ingredients(clean: str) -> list:
+    """
+    Ingredienti: frammenti brevi con una quantità (anche dentro il procedimento
+    scritto di seguito), più le voci elencate sotto un titolo "Ingredienti".
+    """
+    found, seen = [], set()
+    for section, _sentence, fragments in _fragments(clean):
+        in_list = section == "ingredienti"
+        if in_list and {f.strip().casefold() for f in fragments} <= _TABLE_HEADER:
+            continue  # intestazione di tabella
+        for fragment in fragments:
+            if not (in_list or _is_quantity(fragment)):
+                continue
+            name = _ingredient_name(fragment)
+            if name and len(name) <= 60 and name.casefold() not in seen | _TABLE_HEADER:
+                seen.add(name.casefold())
+                found.append(name)
+    return found
+
+
+def extract_techniques(clean: str) -> list:
+    found = []
+    for m in _TECHNIQUE_RE.finditer(clean):
+        if m.group(0).lower() in _TECHNIQUE_FALSE:
+            continue
+        canonical = TECHNIQUES[m.group(1).lower()]
+        if canonical not in found:
+            found.append(canonical)
+    return found
+
+
+def _procedure(clean: str) -> list:
+    """Frasi che non sono solo elenco ingredienti (né titoli di sezione)."""
+    return [
+        sentence for section, sentence, fragments in _fragments(clean)
+        if section != "ingredienti" and not all(_is_quantity(f) for f in fragments)
+    ]
+
+
+def recipe_digest(text: str) -> str:
+    return hashlib.sha256(clean_recipe(text).encode("utf-8")).hexdigest()[:16]
+
+
+def _compact(clean, ingredients):
+    # le tecniche restano nel procedimento, così come scritte: nessuna riga in più
+    compact = "\n".join(["Ingredienti: " + ", ".join(ingredients) + "."] + _procedure(clean))
+    # se l'estrazione non ha trovato nulla di utile, il testo pulito è già il più corto
+    return compact if len(compact) < len(clean) else clean
+
+
+@lru_cache(maxsize=256)
+def _normalize(digest, text):
+    clean = clean_recipe(text)
+    ingredients = tuple(extract_ingredients(clean))
+    techniques = tuple(extract_techniques(clean))
+    return NormalizedRecipe(clean, ingredients, techniques, _compact(clean, ingredients) if ingredients else clean, digest)
+
+
+def normalize_recipe(text: str) -> NormalizedRecipe:
+    """Ricetta normalizzata, memoizzata per hash del testo (stessa ricetta su più registri / lingue)."""
+    digest = hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+    return _normalize(digest, text or "")
@@ -0,0 +1,191 @@
+"""
+Cache condivisa di processo (tutte le sessioni Streamlit, API comprese).
+
+Un solo LRU con budget in byte (SHARED_CACHE_MB, default 256) diviso in namespace:
+    "archive"       piatti letti dall'archivio (chiave = firma dei file)
+    "files"         contenuto di file serviti in download (chiave = path + mtime)
+    "docx"          export DOCX
+    "cover_pdf"     PDF cover renderizzati
+    "cover_preview" anteprime PNG e miniature
+    "cover_cells"   file JPEG pronti per le celle della cover (path, passthrough)
+    "cover_background" background della cover preparati (path e risoluzione)
+    "model"         risultati del modello (testi generati, traduzioni)
+    "ocr"           testo estratto per pagina (chiave = hash dell'immagine)
+
+Quando il budget è superato si eliminano le voci usate meno di recente,
+indipendentemente dal namespace. Tiene anche un registro leggero della memoria
+occupata da ogni sessione (st.session_state), mostrato nella pagina Admin.
+"""
+import io
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+DEFAULT_BUDGET_MB = 256
+SESSION_TTL_S = 3600  # sessioni non viste da più di un'ora spariscono dal report
+
+
+def estimate_size(value, _depth=0):
+    """Stima (economica) dei byte occupati da un valore."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, io.BytesIO):  # anche UploadedFile di Streamlit
+        return value.getbuffer().nbytes
+    if hasattr(value, "size") and hasattr(value, "getbands"):  # PIL.Image
+        w, h = value.size
+        return w * h * len(value.getbands())
+    if _depth < 4:
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items()
+            )
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return sys.getsizeof(value) + sum(estimate_size(v, _depth + 1) for v in value)
+    return sys.getsizeof(value)
+
+
+class SharedCache:
+    """LRU thread-safe con budget in byte e statistiche per namespace."""
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # (namespace, key) -> (value, size)
+        self._building = {}          # (namespace, key) -> Lock (calcoli in corso)
+        self._bytes = 0
+        self._stats = {}
+
+    def _ns(self, namespace):
+        return self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "evictions": 0})
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                self._ns(namespace)["misses"] += 1
+                return default
+            self._data.move_to_end((namespace, key))
+            self._ns(namespace)["hits"] += 1
+            return entry[0]
+
+    def contains(self, namespace, key):
+        """True se la chiave è in cache (non tocca statistiche né ordine LRU)."""
+        with self._lock:
+            return (namespace, key) in self._data
+
+    def put(self, namespace, key, value, size=None):
+        size = estimate_size(value) if size is None else size
+        if size > self.budget:
+            return value  # troppo grande: non si tiene in cache
+        with self._lock:
+            old = self._data.pop((namespace, key), None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[(namespace, key)] = (value, size)
+            self._bytes += size
+            while self._bytes > self.budget and self._data:
+                (ns, _), (_, freed) = self._data.popitem(last=False)
+                self._bytes -= freed
+                self._ns(ns)["evictions"] += 1
+        return value
+
+    def get_or_create(self, namespace, key, factory, size=None):
+        """
+        Valore in cache oppure factory(). Sessioni che chiedono la stessa chiave
+        nello stesso momento aspettano un unico calcolo.
+        """
+        marker = object()
+        value = self.get(namespace, key, marker)
+        if value is not marker:
+            return value
+
+        full_key = (namespace, key)
+        with self._lock:
+            building = self._building.setdefault(full_key, threading.Lock())
+        with building:
+            with self._lock:
+                entry = self._data.get(full_key)
+            if entry is not None:
+                return entry[0]
+            try:
+                return self.put(namespace, key, factory(), size)
+            finally:
+                with self._lock:
+                    self._building.pop(full_key, None)
+
+    def invalidate(self, namespace=None, key=None):
+        """Elimina una voce, un namespace intero o (senza argomenti) tutto."""
+        with self._lock:
+            for full_key in list(self._data):
+                if (namespace is None or full_key[0] == namespace) and (key is None or full_key[1] == key):
+                    self._bytes -= self._data.pop(full_key)[1]
+
+    def stats(self):
+        """Per namespace: voci, byte, hit, miss, evictions. Più totale e budget."""
+        with self._lock:
+            per_ns = {ns: dict(s, entries=0, bytes=0) for ns, s in self._stats.items()}
+            for (ns, _), (_, size) in self._data.items():
+                row = per_ns.setdefault(ns, {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0})
+                row["entries"] += 1
+                row["bytes"] += size
+            return {"budget_bytes": self.budget, "used_bytes": self._bytes, "namespaces": per_ns}
+
+
+@lru_cache(maxsize=None)
+def get_cache():
+    budget_mb = float(os.getenv("SHARED_CACHE_MB", DEFAULT_BUDGET_MB))
+    return SharedCache(int(budget_mb * 1024 * 1024))
+
+
+def file_signature(path):
+    """(path assoluto, mtime, size) oppure None se il file non esiste."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def cached_file_bytes(path):
+    """Contenuto del file, condiviso tra sessioni finché il file non cambia."""
+    sig = file_signature(path)
+    if sig is None:
+        raise FileNotFoundError(path)
+
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+
+    return get_cache().get_or_create("files", sig, read)
+
+
+# =====================
+# Memoria per sessione (pagina Admin)
+# =====================
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def report_session(session_id, items):
+    """Registra la dimensione delle chiavi di session_state di una sessione (chiamata a ogni rerun)."""
+    sizes = {str(k): estimate_size(v) for k, v in items}
+    with _SESSIONS_LOCK:
+        _SESSIONS[session_id] = {"seen": time.time(), "sizes": sizes}
+
+
+def session_reports():
+    """Sessioni attive (viste nell'ultima ora), dalla più pesante."""
+    now = time.time()
+    with _SESSIONS_LOCK:
+        for sid in [s for s, r in _SESSIONS.items() if now - r["seen"] > SESSION_TTL_S]:
+            del _SESSIONS[sid]
+        reports = [
+            {"session_id": sid, "seen": r["seen"], "total_bytes": sum(r["sizes"].values()), "sizes": dict(r["sizes"])}
+            for sid, r in _SESSIONS.items()
+        ]
+    return sorted(reports, key=lambda r: r["total_bytes"], reverse=True)
@@ -0,0 +1,128 @@
+"""
+Generazione speculativa (opzionale) alla conferma della ricetta.
+
+Alla pressione di "Conferma Ricetta" si lanciano in background le generazioni
+per i registri / tipo / lunghezza attualmente impostati. Se al "Genera" i
+parametri coincidono, il testo è già pronto (o in arrivo); le speculazioni non
+usate vengono annullate (se non ancora partite) o scartate, e i loro token
+contano come spreco.
+
+Un solo pool di thread per processo (SPECULATION_WORKERS, default 4), stato
+per sessione, metriche globali mostrate nella pagina Admin.
+"""
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from ai_services import generate_output_detailed
+
+MAX_WORKERS = int(os.getenv("SPECULATION_WORKERS", "4"))
+
+
+def speculation_key(ricetta, registro, out_type, length):
+    digest = hashlib.sha256(ricetta.strip().encode("utf-8")).hexdigest()[:16]
+    return (digest, registro, out_type, length)
+
+
+class Speculator:
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self._pending = {}  # session_id -> {chiave: future}
+        self.metrics = {
+            "launched": 0,
+            "hits": 0,          # Genera servito da una speculazione
+            "misses": 0,        # Genera senza speculazione corrispondente
+            "cancelled": 0,     # annullate prima di partire
+            "discarded": 0,     # completate (o in corso) ma non usate
+            "used_tokens": 0,
+            "wasted_tokens": 0,
+            "saved_ms": 0.0,    # latenza del modello risparmiata sui hit
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.metrics[name] += value
+
+    def start(self, session_id, ricetta, registri, out_type, length):
+        """
+        Lancia le speculazioni della sessione. Quelle già in corso con gli stessi
+        parametri (doppia conferma) si tengono, le altre vengono scartate.
+        """
+        with self._lock:
+            previous = self._pending.pop(session_id, {})
+        jobs, launched = {}, 0
+        for registro in registri:
+            key = speculation_key(ricetta, registro, out_type, length)
+            if key in previous:
+                jobs[key] = previous.pop(key)
+                continue
+            future = self._pool.submit(generate_output_detailed, ricetta, registro, out_type, length)
+            jobs[key] = future
+            launched += 1
+        with self._lock:
+            self._pending[session_id] = jobs
+            self.metrics["launched"] += launched
+        self._drop(previous)
+
+    def take(self, session_id, ricetta, registro, out_type, length):
+        """
+        Testo speculato per questi parametri, atteso se ancora in corso.
+        None se non c'è (o se la speculazione è fallita): si genera normalmente.
+        """
+        key = speculation_key(ricetta, registro, out_type, length)
+        with self._lock:
+            future = self._pending.get(session_id, {}).pop(key, None)
+        if future is None:
+            self._count("misses")
+            return None
+
+        waited_from = time.perf_counter()
+        try:
+            result = future.result()
+        except Exception:
+            self._count("misses")
+            return None
+        # risparmio = latenza del modello meno l'attesa residua al momento del Genera
+        waited_ms = (time.perf_counter() - waited_from) * 1000
+        with self._lock:
+            self.metrics["hits"] += 1
+            self.metrics["used_tokens"] += result["usage"]["total_tokens"]
+            self.metrics["saved_ms"] += max(0.0, result["latency_ms"] - waited_ms)
+        return result["text"]
+
+    def discard(self, session_id):
+        """Annulla / scarta tutte le speculazioni non usate della sessione."""
+        with self._lock:
+            jobs = self._pending.pop(session_id, {})
+        self._drop(jobs)
+
+    def _drop(self, jobs):
+        for future in jobs.values():
+            if future.cancel():
+                self._count("cancelled")
+            else:
+                self._count("discarded")
+                future.add_done_callback(self._count_waste)
+
+    def _count_waste(self, future):
+        try:
+            self._count("wasted_tokens", future.result()["usage"]["total_tokens"])
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            m = dict(self.metrics)
+        served = m["hits"] + m["misses"]
+        m["hit_rate"] = round(m["hits"] / served, 3) if served else None
+        m["saved_ms"] = round(m["saved_ms"], 1)
+        return m
+
+
+@lru_cache(maxsize=None)
+def get_speculator():
+    return Speculator()
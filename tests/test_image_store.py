@@ -0,0 +1,28 @@
+import io
+import os
+
+import pandas as pd
+from PIL import Image
+
+from image_store import migrate_legacy
+
+
+def test_migrate_legacy_riscrive_l_archivio_indicato(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # l'archivio di default (relativo alla cwd) non deve essere toccato
+    root = tmp_path / "immagini"
+    root.mkdir()
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 30), "red").save(buf, "PNG")
+    (root / "1.png").write_bytes(buf.getvalue())
+
+    archive = tmp_path / "altro" / "archivio.xlsx"
+    archive.parent.mkdir()
+    # riga senza seriale, come in un Excel ritoccato a mano
+    pd.DataFrame({"seriale": [1, None], "immagine_path": ["1.png", ""]}).to_excel(archive, index=False)
+
+    assert migrate_legacy(str(root), archive_file=str(archive)) == 1
+    assert not (root / "1.png").exists()
+    df = pd.read_excel(archive)
+    assert df.loc[0, "immagine_path"].startswith("masters/")
+    assert os.path.exists(root / df.loc[0, "immagine_path"])
+    assert not os.path.exists("archivio_piatti.xlsx")
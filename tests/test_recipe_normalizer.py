@@ -0,0 +1,17 @@
+from recipe_normalizer import normalize_recipe
+
+
+def test_unita_di_confezione_non_diventano_ingredienti():
+    ricetta = "1 bustina di zafferano, 2 confezioni di panna, 1 vasetto di yogurt, 1 noce di burro, 10 noci"
+    assert normalize_recipe(ricetta).ingredients == ("zafferano", "panna", "yogurt", "burro", "noci")
+
+
+def test_etichetta_iniziale_non_entra_nel_primo_ingrediente():
+    assert normalize_recipe("Risotto: riso 300 g, burro 40 g").ingredients == ("riso", "burro")
+
+
+def test_etichetta_ingredienti_apre_la_sezione():
+    ricetta = "Ingredienti: riso, burro\nProcedimento: tostare il riso 2 minuti."
+    norm = normalize_recipe(ricetta)
+    assert norm.ingredients == ("riso", "burro")
+    assert "Procedimento: tostare il riso 2 minuti." in norm.compact
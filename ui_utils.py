@@ -0,0 +1,13 @@
+"""
+Aiuti Streamlit condivisi tra app.py e le pagine in modules_cover/.
+"""
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+
+
+def rerun_fragment():
+    """Rerun del solo frammento; se il frammento sta girando dentro un rerun completo, rerun completo."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()